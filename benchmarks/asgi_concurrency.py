@@ -0,0 +1,139 @@
+"""
+Sync vs async serving benchmark
+
+Starts the Flask service (service:app on gunicorn sync workers) and the ASGI
+service (service.asgi:app on uvicorn workers) as separate servers, measures
+the resident memory of each server's process tree, and drives both at
+rising client concurrency. The report gives requests per second, latency
+percentiles and requests per second per 100 MB of RSS, so the two modes can
+be compared at equal memory.
+
+    python -m benchmarks.asgi_concurrency --sync-workers 4 --async-workers 1 \\
+        --concurrency 8,32,128 --duration 10
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import subprocess
+import http.client
+
+from benchmarks.support import seed, item_ids, git_commit
+from benchmarks.load import ENDPOINTS, run_endpoint
+from service.models import db
+
+
+def free_port() -> int:
+    """Returns a TCP port that is free right now"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(port: int, timeout: float = 30.0):
+    """Waits until the server answers GET /inventory?limit=1"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/inventory?limit=1")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server on port {} did not start".format(port))
+
+
+def tree_rss_mb(pid: int) -> float:
+    """Returns the resident memory of a process and its children in MB"""
+    total_kb = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open("/proc/{}/status".format(current), encoding="utf-8") as status_file:
+                for line in status_file:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+            for task in os.listdir("/proc/{}/task".format(current)):
+                children = "/proc/{}/task/{}/children".format(current, task)
+                with open(children, encoding="utf-8") as children_file:
+                    pending.extend(int(child) for child in children_file.read().split())
+        except OSError:
+            continue
+    return round(total_kb / 1024, 1)
+
+
+def server_command(mode: str, port: int, workers: int) -> list:
+    """Returns the command that starts the server for a serving mode"""
+    bind = "127.0.0.1:{}".format(port)
+    if mode == "sync":
+        return [sys.executable, "-m", "gunicorn", "--workers", str(workers),
+                "--worker-class", "sync", "--bind", bind, "service:app"]
+    return [sys.executable, "-m", "uvicorn", "--workers", str(workers),
+            "--port", str(port), "--log-level", "warning", "service.asgi:app"]
+
+
+def benchmark_mode(mode, workers, ids, levels, endpoints, duration) -> dict:
+    """Runs every endpoint at every concurrency level against one server"""
+    port = free_port()
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        server_command(mode, port, workers),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port)
+        base_url = "http://127.0.0.1:{}".format(port)
+        result = {"workers": workers, "runs": []}
+        for concurrency in levels:
+            for name in endpoints:
+                print("  {} c={} {} ...".format(mode, concurrency, name), file=sys.stderr)
+                stats = run_endpoint(base_url, ENDPOINTS[name], ids, concurrency, duration)
+                stats.update(endpoint=name, concurrency=concurrency)
+                result["runs"].append(stats)
+        result["rss_mb"] = tree_rss_mb(server.pid)
+        for stats in result["runs"]:
+            stats["rps_per_100mb"] = round(stats["rps"] * 100 / result["rss_mb"], 1)
+        return result
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    """Runs the comparison and prints the report as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--sync-workers", type=int, default=4)
+    parser.add_argument("--async-workers", type=int, default=1)
+    parser.add_argument("--concurrency", default="8,32,128")
+    parser.add_argument("--endpoints", default="get_item,list_page")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    seed(args.items, exact=True)
+    ids = item_ids()
+    db.session.remove()
+    levels = [int(value) for value in args.concurrency.split(",")]
+    endpoints = args.endpoints.split(",")
+    report = {
+        "benchmark": "asgi_concurrency",
+        "commit": git_commit(),
+        "database": db.engine.dialect.name,
+        "items": args.items,
+        "sync": benchmark_mode("sync", args.sync_workers, ids, levels, endpoints, args.duration),
+        "async": benchmark_mode("async", args.async_workers, ids, levels, endpoints, args.duration),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Response encoding benchmark
+
+Encodes one list response of Items with every body encoding the service can
+negotiate (JSON or MessagePack, each uncompressed and with every available
+Content-Encoding) and prints the bytes and the CPU time per request as JSON.
+
+    python -m benchmarks.encoding --rows 10000 --repeat 5
+"""
+import json
+import time
+import argparse
+
+from benchmarks.support import seed, git_commit
+from service import app, json_backend, msgpack_backend, compression
+from service.models import Items, db
+
+BODY_ENCODERS = {
+    "json": json_backend.dumps,
+    "msgpack": msgpack_backend.dumps,
+}
+
+
+def cpu_time(repeat: int, func) -> float:
+    """Returns the lowest CPU time of repeat calls to func"""
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        timings.append(time.process_time() - start)
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows)
+        data = Items.serialize_rows(Items.query.order_by(Items.id).limit(args.rows))
+        runs = []
+        for body_name, encode in BODY_ENCODERS.items():
+            body = encode(data)
+            encode_seconds = cpu_time(args.repeat, lambda encode=encode: encode(data))
+            runs.append({
+                "encoding": body_name,
+                "bytes": len(body),
+                "cpu_ms": round(encode_seconds * 1000, 2),
+            })
+            for name, compress in compression.ENCODERS.items():
+                compressed = compress(body, app.config)
+                seconds = cpu_time(
+                    args.repeat, lambda compress=compress, body=body: compress(body, app.config)
+                )
+                runs.append({
+                    "encoding": "{}+{}".format(body_name, name),
+                    "bytes": len(compressed),
+                    "cpu_ms": round((encode_seconds + seconds) * 1000, 2),
+                })
+        report = {
+            "benchmark": "encoding",
+            "commit": git_commit(),
+            "rows": args.rows,
+            "database": db.engine.dialect.name,
+            "json_backend": json_backend.backend_name(),
+            "msgpack_backend": msgpack_backend.backend_name(),
+            "compress_level": app.config["COMPRESS_LEVEL"],
+            "runs": runs,
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
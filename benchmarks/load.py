@@ -0,0 +1,212 @@
+"""
+Load test for the Inventory API
+
+Seeds the database with ItemFactory at each scale, drives every endpoint in
+service/routes.py from a pool of keep-alive client threads and prints the
+p50/p95/p99 latency and requests per second of each endpoint as JSON.
+
+Only 2xx and 3xx responses count as requests. Every other response or
+connection failure is an error, and 4xx responses (e.g. a 409 or 429) are
+also reported on their own as client_errors, so an endpoint that is
+rejected quickly never looks fast.
+
+By default the service runs in-process on a threaded werkzeug server. Pass
+--url to load test a server that is already running (e.g. gunicorn), in which
+case it must use the same DATABASE_URI so the seeding reaches it.
+
+    python -m benchmarks.load --scales 1000,100000,1000000 --output load.json
+    python -m benchmarks.load --url http://localhost:8000 --concurrency 16
+"""
+import sys
+import json
+import logging
+import time
+import random
+import argparse
+import threading
+import http.client
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+from benchmarks.support import seed, item_ids, summarize, git_commit
+from service import app
+from service.models import db
+from tests.factories import ItemFactory
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+
+def new_item_body() -> str:
+    """Returns the JSON body of a new random Item"""
+    item = ItemFactory.build()
+    data = item.serialize()
+    del data["id"], data["version"]
+    return json.dumps(data)
+
+
+######################################################################
+#  E N D P O I N T S
+######################################################################
+# Each endpoint returns (method, path, body) for one request given the ids
+# of existing Items. Writes only touch a random existing Item so the table
+# size stays close to the seeded scale.
+ENDPOINTS = {
+    "list_page": lambda ids: ("GET", "/inventory?limit=100", None),
+    "list_page_after": lambda ids: (
+        "GET", "/inventory?limit=100&after={}".format(random.choice(ids)), None
+    ),
+    "list_category": lambda ids: ("GET", "/inventory?category=shirt", None),
+    "list_name": lambda ids: ("GET", "/inventory?name=blue%20shirt", None),
+    "list_all": lambda ids: ("GET", "/inventory", None),
+    "get_item": lambda ids: ("GET", "/inventory/{}".format(random.choice(ids)), None),
+    "create_item": lambda ids: ("POST", "/inventory", new_item_body()),
+    "update_item": lambda ids: (
+        "PUT", "/inventory/{}".format(random.choice(ids)), new_item_body()
+    ),
+    "adjust_item": lambda ids: (
+        "POST", "/inventory/{}/adjust".format(random.choice(ids)),
+        json.dumps({"delta": 1}),
+    ),
+    "disable_item": lambda ids: (
+        "PUT", "/inventory/{}/disable".format(random.choice(ids)), None
+    ),
+    "batch_update": lambda ids: (
+        "POST", "/inventory:batch",
+        json.dumps([
+            {"op": "update", "id": random.choice(ids), "item": json.loads(new_item_body())}
+            for _ in range(50)
+        ]),
+    ),
+}
+
+# Full table scans are opt-in: at a million rows one request returns them all
+FULL_SCANS = ("list_all", "list_category", "list_name")
+DEFAULT_ENDPOINTS = [name for name in ENDPOINTS if name not in FULL_SCANS]
+
+
+######################################################################
+#  L O A D   G E N E R A T O R
+######################################################################
+def client_worker(base_url, endpoint, ids, deadline, results, lock):
+    """Sends requests on one keep-alive connection until the deadline"""
+    parts = urlsplit(base_url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    latencies, errors, client_errors = [], 0, 0
+    while time.perf_counter() < deadline:
+        method, path, body = endpoint(ids)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=JSON_HEADERS)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+                client_errors += response.status < 500
+                continue
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+            continue
+        latencies.append(time.perf_counter() - start)
+    connection.close()
+    with lock:
+        results["latencies"].extend(latencies)
+        results["errors"] += errors
+        results["client_errors"] += client_errors
+
+
+def run_endpoint(base_url, endpoint, ids, concurrency, duration) -> dict:
+    """Drives one endpoint from concurrency threads for duration seconds"""
+    results = {"latencies": [], "errors": 0, "client_errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(
+            target=client_worker,
+            args=(base_url, endpoint, ids, deadline, results, lock),
+        )
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    summary = summarize(results["latencies"], elapsed, results["errors"])
+    summary["client_errors"] = results["client_errors"]
+    return summary
+
+
+def start_local_server():
+    """Starts the app on a threaded werkzeug server and returns its URL"""
+    from werkzeug.serving import make_server  # pylint: disable=import-outside-toplevel
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)  # no access log
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return "http://127.0.0.1:{}".format(server.server_port), server
+
+
+######################################################################
+#  M A I N
+######################################################################
+def main():
+    """Runs the load test at each scale and prints the report as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scales", default="1000,100000",
+                        help="comma separated table sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--endpoints", default=",".join(DEFAULT_ENDPOINTS),
+                        help="comma separated endpoints: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds to drive each endpoint")
+    parser.add_argument("--url", help="load test this running server instead")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in endpoints if name not in ENDPOINTS]
+    if unknown:
+        parser.error("unknown endpoints: " + ", ".join(unknown))
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        base_url, server = start_local_server()
+
+    report = {
+        "benchmark": "load",
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "database": db.engine.dialect.name,
+        "concurrency": args.concurrency,
+        "duration_seconds": args.duration,
+        "scales": [],
+    }
+    for scale in [int(value) for value in args.scales.split(",")]:
+        print("Seeding {} items...".format(scale), file=sys.stderr)
+        seed(scale, exact=True)
+        ids = item_ids()
+        db.session.remove()
+        result = {"items": scale, "endpoints": {}}
+        for name in endpoints:
+            print("  {} ...".format(name), file=sys.stderr)
+            result["endpoints"][name] = run_endpoint(
+                base_url, ENDPOINTS[name], ids, args.concurrency, args.duration
+            )
+        report["scales"].append(result)
+
+    if server:
+        server.shutdown()
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Typeahead search benchmark
+
+Seeds the items table and times GET /inventory/search for the prefixes a
+user types letter by letter, printing the latency percentiles as JSON.
+Run it against PostgreSQL (DATABASE_URI) to measure the index backends and
+against the default SQLite database to measure the in-process trie.
+
+    python -m benchmarks.search --rows 1000000 --repeat 20
+"""
+import json
+import time
+import argparse
+
+from benchmarks.support import seed, summarize, git_commit
+from service import app, search
+from service.models import db
+
+QUERIES = ("s", "sh", "shi", "shir", "shirt", "blue sh", "shrit")
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    with app.app_context():
+        seed(args.rows)
+        search.create_indexes(db.engine)
+        backend = search.backend_name(db.engine)
+        client.get("/inventory/search?q=warmup")  # builds the trie on SQLite
+        runs = []
+        for query in QUERIES:
+            latencies = []
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                resp = client.get("/inventory/search", query_string={
+                    "q": query, "limit": args.limit,
+                })
+                latencies.append(time.perf_counter() - start)
+            runs.append(dict(summarize(latencies, time.perf_counter() - started),
+                             query=query, results=len(resp.get_json())))
+        report = {
+            "benchmark": "search",
+            "commit": git_commit(),
+            "rows": args.rows,
+            "database": db.engine.dialect.name,
+            "backend": backend,
+            "runs": runs,
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
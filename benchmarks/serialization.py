@@ -0,0 +1,55 @@
+"""
+Serialization microbenchmark
+
+Compares the original list path (hydrate ORM objects, serialize() each one,
+encode with the stdlib json module) against the fast path (select column
+tuples with Items.serialize_rows and encode with the json_backend) and prints
+the timings as JSON.
+
+    python -m benchmarks.serialization --rows 100000 --repeat 3
+"""
+import json
+import argparse
+
+from benchmarks.support import seed, best_of
+from service import app, json_backend
+from service.models import Items, db
+
+
+def orm_stdlib(rows: int) -> bytes:
+    """The original list path: ORM objects and the stdlib encoder"""
+    results = [item.serialize() for item in Items.query.order_by(Items.id).limit(rows)]
+    return json.dumps(results).encode("utf-8")
+
+
+def rows_fast(rows: int) -> bytes:
+    """The fast list path: column tuples and the selected JSON backend"""
+    results = Items.serialize_rows(Items.query.order_by(Items.id).limit(rows))
+    return json_backend.dumps(results)
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.rows)
+        baseline = best_of(args.repeat, lambda: orm_stdlib(args.rows))
+        fast = best_of(args.repeat, lambda: rows_fast(args.rows))
+    report = {
+        "benchmark": "serialization",
+        "rows": args.rows,
+        "database": db.engine.dialect.name,
+        "json_backend": json_backend.backend_name(),
+        "orm_stdlib_seconds": round(baseline, 4),
+        "rows_fast_seconds": round(fast, 4),
+        "speedup": round(baseline / fast, 2) if fast else None,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
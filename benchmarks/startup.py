@@ -0,0 +1,81 @@
+"""
+Startup time benchmark
+
+Starts fresh Python processes that import the service, create the app and
+serve their first request (GET /inventory?limit=1 through the test client),
+and reports the import-to-first-request latency split into its phases. The
+same is measured with an unreachable database, where creating the app must
+still succeed and only the first request fails.
+
+    python -m benchmarks.startup --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.support import git_commit
+from service.models import db
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import service
+imported = time.perf_counter()
+app = service.create_app()
+created = time.perf_counter()
+status = app.test_client().get("/inventory?limit=1").status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "total_ms": (served - start) * 1000,
+    "status": status,
+}))
+"""
+UNREACHABLE_URI = "postgresql://nobody@127.0.0.1:1/unreachable"
+
+
+def run_child(database_uri: str) -> dict:
+    """Measures one cold start in a new interpreter"""
+    env = dict(os.environ, DATABASE_URI=database_uri, DB_POOL_TIMEOUT="1")
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize_runs(runs: list) -> dict:
+    """Returns the median of every phase over the runs"""
+    summary = {
+        key: round(statistics.median(run[key] for run in runs), 1)
+        for key in ("import_ms", "create_app_ms", "first_request_ms", "total_ms")
+    }
+    summary["statuses"] = sorted({run["status"] for run in runs})
+    return summary
+
+
+def main():
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    database_uri = os.environ["DATABASE_URI"]
+    report = {
+        "benchmark": "startup",
+        "commit": git_commit(),
+        "database": db.engine.dialect.name,
+        "runs": args.runs,
+        "reachable": summarize_runs([run_child(database_uri) for _ in range(args.runs)]),
+        "unreachable": summarize_runs([run_child(UNREACHABLE_URI) for _ in range(args.runs)]),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
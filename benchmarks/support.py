@@ -0,0 +1,83 @@
+"""
+Shared helpers for the benchmarks: seeding, timing and reporting
+"""
+import os
+import time
+import subprocess
+
+os.environ.setdefault("DATABASE_URI", "sqlite:////tmp/inventory-bench.db")
+
+# pylint: disable=wrong-import-position
+from service import app  # noqa: E402
+from service.models import Items, db, init_db  # noqa: E402
+from tests.factories import ItemFactory  # noqa: E402
+
+init_db(app)  # the benchmarks create their own tables and share one app context
+
+
+def seed(rows: int, chunk: int = 10000, exact: bool = False):
+    """Makes sure the items table holds at least (or exactly) rows Items
+
+    Rows are generated with ItemFactory and written with multi-row INSERTs
+    so seeding a million Items takes seconds rather than hours.
+    """
+    if exact:
+        db.session.query(Items).delete()
+        db.session.commit()
+    missing = rows - Items.query.count()
+    while missing > 0:
+        size = min(chunk, missing)
+        values = [ItemFactory.build().to_row() for _ in range(size)]
+        db.session.execute(Items.__table__.insert(), values)
+        db.session.commit()
+        missing -= size
+
+
+def item_ids(limit: int = 10000) -> list:
+    """Returns up to limit existing Item ids to aim requests at"""
+    return [row.id for row in db.session.query(Items.id).order_by(Items.id).limit(limit)]
+
+
+def percentile(samples: list, fraction: float) -> float:
+    """Returns the nearest-rank percentile of already sorted samples"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def summarize(latencies: list, elapsed: float, errors: int = 0) -> dict:
+    """Returns latency percentiles in milliseconds and requests per second"""
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "rps": round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def best_of(repeat: int, func) -> float:
+    """Returns the fastest wall clock time of repeat calls to func"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        db.session.remove()
+    return min(timings)
+
+
+def git_commit() -> str:
+    """Returns the current git commit so reports can be compared across commits"""
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        )
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
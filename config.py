@@ -19,7 +19,149 @@ if 'VCAP_SERVICES' in os.environ:
 # Configure SQLAlchemy
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
-SQLALCHEMY_POOL_SIZE = 2
+
+# Optional read replicas: GET traffic is spread round-robin across them
+DATABASE_READ_URIS = [
+    uri.strip() for uri in os.getenv("DATABASE_READ_URIS", "").split(",") if uri.strip()
+]
+SQLALCHEMY_READ_BINDS = [
+    "read_replica_{}".format(index) for index in range(len(DATABASE_READ_URIS))
+]
+SQLALCHEMY_BINDS = dict(zip(SQLALCHEMY_READ_BINDS, DATABASE_READ_URIS))
+# seconds a client keeps reading from the primary after it wrote
+DB_READ_AFTER_WRITE_SECONDS = int(os.getenv("DB_READ_AFTER_WRITE_SECONDS", "5"))
+
+# Connection pool tuning (per worker process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "2"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "0"))  # ms, 0 = none
+
+SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": DB_POOL_PRE_PING}
+if DATABASE_URI.startswith("postgres"):
+    SQLALCHEMY_ENGINE_OPTIONS.update(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    if DB_STATEMENT_TIMEOUT:
+        SQLALCHEMY_ENGINE_OPTIONS["connect_args"] = {
+            "options": "-c statement_timeout={}".format(DB_STATEMENT_TIMEOUT)
+        }
+
+# Pagination and streaming of large item lists
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Batch endpoint: most operations accepted in one request (413 above it)
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "1000"))
+
+# Bulk import: Items inserted per transaction and row errors reported in full
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+# Keep a per category and condition summary table up to date on every write
+SUMMARY_TABLE_ENABLED = os.getenv("SUMMARY_TABLE_ENABLED", "false").lower() == "true"
+
+# Stock levels: the location that holds an Item's stock from before it was
+# tracked per location, and that quantity adjustments are applied to
+STOCK_DEFAULT_LOCATION = os.getenv("STOCK_DEFAULT_LOCATION", "default")
+
+# Typeahead name search: result limits, and how long the in-process trie used
+# on databases without a search index (e.g. SQLite) may be reused
+SEARCH_DEFAULT_LIMIT = int(os.getenv("SEARCH_DEFAULT_LIMIT", "10"))
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", "100"))
+SEARCH_TRIE_TTL = float(os.getenv("SEARCH_TRIE_TTL", "30"))
+
+# Append-only change log of Item writes, served on GET /inventory/changes
+CHANGE_LOG_ENABLED = os.getenv("CHANGE_LOG_ENABLED", "true").lower() == "true"
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "1.0"))  # seconds
+CHANGE_MAX_WAIT = int(os.getenv("CHANGE_MAX_WAIT", "30"))  # long-poll seconds
+CHANGE_STREAM_TIMEOUT = int(os.getenv("CHANGE_STREAM_TIMEOUT", "300"))  # SSE seconds
+# long-polls and SSE streams each hold a worker thread: at most this many at once
+# per process (raise it with an async or gevent worker)
+CHANGE_MAX_STREAMS = int(os.getenv("CHANGE_MAX_STREAMS", "2"))
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", "7"))  # 0 keeps all
+
+# Stock reservations: hold lengths in seconds, and the background expiry sweep
+# (every RESERVATION_SWEEP_INTERVAL seconds, 0 to disable, in batches)
+RESERVATION_DEFAULT_TTL = int(os.getenv("RESERVATION_DEFAULT_TTL", "300"))
+RESERVATION_MAX_TTL = int(os.getenv("RESERVATION_MAX_TTL", "3600"))
+RESERVATION_SWEEP_INTERVAL = float(os.getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", "500"))
+
+# Idempotency-Key support for writes: how long a stored response is replayed,
+# and how long a claimed key stays locked if its request never finishes
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "60"))
+
+# Read-through item cache (set CACHE_REDIS_URL to share it between workers)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 2 ** 20)))  # in-process cache only
+# worker processes serving the app; with more than one and no shared cache,
+# each worker's in-process entries live CACHE_LOCAL_TTL seconds (0 disables it)
+CACHE_WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "30"))
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", "2"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+# a bound Redis service on Cloud Foundry (see manifest.yml) shares the cache
+if not CACHE_REDIS_URL and 'VCAP_SERVICES' in os.environ:
+    for service in (entry for entries in vcap.values() for entry in entries):
+        if "redis" in (service.get("label", "") + service.get("name", "")).lower():
+            credentials = service.get("credentials", {})
+            CACHE_REDIS_URL = credentials.get("uri") or credentials.get("url")
+            break
+
+# JSON encoder for list responses: auto (orjson if installed), orjson or stdlib
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto")
+
+# Compression of response bodies negotiated through Accept-Encoding
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "true").lower() == "true"
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))  # bytes
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))  # gzip and deflate, 1-9
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))  # 0-11
+
+# Readiness probe: GET /ready fails above these limits
+READY_MAX_LATENCY_MS = float(os.getenv("READY_MAX_LATENCY_MS", "500"))
+READY_MAX_POOL_UTILISATION = float(os.getenv("READY_MAX_POOL_UTILISATION", "0.9"))
+READY_LATENCY_WINDOW = float(os.getenv("READY_LATENCY_WINDOW", "30"))  # seconds, reported only
+
+# Per-client token bucket rate limiting: tokens refilled per second, bucket
+# size, and per endpoint costs as JSON (e.g. {"list_items": 5}, see throttling.py).
+# Rate and burst are totals for the service, split between the CACHE_WORKERS
+# worker processes since every worker keeps its own buckets
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE", "20"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "100"))
+RATE_LIMIT_COSTS = json.loads(os.getenv("RATE_LIMIT_COSTS", "{}"))
+RATE_LIMIT_KEY_HEADER = os.getenv("RATE_LIMIT_KEY_HEADER", "X-API-Key")
+# comma separated API keys that get their own bucket; other clients are keyed by address
+RATE_LIMIT_API_KEYS = frozenset(
+    key.strip() for key in os.getenv("RATE_LIMIT_API_KEYS", "").split(",") if key.strip()
+)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+# Number of trusted reverse proxies in front of the app whose X-Forwarded-For
+# and X-Forwarded-Proto are applied to the request (0 trusts none)
+PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", "0"))
+PROXY_FIX_X_PROTO = int(os.getenv("PROXY_FIX_X_PROTO", "0"))
+
+# Load shedding: answer 503 at once while pool checkouts queue too long,
+# judged on at least LOAD_SHED_MIN_SAMPLES checkouts in the window
+LOAD_SHED_ENABLED = os.getenv("LOAD_SHED_ENABLED", "false").lower() == "true"
+LOAD_SHED_MAX_POOL_WAIT_MS = float(os.getenv("LOAD_SHED_MAX_POOL_WAIT_MS", "250"))
+LOAD_SHED_WINDOW = float(os.getenv("LOAD_SHED_WINDOW", "5"))  # seconds
+LOAD_SHED_MIN_SAMPLES = int(os.getenv("LOAD_SHED_MIN_SAMPLES", "20"))
+
+# Per-request timing, SQL counters and the Prometheus /metrics endpoint
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() == "true"
 
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "sup3r-s3cr3t")
@@ -15,15 +15,13 @@ from compare import expect
 def step_impl(context):
     """ Delete all Items and load new ones """
     headers = {'Content-Type': 'application/json'}
-    # list all of the items and delete them one by one
+    batch_url = context.base_url + '/inventory:batch'
+    # list all of the items and delete them in a single batch
     context.resp = requests.get(context.base_url + '/inventory', headers=headers)
     expect(context.resp.status_code).to_equal(200)
-    for item in context.resp.json():
-        context.resp = requests.delete(context.base_url + '/inventory/' + str(item["id"]), headers=headers)
-        expect(context.resp.status_code).to_equal(204)
-    
-    # load the database with new items
-    create_url = context.base_url + '/inventory'
+    operations = [{"op": "delete", "id": item["id"]} for item in context.resp.json()]
+
+    # load the database with new items in the same batch
     for row in context.table:
         data = {
             "name": row['name'],
@@ -31,6 +29,9 @@ def step_impl(context):
             "quantity": int(row['quantity']),
             "condition": row['condition']
         }
-        payload = json.dumps(data)
-        context.resp = requests.post(create_url, data=payload, headers=headers)
-        expect(context.resp.status_code).to_equal(201)
\ No newline at end of file
+        operations.append({"op": "create", "item": data})
+    payload = json.dumps(operations)
+    context.resp = requests.post(batch_url, data=payload, headers=headers)
+    expect(context.resp.status_code).to_equal(200)
+    for result in context.resp.json():
+        expect(["created", "deleted"]).to_contain(result["result"])
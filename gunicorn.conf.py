@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for the Inventory service
+
+Every setting can be overridden from the environment:
+
+    WEB_CONCURRENCY  - number of worker processes (default: 2 x CPUs + 1)
+    GUNICORN_THREADS - threads per worker for the gthread worker (default: 4)
+    GUNICORN_WORKER_CLASS - sync, gthread or gevent (default: gthread)
+    GUNICORN_PRELOAD - load the app once in the master before forking
+    GUNICORN_TIMEOUT - seconds before a silent worker is restarted
+
+Each worker gets its own SQLAlchemy engine and connection pool, so the
+database sees at most workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections.
+"""
+import os
+import sys
+import multiprocessing
+
+bind = "0.0.0.0:{}".format(os.getenv("PORT", "8000"))
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+os.environ["WEB_CONCURRENCY"] = str(workers)  # tells the app (see CACHE_WORKERS)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "100"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+accesslog = "-"
+errorlog = "-"
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives each worker its own database connections after the fork"""
+    if worker_class == "gevent":
+        try:
+            from psycogreen.gevent import patch_psycopg  # pylint: disable=import-outside-toplevel
+
+            patch_psycopg()
+        except ImportError:
+            server.log.warning("psycogreen is not installed: psycopg2 calls will block gevent")
+    if "service" not in sys.modules:
+        return  # the app is not preloaded, the worker opens its own engine
+    from service import app  # pylint: disable=import-outside-toplevel
+    from service.models import db  # pylint: disable=import-outside-toplevel
+
+    with app.app_context():
+        try:
+            # leave the parent's connections open for the parent to use
+            db.engine.dispose(close=False)
+        except TypeError:  # SQLAlchemy < 1.4.33
+            db.engine.pool = db.engine.pool.recreate()
+    server.log.info("Worker %s reset its database pool after fork", worker.pid)
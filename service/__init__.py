@@ -1,25 +1,71 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+
+create_app() creates and configures the Flask app and sets up the logging
+and SQL database. It does no database work: connections are opened on first
+use and the tables are created by the `flask create-db` step.
+
+The module level `app` used by `service:app` is created on first access.
 """
-import sys
 import logging
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+
+def create_app(config=None) -> Flask:
+    """Creates and configures an instance of the Inventory service
+
+    :param config: settings applied over config.py, as a dict or as an
+        object or import path for from_object()
+
+    :return: the Flask app
+    :rtype: Flask
 
-# Create Flask application
-app = Flask(__name__)
-app.config.from_object("config")
+    """
+    # Create Flask application
+    app = Flask(__name__)
+    app.config.from_object("config")
+    if isinstance(config, dict):
+        app.config.from_mapping(config)
+    elif config is not None:
+        app.config.from_object(config)
 
-# Import the routes After the Flask app is created
-# pylint: disable=wrong-import-position, cyclic-import
-from service import routes, models, error_handlers
+    if app.config.get("PROXY_FIX_X_FOR") or app.config.get("PROXY_FIX_X_PROTO"):
+        # client addresses (e.g. for rate limiting) come from the trusted proxies
+        app.wsgi_app = ProxyFix(
+            app.wsgi_app,
+            x_for=app.config.get("PROXY_FIX_X_FOR", 0),
+            x_proto=app.config.get("PROXY_FIX_X_PROTO", 0),
+        )
 
-# Set up logging for production
-print("Setting up logging for {}...".format(__name__))
-app.logger.propagate = False
-if __name__ != "__main__":
+    # pylint: disable=import-outside-toplevel, cyclic-import
+    from service import routes, models, error_handlers, commands, metrics, routing, compression
+    from service import sweeper, search, throttling
+
+    app.register_blueprint(routes.api)
+    app.register_blueprint(error_handlers.errors)
+    models.init_app(app)
+    commands.init_app(app)
+    metrics.init_app(app)
+    routing.init_app(app, models.db)
+    compression.init_app(app)
+    throttling.init_app(app)
+    sweeper.init_app(app)
+    search.init_app(app)
+
+    setup_logging(app)
+    app.logger.info(70 * "*")
+    app.logger.info("  I T E M   S T O R E   S E R V I C E  ".center(70, "*"))
+    app.logger.info(70 * "*")
+    app.logger.info("Service initialized!")
+    return app
+
+
+def setup_logging(app: Flask):
+    """Sends the app logs to gunicorn's handlers in a consistent format"""
+    print("Setting up logging for {}...".format(__name__))
+    app.logger.propagate = False
     gunicorn_logger = logging.getLogger("gunicorn.error")
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
@@ -31,15 +77,10 @@ if __name__ != "__main__":
         handler.setFormatter(formatter)
     app.logger.info("Logging handler established")
 
-app.logger.info(70 * "*")
-app.logger.info("  I T E M   S T O R E   S E R V I C E  ".center(70, "*"))
-app.logger.info(70 * "*")
-
-try:
-    models.init_db(app)  # make our sqlalchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
 
-app.logger.info("Service initialized!")
+def __getattr__(name):
+    """Creates the module level app the first time it is imported"""
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
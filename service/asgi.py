@@ -0,0 +1,442 @@
+"""
+Module: asgi
+
+Async (ASGI) entry point for the Inventory service
+
+Serves the core Item routes with an async database driver (asyncpg for
+PostgreSQL, aiosqlite for SQLite) and async SQLAlchemy sessions, so a waiting
+request holds neither a worker nor a database connection:
+
+    uvicorn service.asgi:app --port 8000
+    gunicorn -k uvicorn.workers.UvicornWorker service.asgi:app
+
+Paths:
+------
+GET /inventory - Returns the Items matching the list filters (see routes.py)
+GET /inventory/{id} - Returns the Item with a given id number
+POST /inventory - creates a new Item record in the database
+PUT /inventory/{id} - updates a Item record in the database
+DELETE /inventory/{id} - deletes a Item record in the database
+PUT /inventory/{id}/disable - sets the quantity (and stock levels) of an Item to zero
+
+Validation is shared with the Flask service through Items.deserialize and
+Items.filter_criteria, and responses use the same JSON shapes. Single Items
+carry the same ETags: GET answers If-None-Match with 304 and PUT checks
+If-Match (see routes.item_etag and compression.etag_matches).
+
+This is a limited serving mode for the core read and write paths. Writes
+with an Idempotency-Key are refused with 501 rather than risk applying a
+retried write twice; send those, and every other route (batch, import,
+export, reservations, stock levels, changes, search), to the Flask service.
+"""
+import re
+import json
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from werkzeug.http import parse_etags, quote_etag
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import StaleDataError
+from service import app as flask_app  # loads the config (run flask create-db for the schema)
+from service import status, json_backend
+from service.models import (
+    Items, StockLevel, DataValidationError, InsufficientQuantityError, StockConflictError
+)
+from service.cache import cache
+from service.compression import etag_matches
+from service.idempotency import HEADER as IDEMPOTENCY_HEADER
+from service.routes import item_etag
+
+logger = logging.getLogger("flask.app")
+
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+class HTTPError(Exception):
+    """Used to return an error response from a handler"""
+
+    def __init__(self, status_code: int, error: str, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error = error
+        self.message = message
+
+
+######################################################################
+#  D A T A B A S E
+######################################################################
+class Database:
+    """Holds the async engine and session factory for the running loop"""
+
+    engine = None
+    session = None
+    _lock = None
+    _lock_loop = None
+
+    @classmethod
+    def startup_lock(cls) -> asyncio.Lock:
+        """Returns the lock that lets one request of the running loop start the engine"""
+        loop = asyncio.get_running_loop()
+        if cls._lock_loop is not loop:
+            cls._lock, cls._lock_loop = asyncio.Lock(), loop
+        return cls._lock
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the database URI with the driver swapped for an async one"""
+    scheme, rest = uri.split("://", 1)
+    driver = ASYNC_DRIVERS.get(scheme.split("+")[0], scheme)
+    return driver + "://" + rest
+
+
+async def startup():
+    """Creates the async engine and session factory"""
+    config = flask_app.config
+    uri = async_database_uri(config["SQLALCHEMY_DATABASE_URI"])
+    options = {"pool_pre_ping": config.get("DB_POOL_PRE_PING", True)}
+    if uri.startswith("postgresql"):
+        options.update(
+            pool_size=config.get("DB_POOL_SIZE", 2),
+            max_overflow=config.get("DB_MAX_OVERFLOW", 10),
+            pool_recycle=config.get("DB_POOL_RECYCLE", 1800),
+            pool_timeout=config.get("DB_POOL_TIMEOUT", 30),
+        )
+        if config.get("DB_STATEMENT_TIMEOUT"):
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": str(config["DB_STATEMENT_TIMEOUT"])}
+            }
+    logger.info("Starting async engine for %s", uri.split("://", 1)[0])
+    Database.engine = create_async_engine(uri, **options)
+    Database.session = sessionmaker(
+        Database.engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+
+async def shutdown():
+    """Closes every pooled connection"""
+    if Database.engine is not None:
+        await Database.engine.dispose()
+        Database.engine = None
+        Database.session = None
+
+
+######################################################################
+#  R E Q U E S T S
+######################################################################
+class Request:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {
+            key.decode("latin-1").lower(): value.decode("latin-1")
+            for key, value in scope.get("headers", [])
+        }
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        self.args = {key: values[0] for key, values in query.items()}
+        self.body = body
+        server = scope.get("server") or ("localhost", 80)
+        self.host = self.headers.get("host", "{}:{}".format(*server))
+        self.scheme = scope.get("scheme", "http")
+
+    def get_json(self):
+        """Returns the parsed JSON body or None if it is not valid JSON"""
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+    def check_content_type(self, media_type: str):
+        """Checks that the media type is correct"""
+        content_type = self.headers.get("content-type")
+        if content_type and content_type == media_type:
+            return
+        logger.error("Invalid Content-Type: %s", content_type)
+        raise HTTPError(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            "Unsupported media type",
+            "Content-Type must be {}".format(media_type),
+        )
+
+    def get_int_arg(self, name: str):
+        """Returns a query parameter as a non-negative int or None if absent"""
+        value = self.args.get(name)
+        if value is None:
+            return None
+        if not value.isdigit():
+            raise DataValidationError(
+                "Query parameter '{}' must be a non-negative integer".format(name)
+            )
+        return int(value)
+
+    def get_list_arg(self, name: str):
+        """Returns a comma separated query parameter as a list or None"""
+        value = self.args.get(name)
+        if not value:
+            return None
+        return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def etag_header(item) -> dict:
+    """Returns the ETag header of an Item"""
+    return {"ETag": quote_etag(item_etag(item.id, item.version))}
+
+
+def not_found(item_id):
+    """Returns the error raised for an unknown Item"""
+    return HTTPError(
+        status.HTTP_404_NOT_FOUND,
+        "Not Found",
+        "404 Not Found: Item with id '{}' was not found.".format(item_id),
+    )
+
+
+async def check_stock(session, item_id: int):
+    """Refuses a quantity below the reserved stock or that breaks the stock levels of an Item"""
+    await session.flush()
+    try:
+        await session.run_sync(Items.check_stock, item_id)
+    except (InsufficientQuantityError, StockConflictError) as error:
+        raise HTTPError(status.HTTP_409_CONFLICT, "Conflict", str(error)) from error
+
+
+######################################################################
+#  H A N D L E R S
+######################################################################
+async def list_items(request: Request):
+    """Returns one page of the Items matching the list filters (see routes.list_items)"""
+    criteria, ordering = Items.filter_criteria(
+        category=request.args.get("category"),
+        name=request.args.get("name"),
+        condition=request.args.get("condition"),
+        min_qty=request.get_int_arg("min_qty"),
+        max_qty=request.get_int_arg("max_qty"),
+        sort=request.get_list_arg("sort"),
+        location=request.args.get("location"),
+    )
+    columns = Items.projection(request.get_list_arg("fields"))
+    limit = request.get_int_arg("limit")
+    after = request.get_int_arg("after")
+    statement = select(*[getattr(Items, field) for field in columns]).where(*criteria)
+    headers = {}
+    max_page_size = flask_app.config["MAX_PAGE_SIZE"]
+    if ordering:
+        if limit is not None or after is not None:
+            raise DataValidationError("sort cannot be combined with limit or after")
+        # one row past the limit tells a full list from one that is too long
+        statement = statement.order_by(*ordering).limit(max_page_size + 1)
+    else:
+        if limit is None:
+            limit = flask_app.config["DEFAULT_PAGE_SIZE"]
+        limit = min(limit, max_page_size)
+        if after is not None:
+            statement = statement.where(Items.id > after)
+        statement = statement.order_by(Items.id).limit(limit)
+    async with Database.session() as session:
+        rows = (await session.execute(statement)).all()
+    results = Items.rows_to_dicts(columns, rows)
+    if ordering and len(results) > max_page_size:
+        raise DataValidationError(
+            "More than {} Items match a sorted list: narrow the filters".format(max_page_size)
+        )
+    if not ordering and results and len(results) == limit:
+        headers["X-Next-Cursor"] = str(results[-1]["id"])
+    return status.HTTP_200_OK, results, headers
+
+
+async def get_items(request: Request, item_id: int):  # pylint: disable=unused-argument
+    """Returns a single Item"""
+    async with Database.session() as session:
+        item = await session.get(Items, item_id)
+    if not item:
+        raise not_found(item_id)
+    if etag_matches(parse_etags(request.headers.get("if-none-match")),
+                    item_etag(item.id, item.version)):
+        return status.HTTP_304_NOT_MODIFIED, None, etag_header(item)
+    return status.HTTP_200_OK, item.serialize(), etag_header(item)
+
+
+async def create_item(request: Request):
+    """Creates an Item from the posted body"""
+    request.check_content_type("application/json")
+    item = Items().deserialize(request.get_json())
+    item.id = None
+    async with Database.session() as session:
+        session.add(item)
+        await session.commit()
+    cache.invalidate(item.id)
+    location = "{}://{}/inventory/{}".format(request.scheme, request.host, item.id)
+    logger.info("Item with ID [%s] created.", item.id)
+    return status.HTTP_201_CREATED, item.serialize(), dict(etag_header(item), Location=location)
+
+
+async def update_items(request: Request, item_id: int):
+    """Updates an Item from the posted body"""
+    request.check_content_type("application/json")
+    async with Database.session() as session:
+        item = await session.get(Items, item_id)
+        if not item:
+            raise not_found(item_id)
+        if_match = request.headers.get("if-match")
+        if if_match and not etag_matches(parse_etags(if_match), item_etag(item.id, item.version)):
+            raise HTTPError(
+                status.HTTP_412_PRECONDITION_FAILED,
+                "Precondition Failed",
+                "412 Precondition Failed: Item with id '{}' has been modified.".format(item_id),
+            )
+        item.deserialize(request.get_json())
+        item.id = item_id
+        await check_stock(session, item_id)
+        await session.commit()
+    cache.invalidate(item_id)
+    logger.info("Item with ID [%s] updated.", item_id)
+    return status.HTTP_200_OK, item.serialize(), etag_header(item)
+
+
+async def delete_item(request: Request, item_id: int):  # pylint: disable=unused-argument
+    """Deletes an Item"""
+    async with Database.session() as session:
+        item = await session.get(Items, item_id)
+        if item:
+            # an ORM delete, so the stock summary sees the removed Item
+            await session.delete(item)
+            await session.commit()
+    cache.invalidate(item_id)
+    logger.info("Item with ID [%s] delete complete.", item_id)
+    return status.HTTP_204_NO_CONTENT, None, {}
+
+
+async def disable_item(request: Request, item_id: int):  # pylint: disable=unused-argument
+    """Sets the quantity of an Item to zero"""
+    async with Database.session() as session:
+        item = await session.get(Items, item_id)
+        if not item:
+            raise not_found(item_id)
+        levels = StockLevel.__table__
+        await session.execute(select(Items.id).where(Items.id == item_id).with_for_update())
+        await session.execute(levels.update().where(levels.c.item_id == item_id).values(quantity=0))
+        item.quantity = 0
+        await check_stock(session, item_id)
+        await session.commit()
+    cache.invalidate(item_id)
+    return status.HTTP_200_OK, item.serialize(), etag_header(item)
+
+
+ROUTES = [
+    (re.compile(r"^/inventory$"), {"GET": list_items, "POST": create_item}),
+    (
+        re.compile(r"^/inventory/(?P<item_id>\d+)$"),
+        {"GET": get_items, "PUT": update_items, "DELETE": delete_item},
+    ),
+    (re.compile(r"^/inventory/(?P<item_id>\d+)/disable$"), {"PUT": disable_item}),
+]
+
+
+async def dispatch(request: Request):
+    """Calls the handler for the request path and method"""
+    for pattern, methods in ROUTES:
+        match = pattern.match(request.path)
+        if not match:
+            continue
+        handler = methods.get(request.method)
+        if handler is None:
+            raise HTTPError(
+                status.HTTP_405_METHOD_NOT_ALLOWED,
+                "Method not Allowed",
+                "405 Method Not Allowed: The method is not allowed for the requested URL.",
+            )
+        if request.method != "GET" and IDEMPOTENCY_HEADER.lower() in request.headers:
+            raise HTTPError(
+                status.HTTP_501_NOT_IMPLEMENTED,
+                "Not Implemented",
+                "501 Not Implemented: {} is only supported by the Flask service.".format(
+                    IDEMPOTENCY_HEADER
+                ),
+            )
+        params = {key: int(value) for key, value in match.groupdict().items()}
+        return await handler(request, **params)
+    raise HTTPError(
+        status.HTTP_404_NOT_FOUND,
+        "Not Found",
+        "404 Not Found: The requested URL was not found on the server.",
+    )
+
+
+######################################################################
+#  A S G I   A P P L I C A T I O N
+######################################################################
+async def read_body(receive) -> bytes:
+    """Reads the whole request body"""
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def send_response(send, status_code: int, data, headers: dict):
+    """Sends a JSON response (or an empty one for 204)"""
+    body = b"" if data is None else json_backend.dumps(data)
+    raw_headers = [(b"content-length", str(len(body)).encode())]
+    if data is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+    for key, value in headers.items():
+        raw_headers.append((key.lower().encode("latin-1"), value.encode("latin-1")))
+    await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    """Opens and closes the database engine with the server"""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await startup()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    request = Request(scope, await read_body(receive))
+    if Database.engine is None:
+        # servers that do not send lifespan events: the first request starts it
+        async with Database.startup_lock():
+            if Database.engine is None:
+                await startup()
+    try:
+        status_code, data, headers = await dispatch(request)
+    except HTTPError as error:
+        logger.warning(error.message)
+        status_code, headers = error.status_code, {}
+        data = {"status": error.status_code, "error": error.error, "message": error.message}
+    except DataValidationError as error:
+        logger.warning(str(error))
+        status_code, headers = status.HTTP_400_BAD_REQUEST, {}
+        data = {"status": status_code, "error": "Bad Request", "message": str(error)}
+    except StaleDataError as error:
+        logger.warning(str(error))
+        status_code, headers = status.HTTP_412_PRECONDITION_FAILED, {}
+        data = {"status": status_code, "error": "Precondition Failed", "message": str(error)}
+    except Exception as error:  # pylint: disable=broad-except
+        logger.exception(error)
+        status_code, headers = status.HTTP_500_INTERNAL_SERVER_ERROR, {}
+        data = {"status": status_code, "error": "Internal Server Error", "message": str(error)}
+    await send_response(send, status_code, data, headers)
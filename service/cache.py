@@ -0,0 +1,304 @@
+"""
+Module: cache
+
+Read-through cache for Item lookups and filtered Item lists
+
+Backends
+--------
+LRUCache - in-process cache bounded by entries and bytes, with least
+           recently used eviction and a TTL
+SharedCache - cache stored in a shared key/value server (e.g. Redis) so every
+              worker sees the same entries and invalidations
+LocalClient - in-process stand-in for the shared server's client
+
+Entries hold serialized Items (dictionaries) so they can be shared between
+processes. Single Items are keyed by id and dropped when that Item changes.
+Filtered lists are keyed by a generation number that is bumped on every write,
+so one increment invalidates all of them at once.
+
+Invalidation only reaches the process that wrote. With several workers
+(WEB_CONCURRENCY > 1) the cache should be shared through CACHE_REDIS_URL.
+Without it each worker keeps its own in-process cache with the short
+CACHE_LOCAL_TTL instead of CACHE_TTL: reads in the writing worker are fresh,
+and other workers may serve an entry that is at most CACHE_LOCAL_TTL seconds
+stale. Set CACHE_LOCAL_TTL to 0 to turn the cache off in that case instead.
+"""
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # pragma: no cover
+    redis = None
+
+logger = logging.getLogger("flask.app")
+
+
+######################################################################
+#  C A C H E   B A C K E N D S
+######################################################################
+class LRUCache:
+    """Bounded in-process cache with LRU eviction and a time to live
+
+    Besides max_size entries the cache holds at most max_bytes of values,
+    measured as their JSON size. A value larger than a quarter of max_bytes
+    is not stored, so one large list cannot evict everything else.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30.0, max_bytes: int = 64 * 2 ** 20):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()  # key -> (expires, value, bytes)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns the value stored under key or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, size = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                self.size -= size
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value):
+        """Stores value under key, evicting the least recently used entries"""
+        size = len(json.dumps(value, default=str))
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes // 4:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value, size)
+            self.size += size
+            while len(self._entries) > self.max_size or self.size > self.max_bytes:
+                self.size -= self._entries.popitem(last=False)[1][2]
+
+    def delete(self, key: str):
+        """Removes the entry stored under key"""
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: str):
+        """Removes the entry stored under key, holding the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def incr(self, key: str) -> int:
+        """Increments a counter that is never evicted and returns its value"""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key: str) -> int:
+        """Returns the current value of a counter"""
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self.size = 0
+
+
+class LocalClient:
+    """In-process stand-in for the subset of the Redis client SharedCache uses"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value for key or None if missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        """Stores value under key, expiring after ex seconds"""
+        with self._lock:
+            expires = time.monotonic() + ex if ex else None
+            self._data[key] = (expires, value)
+
+    def delete(self, *keys):
+        """Removes the given keys"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key):
+        """Increments the integer stored under key"""
+        with self._lock:
+            expires, value = self._data.get(key, (None, 0))
+            self._data[key] = (expires, int(value) + 1)
+            return int(value) + 1
+
+    def scan_iter(self, match="*"):
+        """Yields the keys that start with the prefix of match"""
+        prefix = match.rstrip("*")
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix)]
+        yield from keys
+
+
+class SharedCache:
+    """Cache kept in a shared key/value server so all workers agree"""
+
+    def __init__(self, client, ttl: float = 30.0, prefix: str = "inventory:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key: str):
+        """Returns the value stored under key or None"""
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value):
+        """Stores value under key with the cache TTL"""
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(self.ttl) or 1)
+
+    def delete(self, key: str):
+        """Removes the entry stored under key"""
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key: str) -> int:
+        """Atomically increments a counter and returns its value"""
+        return int(self.client.incr(self.prefix + key))
+
+    def counter(self, key: str) -> int:
+        """Returns the current value of a counter"""
+        raw = self.client.get(self.prefix + key)
+        return int(raw) if raw is not None else 0
+
+    def clear(self):
+        """Removes every entry under the cache prefix"""
+        for key in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(key)
+
+
+######################################################################
+#  R E A D - T H R O U G H   I T E M   C A C H E
+######################################################################
+class ItemCache:
+    """Read-through cache for serialized Items with hit and miss counters"""
+
+    LIST_GENERATION = "lists:generation"
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """Configures the cache backend from the Flask app config"""
+        if not app.config.get("CACHE_ENABLED", True):
+            self.backend = None
+            return
+        ttl = app.config.get("CACHE_TTL", 30)
+        url = app.config.get("CACHE_REDIS_URL")
+        if url and redis is not None:
+            logger.info("Using shared item cache at %s", url)
+            self.backend = SharedCache(redis.Redis.from_url(url), ttl)
+        elif app.config.get("CACHE_WORKERS", 1) > 1:
+            # other workers never see this worker's invalidations, so their
+            # entries are only trusted for the short local TTL
+            local_ttl = app.config.get("CACHE_LOCAL_TTL", 2)
+            logger.warning(
+                "%s workers without a shared cache (CACHE_REDIS_URL%s): %s",
+                app.config["CACHE_WORKERS"], " and redis" if url else "",
+                "item cache entries may be up to {}s stale".format(local_ttl)
+                if local_ttl > 0 else "item cache disabled",
+            )
+            self.backend = None
+            if local_ttl > 0:
+                self.backend = LRUCache(
+                    app.config.get("CACHE_MAX_SIZE", 10000), min(ttl, local_ttl),
+                    app.config.get("CACHE_MAX_BYTES", 64 * 2 ** 20),
+                )
+        else:
+            if url:
+                logger.warning("redis is not installed: using the in-process item cache")
+            self.backend = LRUCache(
+                app.config.get("CACHE_MAX_SIZE", 10000), ttl,
+                app.config.get("CACHE_MAX_BYTES", 64 * 2 ** 20),
+            )
+        self.reset_stats()
+
+    def get_item(self, item_id: int, loader):
+        """Returns a serialized Item, calling loader() to fetch it on a miss"""
+        return self._read_through("item:{}".format(item_id), loader)
+
+    def get_list(self, filters: dict, loader):
+        """Returns a serialized Item list, calling loader() to fetch it on a miss"""
+        if self.backend is None:
+            return loader()
+        generation = self.backend.counter(self.LIST_GENERATION)
+        key = "list:{}:{}".format(generation, json.dumps(filters, sort_keys=True))
+        return self._read_through(key, loader)
+
+    def invalidate(self, *item_ids):
+        """Drops the given Items and every cached list"""
+        if self.backend is None:
+            return
+        for item_id in item_ids:
+            self.backend.delete("item:{}".format(item_id))
+        self.backend.incr(self.LIST_GENERATION)
+
+    def clear(self):
+        """Drops every cached entry"""
+        if self.backend is not None:
+            self.backend.clear()
+
+    def reset_stats(self):
+        """Resets the hit and miss counters"""
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters"""
+        return {
+            "enabled": self.backend is not None,
+            "backend": type(self.backend).__name__ if self.backend else None,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _read_through(self, key: str, loader):
+        """Returns the value for key, loading and storing it on a miss"""
+        if self.backend is None:
+            return loader()
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            self.backend.set(key, value)
+        return value
+
+
+# The cache shared by the models and routes, configured in init_db()
+cache = ItemCache()
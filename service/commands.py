@@ -0,0 +1,84 @@
+"""
+Module: commands
+
+Flask command line commands for operating the Inventory service
+
+    flask create-db
+    flask explain-filters --category shirt --name "blue shirt" --analyze
+    flask rebuild-summary
+    flask sweep-reservations
+"""
+import click
+from flask.cli import with_appcontext
+from flask import current_app
+from service.models import Items, StockSummary
+from service import sweeper
+
+
+######################################################################
+# CREATE THE DATABASE TABLES
+######################################################################
+@click.command("create-db")
+@with_appcontext
+def create_db():
+    """Creates the tables and adds any missing columns and indexes
+
+    Run once per deploy before the workers start, rather than in every worker.
+    """
+    Items.create_schema()
+    click.echo("Database schema is up to date")
+
+
+######################################################################
+# EXPLAIN THE LIST FILTER QUERIES
+######################################################################
+@click.command("explain-filters")
+@click.option("--category", default="shirt", help="Category to filter on")
+@click.option("--name", default="blue shirt", help="Name to filter on")
+@click.option("--analyze", is_flag=True, help="Run the queries and show actual timings")
+@with_appcontext
+def explain_filters(category, name, analyze):
+    """Prints the query plans used by the GET /inventory filters"""
+    queries = {
+        "name": Items.find_by_name(name),
+        "category": Items.find_by_category(category),
+        "category and name": Items.build_query(category=category, name=name),
+    }
+    for label, query in queries.items():
+        click.echo("-- filter on {}".format(label))
+        for line in Items.explain(query, analyze):
+            click.echo(line)
+
+
+######################################################################
+# REBUILD THE STOCK SUMMARY TABLE
+######################################################################
+@click.command("rebuild-summary")
+@with_appcontext
+def rebuild_summary():
+    """Recomputes the stock summary table from the items table"""
+    StockSummary.rebuild()
+    click.echo("Rebuilt the stock summary")
+
+
+######################################################################
+# RELEASE EXPIRED RESERVATIONS
+######################################################################
+@click.command("sweep-reservations")
+@with_appcontext
+def sweep_reservations():
+    """Releases expired reservations, idempotency keys and old changes, for a scheduler"""
+    batch_size = current_app.config["RESERVATION_SWEEP_BATCH"]
+    released = sweeper.sweep_expired(batch_size)
+    click.echo("Released {} expired reservations".format(released))
+    deleted = sweeper.purge_keys(batch_size)
+    click.echo("Deleted {} expired idempotency keys".format(deleted))
+    days = current_app.config["CHANGE_LOG_RETENTION_DAYS"]
+    purged = sweeper.purge_changes(days, batch_size)
+    click.echo("Deleted {} changes older than {} days".format(purged, days))
+
+
+def init_app(app):
+    """Adds the commands to the flask command line of an app"""
+    for command in (create_db, explain_filters, rebuild_summary, sweep_reservations):
+        app.cli.add_command(command)
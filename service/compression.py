@@ -0,0 +1,115 @@
+"""
+Module: compression
+
+Response compression negotiated through Accept-Encoding
+
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with the best
+encoding the client accepts: br (when the brotli package is installed), gzip
+or deflate. Streamed responses are left alone, as are responses that
+already carry a Content-Encoding (e.g. the gzip export stream).
+
+A compressed body is a different representation, so a strong ETag gets the
+encoding appended ("etag-gzip"). Conditional requests compare tags with
+etag_matches(), which accepts the plain and the suffixed forms.
+"""
+import gzip
+import zlib
+import logging
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger("flask.app")
+
+
+def _gzip(data: bytes, config) -> bytes:
+    """Compresses data in the gzip format"""
+    return gzip.compress(data, compresslevel=config["COMPRESS_LEVEL"], mtime=0)
+
+
+def _deflate(data: bytes, config) -> bytes:
+    """Compresses data in the zlib (HTTP deflate) format"""
+    return zlib.compress(data, config["COMPRESS_LEVEL"])
+
+
+def _brotli(data: bytes, config) -> bytes:
+    """Compresses data with brotli"""
+    return brotli.compress(data, quality=config["COMPRESS_BROTLI_QUALITY"])
+
+
+# in order of preference when the client accepts several equally
+ENCODERS = {"gzip": _gzip, "deflate": _deflate}
+if brotli is not None:
+    ENCODERS = {"br": _brotli, **ENCODERS}
+
+
+def negotiate(accept_encodings) -> str:
+    """Returns the encoding to use for an Accept-Encoding header, or None"""
+    best, best_quality = None, 0
+    for encoding in ENCODERS:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """Returns the strong ETag of a representation compressed with encoding"""
+    return "{}-{}".format(etag, encoding)
+
+
+def etag_matches(etags, etag: str) -> bool:
+    """Returns True if If-Match or If-None-Match etags hold etag in any encoding"""
+    return etags.contains(etag) or any(
+        etags.contains(encoded_etag(etag, encoding)) for encoding in ENCODERS
+    )
+
+
+def match_not_modified(response):
+    """Gives a 304 response the encoded ETag that the client sent, if any"""
+    etag, weak = response.get_etag()
+    if etag and not weak and not request.if_none_match.contains(etag):
+        for encoding in ENCODERS:
+            if request.if_none_match.contains(encoded_etag(etag, encoding)):
+                response.set_etag(encoded_etag(etag, encoding))
+                break
+    return response
+
+
+def compress_response(app, response):
+    """Compresses a response body if it is large enough and the client agrees"""
+    if response.status_code == 304:
+        return match_not_modified(response)
+    if (
+        not app.config.get("COMPRESS_ENABLED")
+        or response.direct_passthrough
+        or response.is_streamed
+        or response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(ENCODERS[encoding](data, app.config))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(encoded_etag(etag, encoding))
+    return response
+
+
+def init_app(app):
+    """Registers the compression hook, which only runs if COMPRESS_ENABLED"""
+
+    @app.after_request
+    def _compress_response(response):
+        return compress_response(app, response)
@@ -0,0 +1,85 @@
+"""
+Module: exporter
+
+Streaming bulk export of Items as CSV or NDJSON
+
+Rows come from a server-side cursor (see Items.iter_rows), are encoded one
+at a time and sent in blocks of about BLOCK_SIZE bytes, optionally gzip
+compressed on the fly. Nothing holds more than one block or one cursor batch,
+so memory use and the time to the first byte do not depend on the number of
+Items exported.
+"""
+import io
+import csv
+import zlib
+from service import json_backend
+
+BLOCK_SIZE = 64 * 1024
+
+FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+######################################################################
+#  E N C O D E R S
+######################################################################
+def csv_lines(items, columns: list):
+    """Yields a header line and then one encoded CSV line per Item"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for item in items:
+        writer.writerow([item[column] for column in columns])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():  # no Items, only the header was written
+        yield buffer.getvalue().encode("utf-8")
+
+
+def ndjson_lines(items, columns: list):  # pylint: disable=unused-argument
+    """Yields one encoded JSON line per Item"""
+    for item in items:
+        yield json_backend.dumps(item) + b"\n"
+
+
+ENCODERS = {
+    "csv": csv_lines,
+    "ndjson": ndjson_lines,
+}
+
+
+######################################################################
+#  S T R E A M   H E L P E R S
+######################################################################
+def blocks(chunks, size: int = BLOCK_SIZE):
+    """Joins small byte chunks into blocks of at least size bytes"""
+    pending = []
+    length = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield b"".join(pending)
+            pending = []
+            length = 0
+    if pending:
+        yield b"".join(pending)
+
+
+def gzip_stream(chunks, level: int = 6):
+    """Compresses a stream of byte chunks into one gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export(items, columns: list, export_format: str, gzip: bool = False):
+    """Returns the byte chunks of an export in the given format"""
+    chunks = blocks(ENCODERS[export_format](items, columns))
+    return gzip_stream(chunks) if gzip else chunks
@@ -0,0 +1,73 @@
+"""
+Module: health
+
+Liveness and readiness checks for the orchestrator and load balancer
+
+The readiness check looks at the primary database's connection pool, checks
+out a connection and times a SELECT 1, and compares the pool utilisation and
+the SELECT 1 latency with READY_MAX_POOL_UTILISATION and READY_MAX_LATENCY_MS,
+so slow or saturated instances are taken out of the load balancer before
+their requests start to time out.
+
+The latency of the requests' own SQL and pool waits over the last
+READY_LATENCY_WINDOW seconds (see metrics.py) are reported but not checked:
+a few slow bulk statements (imports, exports) say nothing about whether the
+instance can take more requests.
+"""
+import time
+import logging
+from sqlalchemy import text
+from service import metrics
+
+logger = logging.getLogger("flask.app")
+
+
+def pool_status(engine) -> dict:
+    """Returns the size and usage of an engine's connection pool"""
+    pool = engine.pool
+    if not hasattr(pool, "checkedout") or not hasattr(pool, "size"):
+        return {"class": type(pool).__name__}  # e.g. SQLite's non-queue pools
+    capacity = pool.size() + max(pool._max_overflow, 0)  # pylint: disable=protected-access
+    checked_out = pool.checkedout()
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "capacity": capacity,
+        "checked_out": checked_out,
+        "overflow": max(pool.overflow(), 0),
+        "utilisation": round(checked_out / capacity, 2) if capacity else None,
+    }
+
+
+def check_readiness(engine, config) -> tuple:
+    """Checks that the database is reachable, responsive and not saturated
+
+    :param engine: the engine of the primary database
+    :param config: the app config with the READY_* thresholds
+
+    :return: (ready, report) where report explains the decision
+    :rtype: tuple
+
+    """
+    max_latency = config["READY_MAX_LATENCY_MS"]
+    report = {"pool": pool_status(engine), "checks": {}}
+    checks = report["checks"]
+    utilisation = report["pool"].get("utilisation")
+    checks["pool"] = utilisation is None or utilisation < config["READY_MAX_POOL_UTILISATION"]
+    if not checks["pool"]:
+        # do not wait in the checkout queue behind the requests
+        checks["database"] = False
+    else:
+        try:
+            start = time.perf_counter()
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            report["select_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            checks["database"] = report["select_ms"] <= max_latency
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error("Readiness check failed: %s", error)
+            report["error"] = str(error)
+            checks["database"] = False
+    report["recent_sql"] = metrics.recent_sql_latency(config["READY_LATENCY_WINDOW"])
+    report["pool_wait"] = metrics.recent_pool_wait(config["READY_LATENCY_WINDOW"])
+    return all(checks.values()), report
@@ -0,0 +1,131 @@
+"""
+Module: idempotency
+
+Safe retries of writes with an Idempotency-Key header
+
+A client that sends the same Idempotency-Key again (e.g. after a timeout)
+gets the stored response of the first request, marked with an
+Idempotent-Replayed header, and the write is not run twice. Keys are kept
+for IDEMPOTENCY_TTL seconds. Reusing a key for a different request fails
+with 422, and a retry while the first request is still running fails with
+409. Requests that fail with an error before committing anything release
+their key so they can be retried. Requests without the header are not
+affected.
+
+The first commit of the write also extends the key's claim to
+IDEMPOTENCY_TTL, so a write that committed is never run again: if the view
+fails after its commit (e.g. invalidating the cache raises), its error
+response is stored and replayed instead, and if storing the response fails,
+retries get 409 until the key expires.
+"""
+import hashlib
+import logging
+from functools import wraps
+from flask import abort, current_app, jsonify, make_response, request
+from sqlalchemy.exc import SQLAlchemyError
+from service.models import IdempotencyKey, db
+from . import status
+
+logger = logging.getLogger("flask.app")
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+STORED_HEADERS = ("Content-Type", "Location", "ETag")
+MAX_KEY_LENGTH = IdempotencyKey.__table__.c.key.type.length
+
+
+def fingerprint() -> str:
+    """Returns a digest of the method, path, query and body of the request"""
+    digest = hashlib.sha256()
+    for part in (request.method, request.full_path):
+        digest.update(part.encode("utf-8") + b"\0")
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(stored: IdempotencyKey):
+    """Returns the stored response of a finished request"""
+    response = make_response(stored.body, stored.status_code, stored.headers or {})
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+
+def store(key: str, status_code: int, headers: dict, body: bytes, ttl: int, attempts: int = 2):
+    """Stores the response of a finished request, retrying once on a database error
+
+    The write has already committed, so a response that cannot be stored
+    is logged and still returned; the key stays held until it expires.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            IdempotencyKey.complete(key, status_code, headers, body, ttl)
+            return True
+        except SQLAlchemyError:
+            logger.exception(
+                "Storing the response for %s %s failed (attempt %s of %s)",
+                HEADER, key, attempt, attempts,
+            )
+    return False
+
+
+def idempotent(view):
+    """Makes a write view replay its response for a repeated Idempotency-Key"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None or not current_app.config.get("IDEMPOTENCY_ENABLED", True):
+            return view(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            abort(
+                status.HTTP_400_BAD_REQUEST,
+                "{} must be 1 to {} characters".format(HEADER, MAX_KEY_LENGTH),
+            )
+        digest = fingerprint()
+        stored = IdempotencyKey.claim(key, digest, current_app.config["IDEMPOTENCY_LOCK_SECONDS"])
+        if stored is not None:
+            if stored.fingerprint != digest:
+                abort(
+                    status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    "{} was already used for a different request".format(HEADER),
+                )
+            if stored.status_code is None:
+                abort(
+                    status.HTTP_409_CONFLICT,
+                    "A request with this {} is still in progress".format(HEADER),
+                )
+            logger.info("Replaying the response for %s %s", HEADER, key)
+            return replay(stored)
+
+        ttl = current_app.config["IDEMPOTENCY_TTL"]
+        db.session.info["idempotency_key"] = (key, ttl)
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            if not db.session.info.pop("idempotency_committed", False):
+                IdempotencyKey.release(key)
+                raise
+            # the write is in, so a retry must not run it again
+            failed = jsonify(
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                error="Internal Server Error",
+                message="The request was applied, but its response could not be returned",
+            )
+            db.session.rollback()
+            store(key, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                  {"Content-Type": failed.content_type}, failed.get_data(), ttl)
+            raise
+        finally:
+            db.session.info.pop("idempotency_key", None)
+            db.session.info.pop("idempotency_holding", None)
+        committed = db.session.info.pop("idempotency_committed", False)
+        if response.is_streamed or (response.status_code >= 400 and not committed):
+            if not committed:
+                IdempotencyKey.release(key)
+            return response
+        headers = {name: response.headers[name] for name in STORED_HEADERS
+                   if name in response.headers}
+        store(key, response.status_code, headers, response.get_data(), ttl)
+        return response
+
+    return wrapper
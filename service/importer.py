@@ -0,0 +1,120 @@
+"""
+Module: importer
+
+Streaming bulk import of Items from CSV or NDJSON
+
+The request body is decoded and parsed one line at a time, every row is
+validated with the Items.deserialize rules and the valid rows are inserted
+in chunks of IMPORT_CHUNK_SIZE (PostgreSQL COPY when available, an
+executemany INSERT otherwise), each chunk in its own transaction. Only the
+current chunk and the first IMPORT_MAX_ERRORS row errors are kept in memory,
+so memory use does not grow with the size of the file.
+
+CSV bodies need a header row naming the name, category, quantity and
+condition columns. NDJSON bodies hold one JSON Item per line.
+"""
+import csv
+import json
+import codecs
+import logging
+from service.models import Items, DataValidationError
+from service.cache import cache
+
+logger = logging.getLogger("flask.app")
+
+# Column lengths enforced by the database, checked before a row is inserted
+MAX_LENGTHS = {
+    column.name: column.type.length
+    for column in Items.__table__.columns
+    if getattr(column.type, "length", None)
+}
+
+
+######################################################################
+#  R E A D E R S
+######################################################################
+def read_csv(stream):
+    """Yields (line number, row dictionary) for each record of a CSV stream"""
+    reader = csv.DictReader(codecs.iterdecode(stream, "utf-8-sig"))
+    for row in reader:
+        # leave out columns a short row did not have, so they count as missing
+        data = {key: value for key, value in row.items() if key and value is not None}
+        quantity = data.get("quantity")
+        if isinstance(quantity, str) and quantity.strip().lstrip("-").isdigit():
+            data["quantity"] = int(quantity)
+        yield reader.line_num, data
+
+
+def read_ndjson(stream):
+    """Yields (line number, parsed value) for each line of an NDJSON stream"""
+    for line_num, line in enumerate(codecs.iterdecode(stream, "utf-8-sig"), start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_num, json.loads(line)
+        except ValueError as error:
+            yield line_num, DataValidationError("Invalid JSON: " + str(error))
+
+
+READERS = {
+    "text/csv": read_csv,
+    "application/x-ndjson": read_ndjson,
+}
+
+
+######################################################################
+#  I M P O R T   P I P E L I N E
+######################################################################
+def validate(data) -> Items:
+    """Returns an unsaved Item for a row or raises DataValidationError"""
+    if isinstance(data, DataValidationError):
+        raise data
+    item = Items().deserialize(data)
+    for name, length in MAX_LENGTHS.items():
+        value = getattr(item, name)
+        if isinstance(value, str) and len(value) > length:
+            raise DataValidationError(
+                "Invalid item: {} is longer than {} characters".format(name, length)
+            )
+    return item
+
+
+def import_rows(rows, chunk_size: int, max_errors: int) -> dict:
+    """Validates and inserts rows from a reader in chunks
+
+    :param rows: (line number, data) pairs from read_csv() or read_ndjson()
+    :param chunk_size: the number of Items to insert per transaction
+    :type chunk_size: int
+    :param max_errors: the number of row errors to report in full
+    :type max_errors: int
+
+    :return: the imported and rejected counts and the row errors
+    :rtype: dict
+
+    """
+    result = {"imported": 0, "rejected": 0, "errors": [], "errors_truncated": False}
+    chunk = []
+
+    def flush():
+        result["imported"] += Items.bulk_insert(chunk)
+        chunk.clear()
+        cache.invalidate()
+
+    for line_num, data in rows:
+        try:
+            chunk.append(validate(data))
+        except DataValidationError as error:
+            result["rejected"] += 1
+            if len(result["errors"]) < max_errors:
+                result["errors"].append({"line": line_num, "error": str(error)})
+            else:
+                result["errors_truncated"] = True
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    logger.info(
+        "Imported %d items, rejected %d rows", result["imported"], result["rejected"]
+    )
+    return result
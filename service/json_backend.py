@@ -0,0 +1,60 @@
+"""
+Module: json_backend
+
+Pluggable JSON encoder for large responses
+
+orjson is used when it is installed (it encodes lists of dictionaries several
+times faster than the standard library), otherwise the stdlib json module.
+Set JSON_BACKEND to "orjson" or "stdlib" to force one or the other.
+"""
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+logger = logging.getLogger("flask.app")
+
+
+def _stdlib_dumps(data) -> bytes:
+    """Encodes data with the standard library json module"""
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_dumps(data) -> bytes:
+    """Encodes data with orjson"""
+    return orjson.dumps(data)
+
+
+BACKENDS = {"stdlib": _stdlib_dumps}
+if orjson is not None:
+    BACKENDS["orjson"] = _orjson_dumps
+
+_name = "orjson" if "orjson" in BACKENDS else "stdlib"
+_dumps = BACKENDS[_name]
+
+
+def init_app(app):
+    """Selects the JSON backend from the JSON_BACKEND config value"""
+    global _dumps, _name  # pylint: disable=global-statement
+    name = app.config.get("JSON_BACKEND", "auto")
+    if name == "auto":
+        name = "orjson" if "orjson" in BACKENDS else "stdlib"
+    if name not in BACKENDS:
+        logger.warning("JSON backend %s is not available: using stdlib", name)
+        name = "stdlib"
+    logger.info("Using the %s JSON backend", name)
+    _name = name
+    _dumps = BACKENDS[name]
+
+
+def backend_name() -> str:
+    """Returns the name of the selected JSON backend"""
+    return _name
+
+
+def dumps(data) -> bytes:
+    """Encodes data as UTF-8 JSON bytes with the selected backend"""
+    return _dumps(data)
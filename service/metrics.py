@@ -0,0 +1,282 @@
+"""
+Module: metrics
+
+Opt-in per-request timing and SQL instrumentation
+
+The duration of the last RECENT_SQL_SIZE SQL statements is always kept, for
+the /ready probe (see health.py), and so is the time the last
+RECENT_SQL_SIZE pool checkouts queued for a connection (with
+TimedQueuePool), for load shedding (see throttling.py).
+
+When METRICS_ENABLED is true every request records:
+    - its latency, per endpoint, method and status code
+    - the number and total duration of the SQL statements it ran
+      (captured with SQLAlchemy engine events)
+    - the time spent encoding the JSON response body
+
+The histograms are served in the Prometheus text format on GET /metrics and
+each response gets a Server-Timing header with the same breakdown. Metrics
+are kept per worker process.
+"""
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.util import queue as sqla_queue
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+RECENT_SQL_SIZE = 200
+
+# (finished at, seconds taken) of the most recent SQL statements of this process
+RECENT_SQL = deque(maxlen=RECENT_SQL_SIZE)
+# (finished at, seconds waited) of the most recent connection pool checkouts
+RECENT_POOL_WAIT = deque(maxlen=RECENT_SQL_SIZE)
+
+
+######################################################################
+#  H I S T O G R A M S
+######################################################################
+class Histogram:
+    """Prometheus style histogram with cumulative buckets per label set"""
+
+    def __init__(self, name: str, description: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        """Records one observation for the given label values"""
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def clear(self):
+        """Forgets every observation"""
+        with self._lock:
+            self._series.clear()
+
+    def expose(self) -> list:
+        """Returns the histogram as lines of the Prometheus text format"""
+        lines = [
+            "# HELP {} {}".format(self.name, self.description),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                labels = ",".join(
+                    '{}="{}"'.format(key, value) for key, value in zip(self.labels, label_values)
+                )
+                prefix = labels + "," if labels else ""
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append('{}_bucket{{{}le="{}"}} {}'.format(self.name, prefix, bound, count))
+                lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(self.name, prefix, series["count"]))
+                lines.append("{}_sum{{{}}} {}".format(self.name, labels, series["sum"]))
+                lines.append("{}_count{{{}}} {}".format(self.name, labels, series["count"]))
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "inventory_request_duration_seconds",
+    "Time spent handling a request",
+    ("endpoint", "method", "status"),
+    LATENCY_BUCKETS,
+)
+SQL_STATEMENTS = Histogram(
+    "inventory_request_sql_statements",
+    "Number of SQL statements run by a request",
+    ("endpoint",),
+    COUNT_BUCKETS,
+)
+SQL_DURATION = Histogram(
+    "inventory_request_sql_duration_seconds",
+    "Total time a request spent waiting on SQL statements",
+    ("endpoint",),
+    LATENCY_BUCKETS,
+)
+SERIALIZATION_DURATION = Histogram(
+    "inventory_request_serialization_duration_seconds",
+    "Time a request spent encoding its response body",
+    ("endpoint",),
+    LATENCY_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_LATENCY, SQL_STATEMENTS, SQL_DURATION, SERIALIZATION_DURATION)
+
+
+######################################################################
+#  I N S T R U M E N T A T I O N
+######################################################################
+def _enabled() -> bool:
+    """Returns True when the current request is being measured"""
+    return has_request_context() and "metrics_start" in g
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """Notes when a SQL statement started"""
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument,too-many-arguments
+    """Adds a finished SQL statement to the recent latencies and request totals"""
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    now = time.perf_counter()
+    elapsed = now - starts.pop()
+    RECENT_SQL.append((now, elapsed))
+    if _enabled():
+        g.metrics_sql_time += elapsed
+        g.metrics_sql_count += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context):
+    """Drops the start time of a SQL statement that failed"""
+    connection = context.connection
+    if connection is not None and connection.info.get("metrics_query_start"):
+        connection.info["metrics_query_start"].pop()
+
+
+class TimedQueue(sqla_queue.Queue):
+    """Connection queue that records how long each get waited for a connection"""
+
+    def get(self, block=True, timeout=None):
+        start = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            now = time.perf_counter()
+            RECENT_POOL_WAIT.append((now, now - start))
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout queued for a connection
+
+    Only the time spent waiting on the pool's queue is recorded: opening a
+    new connection while the pool is not full is not, so a slow connect
+    does not look like a saturated pool.
+    """
+
+    _queue_class = TimedQueue
+
+
+@contextmanager
+def timed_serialization():
+    """Adds the time spent in the with block to the serialization total"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _enabled():
+            g.metrics_serialize_time += time.perf_counter() - start
+
+
+def start_request():
+    """Starts measuring a request"""
+    g.metrics_start = time.perf_counter()
+    g.metrics_sql_time = 0.0
+    g.metrics_sql_count = 0
+    g.metrics_serialize_time = 0.0
+
+
+def finish_request(response):
+    """Records the request metrics and adds the Server-Timing header"""
+    if not _enabled():
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    # without the blueprint prefix, e.g. list_items
+    endpoint = (request.endpoint or "unmatched").rpartition(".")[2]
+    REQUEST_LATENCY.observe(elapsed, endpoint, request.method, str(response.status_code))
+    SQL_STATEMENTS.observe(g.metrics_sql_count, endpoint)
+    SQL_DURATION.observe(g.metrics_sql_time, endpoint)
+    SERIALIZATION_DURATION.observe(g.metrics_serialize_time, endpoint)
+    response.headers.add(
+        "Server-Timing",
+        'app;dur={:.2f}, db;dur={:.2f};desc="{} queries", serialize;dur={:.2f}'.format(
+            elapsed * 1000,
+            g.metrics_sql_time * 1000,
+            g.metrics_sql_count,
+            g.metrics_serialize_time * 1000,
+        ),
+    )
+    return response
+
+
+def _recent(samples: deque, window: float) -> dict:
+    """Returns the count, mean and 95th percentile of the recent samples"""
+    since = time.perf_counter() - window
+    recent = sorted(elapsed for finished, elapsed in list(samples) if finished >= since)
+    if not recent:
+        return {"count": 0, "mean_ms": None, "p95_ms": None}
+    p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+    return {
+        "count": len(recent),
+        "mean_ms": round(sum(recent) / len(recent) * 1000, 2),
+        "p95_ms": round(p95 * 1000, 2),
+    }
+
+
+def recent_sql_latency(window: float = 60.0) -> dict:
+    """Returns the count, mean and 95th percentile of the recent SQL latencies
+
+    :param window: only count statements that finished in the last window seconds
+    :type window: float
+
+    """
+    return _recent(RECENT_SQL, window)
+
+
+def recent_pool_wait(window: float = 60.0) -> dict:
+    """Returns the count, mean and 95th percentile of the recent pool waits
+
+    :param window: only count checkouts that finished in the last window seconds
+    :type window: float
+
+    """
+    return _recent(RECENT_POOL_WAIT, window)
+
+
+def expose() -> str:
+    """Returns every histogram in the Prometheus text exposition format"""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return "\n".join(lines) + "\n"
+
+
+def clear():
+    """Forgets every recorded observation"""
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+    RECENT_SQL.clear()
+    RECENT_POOL_WAIT.clear()
+
+
+def init_app(app):
+    """Registers the request hooks, which only measure if METRICS_ENABLED"""
+
+    @app.before_request
+    def _start_request():
+        if app.config.get("METRICS_ENABLED"):
+            start_request()
+
+    app.after_request(finish_request)
@@ -6,6 +6,11 @@ All of the models are stored in this module
 Models
 ------
 Items - Items sold or returned to the store
+StockLevel - the quantity of an Item held at each location
+Reservation - a quantity of an Item held for a while, e.g. during checkout
+IdempotencyKey - stored responses of writes sent with an Idempotency-Key
+StockSummary - running counts and quantities per category and condition
+ItemChange - append-only log of the changes made to Items
 
 Attributes:
 -----------
@@ -13,23 +18,41 @@ name (string) - the name of the item
 category (string) - the category the item belongs to (i.e., shirt, shorts)
 quantity (int) - number of items in respective categort 
 condition (boolean) - New (0) or Returned/used (1)
+version (int) - incremented on every update, used for ETags and optimistic locking
+reserved (int) - the quantity held by active reservations (not serialized)
 
 """
+import io
+import csv
 import logging
+import warnings
+from datetime import datetime, timedelta
 from enum import Enum
+from types import SimpleNamespace
 from xmlrpc.client import Boolean
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, bindparam, event, func, inspect, orm, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import SAWarning
+from service.cache import cache
+from service import json_backend
+from service.routing import RoutingSQLAlchemy
 
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# Its sessions send reads to any configured read replicas (see routing.py)
+db = RoutingSQLAlchemy()
+
+
+def init_app(app):
+    """Initialize the SQLAlchemy app without touching the database"""
+    Items.init_app(app)
 
 
 def init_db(app):
-    """Initialize the SQLAlchemy app"""
+    """Initialize the SQLAlchemy app and create the tables"""
     Items.init_db(app)
 
 
@@ -37,6 +60,30 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class InsufficientQuantityError(Exception):
+    """Used when an adjustment would take the quantity below zero"""
+
+    @classmethod
+    def reserved(cls, item_id: int, reserved: int):
+        """Returns the error for a quantity below the reserved stock"""
+        return cls(
+            "Item with id '{}' has {} reserved: its quantity may not be set "
+            "below that".format(item_id, reserved)
+        )
+
+
+class StockConflictError(Exception):
+    """Used when a write would set a quantity the stock rules do not allow"""
+
+    @classmethod
+    def located(cls, item_id: int, total: int):
+        """Returns the error for a quantity that is not the total of the stock levels"""
+        return cls(
+            "Item with id '{}' has stock levels totalling {}: set its stock per "
+            "location instead of its quantity".format(item_id, total)
+        )
+
+
 class Condition(Enum):
     """Enumeration of valid Item Conditions"""
 
@@ -56,12 +103,21 @@ class Items(db.Model):
     # Table Schema
     ##################################################
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(63), nullable=False)
-    category = db.Column(db.String(63), nullable=False)
+    name = db.Column(db.String(63), nullable=False, index=True)
+    category = db.Column(db.String(63), nullable=False, index=True)
     quantity = db.Column(db.Integer, primary_key=False)
     condition = db.Column(
         db.Enum(Condition), nullable=False, default=(Condition.NEW)
     )
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    reserved = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (db.Index("ix_items_category_name", "category", "name"),)
+    __mapper_args__ = {"version_id_col": version}
+
+    # Columns that can be returned by serialize_rows() and sorted on in SQL
+    FIELDS = ("id", "name", "category", "quantity", "condition", "version")
+    SORT_FIELDS = ("id", "name", "category")  # the indexed columns
 
     ##################################################
     # INSTANCE METHODS
@@ -79,21 +135,55 @@ class Items(db.Model):
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
         db.session.commit()
+        cache.invalidate(self.id)
 
     def update(self):
         """
         Updates an Item in the database
+
+        :raises StockConflictError: if the quantity of an Item with stock
+            levels no longer matches their total (see StockLevel)
         """
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        quantity_changed = inspect(self).attrs.quantity.history.has_changes()
+        try:
+            db.session.flush()  # the UPDATE locks the row for the check
+            if quantity_changed:
+                self.check_stock(db.session, self.id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(self.id)
+
+    def disable(self):
+        """Makes an Item unavailable by setting its quantity and every stock level to zero"""
+        logger.info("Disabling %s", self.name)
+        table = Items.__table__
+        levels = StockLevel.__table__
+        try:
+            # lock the Item before its stock levels, in the order set_level uses
+            db.session.execute(select(table.c.id).where(table.c.id == self.id).with_for_update())
+            db.session.execute(
+                levels.update().where(levels.c.item_id == self.id).values(quantity=0)
+            )
+            self.quantity = 0
+            db.session.flush()
+            self.check_stock(db.session, self.id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(self.id)
 
     def delete(self):
         """Removes an Item from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
         db.session.commit()
+        cache.invalidate(self.id)
 
     def serialize(self) -> dict:
         """Serializes a Item into a dictionary"""
@@ -103,6 +193,7 @@ class Items(db.Model):
             "category": self.category,
             "quantity": self.quantity,
             "condition": self.condition.name,  # convert enum to string
+            "version": self.version,
         }
 
     def deserialize(self, data: dict):
@@ -132,13 +223,25 @@ class Items(db.Model):
             )
         return self
 
+    def to_row(self) -> dict:
+        """Returns the column values of an Item for a bulk statement"""
+        return {
+            "name": self.name,
+            "category": self.category,
+            "quantity": self.quantity,
+            "condition": self.condition,
+        }
+
     ##################################################
     # CLASS METHODS
     ##################################################
 
     @classmethod
-    def init_db(cls, app: Flask):
-        """Initializes the database session
+    def init_app(cls, app: Flask):
+        """Initializes the database session without connecting to the database
+
+        Connections are opened on first use, so an app can be created while
+        the database is briefly unreachable.
 
         :param app: the Flask app
         :type data: Flask
@@ -147,8 +250,429 @@ class Items(db.Model):
         logger.info("Initializing database")
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
+        cache.init_app(app)
+        json_backend.init_app(app)
+        StockSummary.enabled = app.config.get("SUMMARY_TABLE_ENABLED", False)
+        StockLevel.default_location = app.config.get("STOCK_DEFAULT_LOCATION", "default")
+        ItemChange.enabled = app.config.get("CHANGE_LOG_ENABLED", True)
+
+    @classmethod
+    def init_db(cls, app: Flask):
+        """Initializes the database session and creates the tables
+
+        :param app: the Flask app
+        :type data: Flask
+
+        """
+        cls.init_app(app)
         app.app_context().push()
+        cls.create_schema()
+
+    @classmethod
+    def create_schema(cls):
+        """Creates the tables and brings an existing schema up to date"""
+        from service import search  # pylint: disable=import-outside-toplevel, cyclic-import
+
         db.create_all()  # make our sqlalchemy tables
+        cls.upgrade_schema()
+        search.create_indexes(db.engine)
+        if StockSummary.enabled and StockSummary.query.first() is None:
+            StockSummary.rebuild()  # first start with the summary table on
+
+    @classmethod
+    def upgrade_schema(cls):
+        """Adds any missing columns and indexes to a table that already existed
+
+        create_all() skips tables that are already there, so columns and
+        indexes added to the schema later are created here if they are missing
+        """
+        table = cls.__table__
+        existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            logger.info("Adding column %s to %s", column.name, table.name)
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            default = column.server_default.arg if column.server_default else None
+            ddl = "ALTER TABLE {} ADD COLUMN {} {}".format(table.name, column.name, column_type)
+            if default is not None:
+                ddl += " NOT NULL DEFAULT {}".format(default)
+            with db.engine.begin() as connection:
+                connection.execute(text(ddl))
+        with warnings.catch_warnings():
+            # the expression index used by search.py cannot be reflected
+            warnings.filterwarnings("ignore", "Skipped unsupported reflection", SAWarning)
+            for index in table.indexes:
+                index.create(bind=db.engine, checkfirst=True)
+
+    @classmethod
+    def explain(cls, query, analyze: bool = False) -> list:
+        """Returns the database query plan for a query
+
+        :param query: the query to explain, e.g. from find_by_name()
+        :param analyze: run the query and include actual timings (PostgreSQL)
+        :type analyze: bool
+
+        :return: the lines of the query plan
+        :rtype: list
+
+        """
+        dialect = db.engine.dialect
+        statement = query.statement.compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}
+        )
+        if dialect.name == "sqlite":
+            prefix = "EXPLAIN QUERY PLAN "
+        elif analyze:
+            prefix = "EXPLAIN ANALYZE "
+        else:
+            prefix = "EXPLAIN "
+        logger.info("Explaining query: %s", statement)
+        rows = db.session.execute(text(prefix + str(statement)))
+        return [" ".join(str(column) for column in row) for row in rows]
+
+    @classmethod
+    def batch(cls, operations: list) -> list:
+        """Applies a list of create/update/delete operations in one transaction
+
+        Each operation is a dictionary with an "op" of create, update or
+        delete, an "id" for update and delete, and an "item" body for create
+        and update. Valid operations are applied as one multi-row INSERT (see
+        allocate_ids), one executemany UPDATE and one DELETE, and committed
+        together. Deletes of Items that do not
+        exist are reported as not_found, and updates that would set a quantity
+        below the reserved stock or other than the total of the Item's stock
+        levels as conflict.
+
+        :param operations: the operations to apply
+        :type operations: list
+
+        :return: one result dictionary per operation, in the same order
+        :rtype: list
+
+        """
+        if not isinstance(operations, list):
+            raise DataValidationError("Invalid batch: body must be a list of operations")
+        logger.info("Processing batch of %d operations", len(operations))
+        results = [None] * len(operations)
+        creates, updates, deletes = [], [], []
+        for index, operation in enumerate(operations):
+            try:
+                kind, item_id, item = cls._parse_operation(operation)
+            except DataValidationError as error:
+                results[index] = {"op": None, "result": "invalid", "error": str(error)}
+                if isinstance(operation, dict):
+                    results[index]["op"] = operation.get("op")
+                continue
+            results[index] = {"op": kind, "id": item_id}
+            if kind == "create":
+                creates.append((index, item))
+            elif kind == "update":
+                updates.append((index, item))
+            else:
+                deletes.append(index)
+
+        table = cls.__table__
+        target_ids = [results[index]["id"] for index, _ in updates]
+        delete_ids = [results[index]["id"] for index in deletes]
+        existing, previous = {}, {}
+        if StockSummary.enabled:
+            target_ids += delete_ids  # the old values come off the summary
+        if target_ids:
+            rows = db.session.query(
+                cls.id, cls.version, cls.category, cls.condition, cls.quantity, cls.reserved
+            ).filter(cls.id.in_(target_ids)).with_for_update()
+            previous = {row.id: row for row in rows}
+            existing = {item.id: previous[item.id].version for _, item in updates
+                        if item.id in previous}
+        found = [(index, item) for index, item in updates if item.id in existing]
+        if found:
+            levels = StockLevel.__table__
+            located = dict(db.session.execute(
+                select(levels.c.item_id, func.sum(levels.c.quantity))
+                .where(levels.c.item_id.in_([item.id for _, item in found]))
+                .group_by(levels.c.item_id)
+            ).all())
+            for index, item in found:
+                if (item.quantity or 0) < previous[item.id].reserved:
+                    results[index]["result"] = "conflict"
+                    results[index]["error"] = str(
+                        InsufficientQuantityError.reserved(item.id, previous[item.id].reserved)
+                    )
+                elif item.id in located and (item.quantity or 0) != located[item.id]:
+                    results[index]["result"] = "conflict"
+                    results[index]["error"] = str(
+                        StockConflictError.located(item.id, located[item.id])
+                    )
+            found = [(index, item) for index, item in found if "result" not in results[index]]
+        for _, item in found:
+            item.version = existing[item.id] + 1
+        for index, item in updates:
+            if item.id not in existing:
+                results[index]["result"] = "not_found"
+                results[index]["error"] = "Item with id '{}' was not found.".format(item.id)
+
+        deltas = {}
+        if StockSummary.enabled:
+            for _, item in creates + found:
+                StockSummary.add_delta(deltas, item, 1)
+            for _, item in found:
+                StockSummary.add_delta(deltas, previous[item.id], -1)
+            for item_id in set(delete_ids):
+                if item_id in previous:
+                    StockSummary.add_delta(deltas, previous[item_id], -1)
+
+        try:
+            ids = cls.allocate_ids(len(creates))
+            if ids is not None:
+                for (_, item), item_id in zip(creates, ids):
+                    item.id, item.version = item_id, 1
+                if creates:
+                    db.session.execute(table.insert().values(
+                        [dict(item.to_row(), id=item.id, version=1) for _, item in creates]
+                    ))
+            else:
+                for _, item in creates:
+                    result = db.session.execute(table.insert().values(item.to_row()))
+                    item.id = result.inserted_primary_key[0]
+                    item.version = 1
+            if found:
+                statement = (
+                    table.update()
+                    .where(table.c.id == bindparam("item_id"))
+                    .values(
+                        name=bindparam("name"),
+                        category=bindparam("category"),
+                        quantity=bindparam("quantity"),
+                        condition=bindparam("condition"),
+                        version=table.c.version + 1,
+                    )
+                )
+                db.session.execute(
+                    statement,
+                    [dict(item.to_row(), item_id=item.id) for _, item in found],
+                )
+            deleted_ids = []
+            if deletes:
+                statement = table.delete().where(table.c.id.in_(delete_ids))
+                dialect = db.session.get_bind(clause=statement).dialect
+                if getattr(dialect, "full_returning", False) or getattr(dialect, "delete_returning", False):
+                    deleted_ids = db.session.execute(statement.returning(table.c.id)).scalars().all()
+                else:
+                    deleted_ids = db.session.execute(
+                        select(table.c.id).where(table.c.id.in_(delete_ids))
+                    ).scalars().all()
+                    db.session.execute(statement)
+            StockSummary.apply(db.session, deltas)
+            if ItemChange.enabled:
+                changes = [ItemChange.for_item("create", item) for _, item in creates]
+                changes.extend(ItemChange.for_item("update", item) for _, item in found)
+                changes.extend({"item_id": item_id, "op": "delete"} for item_id in deleted_ids)
+                ItemChange.record(db.session, changes)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(*[item.id for _, item in found], *deleted_ids)
+
+        for index, item in creates + found:
+            results[index]["id"] = item.id
+            results[index]["result"] = "created" if results[index]["op"] == "create" else "updated"
+            results[index]["item"] = item.serialize()
+        deleted_ids = set(deleted_ids)
+        for index in deletes:
+            item_id = results[index]["id"]
+            if item_id in deleted_ids:
+                results[index]["result"] = "deleted"
+                deleted_ids.discard(item_id)  # a repeated delete finds nothing
+            else:
+                results[index]["result"] = "not_found"
+                results[index]["error"] = "Item with id '{}' was not found.".format(item_id)
+        return results
+
+    @classmethod
+    def bulk_insert(cls, items: list) -> int:
+        """Inserts many new Items in one transaction
+
+        Uses COPY on PostgreSQL (psycopg2) and an executemany INSERT on
+        other databases. The ids of the new Items are not read back.
+
+        :param items: the unsaved Items to insert
+        :type items: list
+
+        :return: the number of Items inserted
+        :rtype: int
+
+        """
+        if not items:
+            return 0
+        table = cls.__table__
+        columns = ("name", "category", "quantity", "condition")
+        try:
+            # an INSERT clause so the session binds to the primary database
+            connection = db.session.connection(bind_arguments={"clause": table.insert()})
+            if connection.dialect.driver == "psycopg2":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)
+                for item in items:
+                    writer.writerow(
+                        (item.name, item.category, item.quantity, item.condition.name)
+                    )
+                buffer.seek(0)
+                copy = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)".format(
+                    table.name, ", ".join(columns)
+                )
+                connection.connection.cursor().copy_expert(copy, buffer)
+            else:
+                db.session.execute(table.insert(), [item.to_row() for item in items])
+            if StockSummary.enabled:
+                deltas = {}
+                for item in items:
+                    StockSummary.add_delta(deltas, item, 1)
+                StockSummary.apply(db.session, deltas)
+            if ItemChange.enabled:
+                # the new ids are not read back, so consumers see one import marker
+                ItemChange.record(db.session, [{"op": "import", "data": {"count": len(items)}}])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info("Bulk inserted %d items", len(items))
+        return len(items)
+
+    @classmethod
+    def allocate_ids(cls, count: int):
+        """Takes count new Item ids from the id sequence in one query
+
+        Rows inserted with these ids never collide with rows that take their
+        id from the sequence. Databases without sequences (e.g. SQLite) return
+        None, and the caller inserts row by row to learn the new ids.
+
+        :return: the new ids in ascending order, or None
+        :rtype: list
+        """
+        table = cls.__table__
+        bind = db.session.get_bind(clause=table.insert())
+        if bind.dialect.name != "postgresql":
+            return None
+        if not count:
+            return []
+        sequence = func.pg_get_serial_sequence(table.name, table.c.id.name)
+        return sorted(db.session.execute(
+            select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+        ).scalars().all())
+
+    @classmethod
+    def check_stock(cls, session, item_id: int):
+        """Checks the quantity of an Item written in the session's transaction
+
+        The quantity may not drop below the stock still reserved (see
+        Reservation), and an Item with stock levels must have their total as
+        its quantity.
+
+        :raises InsufficientQuantityError: if the quantity is below the reserved stock
+        :raises StockConflictError: if the quantity is not the total of the stock levels
+        """
+        table = cls.__table__
+        levels = StockLevel.__table__
+        total = (
+            select(func.sum(levels.c.quantity))
+            .where(levels.c.item_id == table.c.id)
+            .scalar_subquery()
+        )
+        row = session.execute(
+            select(func.coalesce(table.c.quantity, 0), table.c.reserved, total)
+            .where(table.c.id == item_id)
+        ).first()
+        if row is None:
+            return
+        quantity, reserved, located = row
+        if quantity < reserved:
+            raise InsufficientQuantityError.reserved(item_id, reserved)
+        if located is not None and quantity != located:
+            raise StockConflictError.located(item_id, located)
+
+    @classmethod
+    def adjust_quantity(cls, item_id: int, delta: int, allow_negative: bool = False,
+                        release: int = 0):
+        """Atomically adds delta to the quantity of an Item
+
+        The change is a single UPDATE ... SET quantity = quantity + delta so
+        concurrent adjustments never lose each other's updates. Unless
+        allow_negative is set, a decrease may not take the quantity below the
+        stock still reserved (see Reservation). For an Item with stock levels
+        the delta is also applied to its default location, so the quantity
+        stays their total.
+
+        :param item_id: the id of the Item to adjust
+        :type item_id: int
+        :param delta: the signed amount to add to the quantity
+        :type delta: int
+        :param allow_negative: allow the quantity to drop below zero
+        :type allow_negative: bool
+        :param release: the reserved quantity to release in the same UPDATE
+        :type release: int
+
+        :return: the adjusted Item, or None if it was not found
+        :rtype: Items
+
+        :raises InsufficientQuantityError: if the quantity would drop below the reserved stock
+
+        """
+        logger.info("Adjusting quantity of id %s by %s", item_id, delta)
+        table = cls.__table__
+        new_quantity = func.coalesce(table.c.quantity, 0) + delta
+        statement = (
+            table.update()
+            .where(table.c.id == item_id)
+            .values(quantity=new_quantity, version=table.c.version + 1)
+        )
+        if release:
+            statement = statement.values(reserved=table.c.reserved - release)
+        if not allow_negative:
+            statement = statement.where(new_quantity >= 0)
+            if delta < 0:
+                statement = statement.where(new_quantity >= table.c.reserved - release)
+        dialect = db.engine.dialect
+        if getattr(dialect, "full_returning", False) or getattr(dialect, "update_returning", False):
+            row = db.session.execute(statement.returning(*table.c)).first()
+        else:
+            result = db.session.execute(statement)
+            row = None
+            if result.rowcount:
+                row = db.session.execute(table.select().where(table.c.id == item_id)).first()
+        if row is not None:
+            StockLevel.adjust_default(item_id, delta)
+        if row is not None and StockSummary.enabled:
+            StockSummary.apply(db.session, {(row.category, row.condition): [0, delta]})
+        if row is not None and ItemChange.enabled:
+            ItemChange.record(db.session, [ItemChange.for_item("update", cls(**dict(row._mapping)))])  # pylint: disable=protected-access
+        db.session.commit()
+        if row is None:
+            if db.session.query(cls.id).filter(cls.id == item_id).first() is None:
+                return None
+            raise InsufficientQuantityError(
+                "Item with id '{}' does not have {} unreserved in stock".format(item_id, -delta)
+            )
+        cache.invalidate(item_id)
+        return cls(**dict(row._mapping))  # pylint: disable=protected-access
+
+    @staticmethod
+    def _parse_operation(operation) -> tuple:
+        """Validates a single batch operation and returns (op, id, item)"""
+        if not isinstance(operation, dict):
+            raise DataValidationError("Invalid operation: must be an object")
+        kind = operation.get("op")
+        if kind not in ("create", "update", "delete"):
+            raise DataValidationError("Invalid operation: unknown op " + repr(kind))
+        item_id = operation.get("id")
+        if kind != "create" and (not isinstance(item_id, int) or isinstance(item_id, bool)):
+            raise DataValidationError("Invalid operation: " + kind + " requires an integer id")
+        item = None
+        if kind != "delete":
+            item = Items().deserialize(operation.get("item"))
+            item.id = item_id if kind == "update" else None
+        return kind, item_id, item
 
     @classmethod
     def all(cls) -> list:
@@ -185,3 +709,1055 @@ class Items(db.Model):
         logger.info("Processing category query for %s ...", category)
         return cls.query.filter(cls.category == category)
 
+    @classmethod
+    def build_query(cls, category=None, name=None, condition=None,
+                    min_qty=None, max_qty=None, sort=None, location=None):  # pylint: disable=too-many-arguments
+        """Returns a query that applies every given filter in SQL
+
+        :param category: only Items in this category
+        :param name: only Items with this name
+        :param condition: only Items in this Condition, by name (e.g. "NEW")
+        :param min_qty: only Items with at least this quantity
+        :param max_qty: only Items with at most this quantity
+        :param sort: field names to order by, "-" prefixed for descending
+        :param location: only Items in stock at this location
+
+        :return: the filtered and ordered query
+        :raises DataValidationError: if a condition or sort field is unknown
+
+        """
+        logger.info("Processing query for category=%s name=%s condition=%s "
+                    "quantity=[%s, %s] sort=%s location=%s ...",
+                    category, name, condition, min_qty, max_qty, sort, location)
+        query = cls.find_by_category(category) if category else cls.query
+        criteria, ordering = cls.filter_criteria(
+            name=name, condition=condition, min_qty=min_qty, max_qty=max_qty, sort=sort,
+            location=location,
+        )
+        return query.filter(*criteria).order_by(*ordering)
+
+    @classmethod
+    def filter_criteria(cls, category=None, name=None, condition=None,
+                        min_qty=None, max_qty=None, sort=None, location=None) -> tuple:  # pylint: disable=too-many-arguments
+        """Returns the WHERE criteria and ORDER BY columns for the list filters
+
+        These are plain SQL expressions, so the same validation and filters
+        serve both build_query() and statements run on an async session.
+
+        :return: a (criteria, ordering) tuple of lists
+        :raises DataValidationError: if a condition or sort field is unknown
+
+        """
+        criteria = []
+        if category:
+            criteria.append(cls.category == category)
+        if name:
+            criteria.append(cls.name == name)
+        if condition:
+            if condition not in Condition.__members__:
+                raise DataValidationError("Invalid condition: " + condition)
+            criteria.append(cls.condition == Condition[condition])
+        if min_qty is not None:
+            criteria.append(cls.quantity >= min_qty)
+        if max_qty is not None:
+            criteria.append(cls.quantity <= max_qty)
+        if location:
+            # an indexed semi-join on stock_levels (location, item_id)
+            in_stock = select(StockLevel.item_id).where(
+                StockLevel.location == location, StockLevel.quantity > 0
+            )
+            criteria.append(cls.id.in_(in_stock))
+        ordering = []
+        for field in sort or []:
+            column_name = field.lstrip("-")
+            if column_name not in cls.SORT_FIELDS:
+                raise DataValidationError("Invalid sort field: " + column_name)
+            column = getattr(cls, column_name)
+            ordering.append(column.desc() if field.startswith("-") else column)
+        return criteria, ordering
+
+    @classmethod
+    def find_page(cls, limit: int, after: int = None, query=None) -> list:
+        """Returns the next page of Items using keyset pagination on the id
+
+        :param limit: the maximum number of Items to return
+        :type limit: int
+        :param after: only return Items with an id greater than this cursor
+        :type after: int
+        :param query: an optional filtered query to paginate (defaults to all)
+
+        :return: up to limit Items ordered by id
+        :rtype: list
+
+        """
+        return cls.page_query(limit, after, query).all()
+
+    @classmethod
+    def page_query(cls, limit: int, after: int = None, query=None):
+        """Returns the query for one keyset page of Items ordered by id"""
+        logger.info("Processing page query after %s limit %s ...", after, limit)
+        if query is None:
+            query = cls.query
+        if after is not None:
+            query = query.filter(cls.id > after)
+        return query.order_by(cls.id).limit(limit)
+
+    @classmethod
+    def serialize_rows(cls, query, fields=None) -> list:
+        """Serializes the Items matched by a query without loading ORM objects
+
+        Only the columns are selected, as plain tuples, which skips the
+        cost of building and tracking an Items instance for every row.
+
+        :param query: the query to serialize, e.g. from find_by_name()
+        :param fields: only select and return these fields; id and version
+            are always included so results can be paged and tagged
+
+        :return: a list of serialized Items, as serialize() would return
+        :rtype: list
+
+        """
+        columns = cls.projection(fields)
+        rows = query.with_entities(*[getattr(cls, field) for field in columns])
+        return cls.rows_to_dicts(columns, rows)
+
+    @classmethod
+    def projection(cls, fields=None) -> list:
+        """Returns the field names to select for a fields= projection
+
+        :raises DataValidationError: if a field is unknown
+
+        """
+        if not fields:
+            return list(cls.FIELDS)
+        unknown = [field for field in fields if field not in cls.FIELDS]
+        if unknown:
+            raise DataValidationError("Invalid fields: " + ", ".join(unknown))
+        return [field for field in cls.FIELDS if field in fields or field in ("id", "version")]
+
+    @classmethod
+    def rows_to_dicts(cls, columns: list, rows) -> list:
+        """Turns column tuples selected in projection() order into dictionaries"""
+        if columns == list(cls.FIELDS):
+            return [
+                {
+                    "id": item_id,
+                    "name": name,
+                    "category": category,
+                    "quantity": quantity,
+                    "condition": condition.name,
+                    "version": version,
+                }
+                for item_id, name, category, quantity, condition, version in rows
+            ]
+        results = []
+        for row in rows:
+            data = dict(zip(columns, row))
+            if "condition" in data:
+                data["condition"] = data["condition"].name
+            results.append(data)
+        return results
+
+    @classmethod
+    def iter_pages(cls, batch_size: int, query=None, fields=None):
+        """Yields every serialized Item one keyset page at a time
+
+        Memory stays bounded because only one page of rows is held at once.
+
+        :param batch_size: the number of Items to fetch per round trip
+        :type batch_size: int
+        :param query: an optional filtered query to walk (defaults to all)
+        :param fields: only return these fields (see serialize_rows)
+
+        """
+        after = None
+        while True:
+            page = cls.serialize_rows(cls.page_query(batch_size, after, query), fields)
+            yield from page
+            if len(page) < batch_size:
+                return
+            after = page[-1]["id"]
+
+    @classmethod
+    def iter_rows(cls, batch_size: int, query=None, fields=None):
+        """Yields every serialized Item of a query from a server-side cursor
+
+        Unlike iter_pages() this keeps the query's own ordering and runs it
+        once, fetching batch_size rows at a time (stream_results).
+
+        :param batch_size: the number of rows to fetch per round trip
+        :type batch_size: int
+        :param query: an optional filtered query to walk (defaults to all)
+        :param fields: only return these fields (see serialize_rows)
+
+        """
+        columns = cls.projection(fields)
+        query = query if query is not None else cls.query.order_by(cls.id)
+        statement = query.with_entities(*[getattr(cls, field) for field in columns]).statement
+        result = db.session.execute(statement, execution_options={"stream_results": True})
+        for rows in result.partitions(batch_size):
+            yield from cls.rows_to_dicts(columns, rows)
+
+    @classmethod
+    def summary(cls, group_by=None) -> list:
+        """Returns the number of Items and their total quantity per group
+
+        Computed with GROUP BY on the items table, or read from the much
+        smaller StockSummary table when SUMMARY_TABLE_ENABLED is set.
+
+        :param group_by: the fields to group by (category and/or condition);
+            no fields gives one overall total
+        :type group_by: list
+
+        :return: one dictionary per group with its count and quantity
+        :rtype: list
+        :raises DataValidationError: if a group by field is unknown
+
+        """
+        group_by = group_by or []
+        unknown = [field for field in group_by if field not in StockSummary.GROUP_FIELDS]
+        if unknown:
+            raise DataValidationError("Invalid group_by fields: " + ", ".join(unknown))
+        fields = [field for field in StockSummary.GROUP_FIELDS if field in group_by]
+        if StockSummary.enabled:
+            source = StockSummary
+            count = func.coalesce(func.sum(StockSummary.item_count), 0)
+            quantity = func.coalesce(func.sum(StockSummary.total_quantity), 0)
+        else:
+            source = cls
+            count = func.count(cls.id)
+            quantity = func.coalesce(func.sum(cls.quantity), 0)
+        columns = [getattr(source, field) for field in fields]
+        query = db.session.query(*columns, count, quantity)
+        if columns:
+            query = query.group_by(*columns).having(count > 0).order_by(*columns)
+        results = []
+        for row in query:
+            group = dict(zip(fields, row))
+            if "condition" in group:
+                group["condition"] = group["condition"].name
+            group["count"] = int(row[-2])
+            group["quantity"] = int(row[-1])
+            results.append(group)
+        return results
+
+
+######################################################################
+#  S T O C K   L E V E L S
+######################################################################
+class StockLevel(db.Model):
+    """
+    The quantity of an Item held at one location (e.g. a warehouse)
+
+    Keyed by (item_id, location), so the stock of an Item is found with the
+    primary key index and the Items at a location with ix_stock_levels_location.
+
+    Once an Item has stock levels they are authoritative and Items.quantity
+    is their total, kept in the same transaction as every write:
+        - the first set_level() seeds default_location with the Item's
+          existing quantity, so no stock is lost
+        - set_level() sets Items.quantity to the new total
+        - Items.adjust_quantity() (and so committed reservations) applies
+          its delta to default_location as well, which may take that level
+          below zero when stock leaves without saying from where
+        - disabling an Item zeroes every level
+        - any other write of the quantity (PUT, batch updates) that does not
+          equal the total is refused with StockConflictError
+    Every level change bumps the Item's version, so ETags and caches of the
+    Item see it.
+    """
+
+    default_location = "default"
+
+    __tablename__ = "stock_levels"
+
+    item_id = db.Column(
+        db.Integer, db.ForeignKey("items.id", ondelete="CASCADE"), primary_key=True
+    )
+    location = db.Column(db.String(63), primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (db.Index("ix_stock_levels_location", "location", "item_id"),)
+
+    def __repr__(self):
+        return "<StockLevel item=[%s] %r>" % (self.item_id, self.location)
+
+    @classmethod
+    def availability(cls, item_id: int) -> dict:
+        """Returns the stock of an Item at every location and in total
+
+        One query: the per-location rows carry the total as a window sum.
+
+        :param item_id: the id of the Item
+        :type item_id: int
+
+        :return: the locations with their quantities, and the total
+        :rtype: dict
+
+        """
+        total = func.sum(cls.quantity).over()
+        rows = (
+            db.session.query(cls.location, cls.quantity, total)
+            .filter(cls.item_id == item_id)
+            .order_by(cls.location)
+            .all()
+        )
+        return {
+            "item_id": item_id,
+            "locations": [{"location": row[0], "quantity": row[1]} for row in rows],
+            "total": int(rows[0][2]) if rows else 0,
+        }
+
+    @classmethod
+    def for_items(cls, item_ids: list) -> dict:
+        """Returns the stock of many Items with one query, to avoid N+1 reads
+
+        :param item_ids: the ids of the Items
+        :type item_ids: list
+
+        :return: maps each item id to a {location: quantity} dictionary
+        :rtype: dict
+
+        """
+        stock = {item_id: {} for item_id in item_ids}
+        if item_ids:
+            rows = db.session.query(cls.item_id, cls.location, cls.quantity).filter(
+                cls.item_id.in_(item_ids)
+            ).order_by(cls.item_id, cls.location)
+            for item_id, location, quantity in rows:
+                stock[item_id][location] = quantity
+        return stock
+
+    @classmethod
+    def set_level(cls, item_id: int, location: str, quantity: int) -> bool:
+        """Sets the quantity of an Item at a location in one transaction
+
+        The Item's quantity becomes the total of its stock levels. The first
+        level set for an Item also records its existing quantity at
+        default_location.
+
+        :param item_id: the id of the Item
+        :param location: the location name
+        :param quantity: the new quantity at the location (0 or more)
+
+        :return: False if the Item was not found
+        :rtype: bool
+        :raises DataValidationError: if the location or quantity is invalid
+        :raises InsufficientQuantityError: if the total would drop below the reserved stock
+
+        """
+        if not location or len(location) > cls.__table__.c.location.type.length:
+            raise DataValidationError("Invalid location: " + str(location))
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 0:
+            raise DataValidationError("Invalid quantity: must be a non-negative integer")
+        items = Items.__table__
+        table = cls.__table__
+        try:
+            # locks the Item row, so concurrent level changes sum in turn
+            bumped = db.session.execute(
+                items.update().where(items.c.id == item_id).values(version=items.c.version + 1)
+            ).rowcount
+            if not bumped:
+                db.session.rollback()
+                return False
+            before = db.session.execute(
+                select(items.c.version, items.c.quantity, items.c.category, items.c.condition)
+                .where(items.c.id == item_id)
+            ).first()
+            first = db.session.execute(
+                select(table.c.location).where(table.c.item_id == item_id).limit(1)
+            ).first() is None
+            if first and before.quantity and location != cls.default_location:
+                # the stock the Item had before it was tracked per location
+                db.session.execute(table.insert().values(
+                    item_id=item_id, location=cls.default_location, quantity=before.quantity or 0
+                ))
+            dialect = db.session.get_bind(clause=table.insert()).dialect.name
+            insert = postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table)
+            db.session.execute(
+                insert.values(item_id=item_id, location=location, quantity=quantity)
+                .on_conflict_do_update(
+                    index_elements=[table.c.item_id, table.c.location],
+                    set_={"quantity": quantity},
+                )
+            )
+            total = db.session.execute(
+                select(func.coalesce(func.sum(table.c.quantity), 0))
+                .where(table.c.item_id == item_id)
+            ).scalar()
+            db.session.execute(
+                items.update().where(items.c.id == item_id).values(quantity=total)
+            )
+            Items.check_stock(db.session, item_id)
+            if StockSummary.enabled:
+                StockSummary.apply(db.session, {
+                    (before.category, before.condition): [0, total - (before.quantity or 0)]
+                })
+            if ItemChange.enabled:
+                ItemChange.record(db.session, [{
+                    "item_id": item_id, "op": "stock", "version": before.version,
+                    "data": {"location": location, "quantity": quantity, "total": total},
+                }])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.invalidate(item_id)
+        return True
+
+    @classmethod
+    def adjust_default(cls, item_id: int, delta: int):
+        """Adds delta to an Item's default location, if the Item has stock levels
+
+        Runs in the caller's transaction, after the Item row was locked.
+        """
+        table = cls.__table__
+        moved = db.session.execute(
+            table.update()
+            .where(table.c.item_id == item_id, table.c.location == cls.default_location)
+            .values(quantity=table.c.quantity + delta)
+        ).rowcount
+        if not moved and db.session.execute(
+            select(table.c.location).where(table.c.item_id == item_id).limit(1)
+        ).first() is not None:
+            db.session.execute(table.insert().values(
+                item_id=item_id, location=cls.default_location, quantity=delta
+            ))
+
+
+######################################################################
+#  R E S E R V A T I O N S
+######################################################################
+class Reservation(db.Model):
+    """
+    A quantity of an Item held for a limited time, e.g. during checkout
+
+    Holding stock does not lock the Item: reserve() adds to Items.reserved
+    in one conditional UPDATE, so the available quantity is simply
+    quantity - reserved. A reservation is either committed (the quantity is
+    taken off the Item), released, or removed by sweep() once it expires;
+    ix_reservations_expires_at lets the sweeper find expired rows without
+    scanning the table.
+    """
+
+    __tablename__ = "reservations"
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(
+        db.Integer, db.ForeignKey("items.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return "<Reservation %s item=[%s] quantity=%s>" % (self.id, self.item_id, self.quantity)
+
+    def serialize(self) -> dict:
+        """Serializes a Reservation into a dictionary"""
+        return {
+            "id": self.id,
+            "item_id": self.item_id,
+            "quantity": self.quantity,
+            "expires_at": self.expires_at.isoformat(),
+            "created_at": self.created_at.isoformat(),
+        }
+
+    @classmethod
+    def reserve(cls, item_id: int, quantity: int, ttl: int):
+        """Holds a quantity of an Item for ttl seconds
+
+        :param item_id: the id of the Item
+        :param quantity: the quantity to hold (1 or more)
+        :param ttl: the number of seconds before the hold expires
+
+        :return: the new Reservation, or None if the Item was not found
+        :rtype: Reservation
+        :raises DataValidationError: if the quantity or ttl is invalid
+        :raises InsufficientQuantityError: if less than quantity is available
+
+        """
+        for name, value in (("quantity", quantity), ("ttl", ttl)):
+            if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                raise DataValidationError(
+                    "Invalid {}: must be a positive integer".format(name)
+                )
+        logger.info("Reserving %s of id %s for %ss", quantity, item_id, ttl)
+        items = Items.__table__
+        available = func.coalesce(items.c.quantity, 0) - items.c.reserved
+        now = datetime.utcnow()
+        try:
+            held = db.session.execute(
+                items.update()
+                .where(items.c.id == item_id)
+                .where(available >= quantity)
+                .values(reserved=items.c.reserved + quantity)
+            ).rowcount
+            if not held:
+                db.session.rollback()
+                if db.session.query(Items.id).filter(Items.id == item_id).first() is None:
+                    return None
+                raise InsufficientQuantityError(
+                    "Item with id '{}' does not have {} available".format(item_id, quantity)
+                )
+            reservation = cls(
+                item_id=item_id,
+                quantity=quantity,
+                created_at=now,
+                expires_at=now + timedelta(seconds=ttl),
+            )
+            db.session.add(reservation)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return reservation
+
+    @classmethod
+    def active(cls, item_id: int) -> dict:
+        """Returns the quantity, reserved and available stock of an Item
+
+        :param item_id: the id of the Item
+
+        :return: the stock and the unexpired reservations, or None if the
+            Item was not found
+        :rtype: dict
+
+        """
+        row = db.session.query(Items.quantity, Items.reserved).filter(
+            Items.id == item_id
+        ).first()
+        if row is None:
+            return None
+        reservations = cls.query.filter(
+            cls.item_id == item_id, cls.expires_at > datetime.utcnow()
+        ).order_by(cls.expires_at)
+        quantity = row.quantity or 0
+        return {
+            "item_id": item_id,
+            "quantity": quantity,
+            "reserved": row.reserved,
+            "available": quantity - row.reserved,
+            "reservations": [reservation.serialize() for reservation in reservations],
+        }
+
+    @classmethod
+    def _delete(cls, criteria, *columns) -> list:
+        """Deletes the reservations matching criteria and returns their columns
+
+        Uses DELETE ... RETURNING where the dialect supports it, otherwise
+        locks and reads the rows first and deletes them by id.
+        """
+        table = cls.__table__
+        statement = table.delete().where(criteria)
+        dialect = db.session.get_bind(clause=statement).dialect
+        if getattr(dialect, "full_returning", False) or getattr(dialect, "delete_returning", False):
+            return db.session.execute(statement.returning(*columns)).all()
+        rows = db.session.execute(
+            select(table.c.id, *columns).where(criteria).with_for_update()
+        ).all()
+        if rows:
+            db.session.execute(table.delete().where(table.c.id.in_([row[0] for row in rows])))
+        return [tuple(row[1:]) for row in rows]
+
+    @classmethod
+    def release(cls, item_id: int, reservation_id: int) -> bool:
+        """Releases a reservation, making its quantity available again
+
+        :return: False if the reservation was not found (or already expired)
+        :rtype: bool
+
+        """
+        table = cls.__table__
+        items = Items.__table__
+        try:
+            rows = cls._delete(
+                and_(table.c.id == reservation_id, table.c.item_id == item_id), table.c.quantity
+            )
+            if not rows:
+                db.session.rollback()
+                return False
+            quantity = rows[0][0]
+            db.session.execute(
+                items.update()
+                .where(items.c.id == item_id)
+                .values(reserved=items.c.reserved - quantity)
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        logger.info("Released reservation %s of %s", reservation_id, quantity)
+        return True
+
+    @classmethod
+    def commit(cls, item_id: int, reservation_id: int):
+        """Takes the quantity of an unexpired reservation off the Item
+
+        The reservation is deleted and the quantity and reserved counts are
+        lowered together with Items.adjust_quantity(), in one transaction.
+
+        :return: the adjusted Item, or None if the reservation was not found
+            or has expired
+        :rtype: Items
+
+        """
+        table = cls.__table__
+        try:
+            rows = cls._delete(
+                and_(
+                    table.c.id == reservation_id,
+                    table.c.item_id == item_id,
+                    table.c.expires_at > datetime.utcnow(),
+                ),
+                table.c.quantity,
+            )
+        except Exception:
+            db.session.rollback()
+            raise
+        if not rows:
+            db.session.rollback()
+            return None
+        quantity = rows[0][0]
+        # the stock was set aside when reserving, so the hold is always honoured
+        return Items.adjust_quantity(item_id, -quantity, allow_negative=True, release=quantity)
+
+    @classmethod
+    def sweep(cls, batch_size: int) -> int:
+        """Releases up to batch_size expired reservations in one transaction
+
+        The expired rows are picked in expiry order with FOR UPDATE SKIP
+        LOCKED, so several workers can sweep at once without waiting on each
+        other, and the reserved counts are lowered once per Item.
+
+        :param batch_size: the most reservations to release
+        :type batch_size: int
+
+        :return: the number of reservations released
+        :rtype: int
+
+        """
+        table = cls.__table__
+        items = Items.__table__
+        expired = (
+            select(table.c.id)
+            .where(table.c.expires_at <= datetime.utcnow())
+            .order_by(table.c.expires_at)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        try:
+            rows = cls._delete(table.c.id.in_(expired), table.c.item_id, table.c.quantity)
+            released = {}
+            for item_id, quantity in rows:
+                released[item_id] = released.get(item_id, 0) + quantity
+            if released:
+                # in id order, so concurrent sweeps lock Items in the same order
+                db.session.execute(
+                    items.update()
+                    .where(items.c.id == bindparam("item"))
+                    .values(reserved=items.c.reserved - bindparam("released")),
+                    [{"item": item_id, "released": released[item_id]}
+                     for item_id in sorted(released)],
+                )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if rows:
+            logger.info("Released %d expired reservations", len(rows))
+        return len(rows)
+
+
+######################################################################
+#  I D E M P O T E N C Y   K E Y S
+######################################################################
+class IdempotencyKey(db.Model):
+    """
+    The stored response of a write sent with an Idempotency-Key header
+
+    A key is claimed before the write runs and holds the response once it
+    has finished, so a retry with the same key gets the stored response
+    without running the write again. Rows are only kept until expires_at:
+    a short lock while the request runs, then the replay window.
+
+    The response is stored after the write has committed, so the write's
+    own transaction already extends the lock to the replay window (see
+    hold). If storing the response then fails, retries are refused as in
+    progress instead of running the write a second time. A claim is only
+    released (see release) if the request never committed.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)  # None while in progress
+    headers = db.Column(db.JSON, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return "<IdempotencyKey %r status=%s>" % (self.key, self.status_code)
+
+    @classmethod
+    def claim(cls, key: str, fingerprint: str, lock_seconds: int):
+        """Claims a key for a request, unless an unexpired claim already holds it
+
+        :param key: the Idempotency-Key header
+        :param fingerprint: a digest of the request the key was sent with
+        :param lock_seconds: how long the claim holds the key if the request
+            never finishes (e.g. the worker dies)
+
+        :return: None if the key was claimed, otherwise the existing
+            IdempotencyKey (in progress if its status_code is None)
+        :rtype: IdempotencyKey
+
+        """
+        table = cls.__table__
+        now = datetime.utcnow()
+        values = {
+            "key": key, "fingerprint": fingerprint, "status_code": None,
+            "headers": None, "body": None, "expires_at": now + timedelta(seconds=lock_seconds),
+        }
+        try:
+            dialect = db.session.get_bind(clause=table.insert()).dialect.name
+            insert = postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table)
+            claimed = db.session.execute(
+                insert.values(**values).on_conflict_do_update(
+                    index_elements=[table.c.key],
+                    set_={name: value for name, value in values.items() if name != "key"},
+                    where=table.c.expires_at <= now,  # take over expired keys only
+                )
+            ).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if claimed:
+            return None
+        return cls.query.get(key)
+
+    @classmethod
+    def hold(cls, session, key: str, ttl: int):
+        """Keeps an in-progress claim for ttl seconds, in the session's transaction"""
+        table = cls.__table__
+        session.execute(
+            table.update()
+            .where(table.c.key == key, table.c.status_code.is_(None))
+            .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl))
+        )
+
+    @classmethod
+    def complete(cls, key: str, status_code: int, headers: dict, body: bytes, ttl: int):
+        """Stores the response of a claimed key for ttl seconds"""
+        table = cls.__table__
+        try:
+            db.session.execute(
+                table.update().where(table.c.key == key).values(
+                    status_code=status_code, headers=headers, body=body,
+                    expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+                )
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    @classmethod
+    def release(cls, key: str):
+        """Drops a claim whose request failed, so a retry runs it again"""
+        db.session.rollback()
+        db.session.execute(cls.__table__.delete().where(cls.__table__.c.key == key))
+        db.session.commit()
+
+    @classmethod
+    def purge(cls, batch_size: int) -> int:
+        """Deletes up to batch_size expired keys
+
+        :return: the number of keys deleted
+        :rtype: int
+
+        """
+        table = cls.__table__
+        expired = (
+            select(table.c.key)
+            .where(table.c.expires_at <= datetime.utcnow())
+            .order_by(table.c.expires_at)
+            .limit(batch_size)
+        )
+        try:
+            deleted = db.session.execute(table.delete().where(table.c.key.in_(expired))).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return deleted
+
+
+######################################################################
+#  S T O C K   S U M M A R Y
+######################################################################
+class StockSummary(db.Model):
+    """
+    Running Item counts and quantities per category and Condition
+
+    When SUMMARY_TABLE_ENABLED is set every write to Items also applies its
+    change to this table in the same transaction, so Items.summary() reads a
+    handful of rows instead of scanning the items table.
+    """
+
+    enabled = False
+    GROUP_FIELDS = ("category", "condition")
+
+    category = db.Column(db.String(63), primary_key=True)
+    condition = db.Column(db.Enum(Condition), primary_key=True)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return "<StockSummary %r %s>" % (self.category, self.condition)
+
+    @staticmethod
+    def add_delta(deltas: dict, item, sign: int):
+        """Adds (sign = 1) or takes away (sign = -1) an Item from deltas
+
+        :param deltas: maps (category, condition) to [count, quantity] changes
+        :param item: an Item or a row with category, condition and quantity
+        :param sign: 1 for an Item that is added, -1 for one that is removed
+
+        """
+        key = (item.category, item.condition or Condition.NEW)
+        change = deltas.setdefault(key, [0, 0])
+        change[0] += sign
+        change[1] += sign * (item.quantity or 0)
+
+    @classmethod
+    def apply(cls, session, deltas: dict):
+        """Applies count and quantity changes with one upsert per group"""
+        changes = [
+            {"category": category, "condition": condition,
+             "item_count": count, "total_quantity": quantity}
+            for (category, condition), (count, quantity) in deltas.items()
+            if count or quantity
+        ]
+        if not changes:
+            return
+        table = cls.__table__
+        dialect = session.get_bind(clause=table.insert()).dialect.name
+        insert = postgresql.insert(table) if dialect == "postgresql" else sqlite.insert(table)
+        statement = insert.on_conflict_do_update(
+            index_elements=[table.c.category, table.c.condition],
+            set_={
+                "item_count": table.c.item_count + insert.excluded.item_count,
+                "total_quantity": table.c.total_quantity + insert.excluded.total_quantity,
+            },
+        )
+        session.execute(statement, changes)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every summary row from the items table"""
+        logger.info("Rebuilding the stock summary")
+        table = cls.__table__
+        totals = db.session.query(
+            Items.category,
+            Items.condition,
+            func.count(Items.id),
+            func.coalesce(func.sum(Items.quantity), 0),
+        ).group_by(Items.category, Items.condition)
+        try:
+            db.session.execute(table.delete())
+            db.session.execute(
+                table.insert().from_select(
+                    ["category", "condition", "item_count", "total_quantity"],
+                    totals.statement,
+                )
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+######################################################################
+#  C H A N G E   L O G
+######################################################################
+class ItemChange(db.Model):
+    """
+    Append-only log of the changes made to Items
+
+    Every create, update and delete of an Item adds a row in the same
+    transaction, numbered by an increasing seq, so consumers can fetch the
+    changes after the last seq they saw instead of re-reading every Item.
+
+    A seq is taken when the row is inserted, not when it commits, so on
+    PostgreSQL writers take a transaction-level advisory lock before they
+    insert change rows. The lock is held until commit, so seqs become
+    visible in order and a consumer that has seen a seq never misses a
+    lower one. (SQLite has a single writer, which gives the same order.)
+    Rows older than the retention period are deleted by purge().
+    """
+
+    __tablename__ = "item_changes"
+    enabled = True
+    OPS = ("create", "update", "delete", "import", "stock")
+    LOCK_KEY = 0x1743  # pg_advisory_xact_lock key that orders the seqs
+
+    seq = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    item_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String(16), nullable=False)
+    version = db.Column(db.Integer, nullable=True)
+    data = db.Column(db.JSON, nullable=True)
+    changed_at = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, server_default=func.now()
+    )
+
+    def __repr__(self):
+        return "<ItemChange %s %s id=[%s]>" % (self.seq, self.op, self.item_id)
+
+    def serialize(self) -> dict:
+        """Serializes a change into a dictionary"""
+        return {
+            "seq": self.seq,
+            "op": self.op,
+            "item_id": self.item_id,
+            "version": self.version,
+            "item": self.data,
+            "changed_at": self.changed_at.isoformat() if self.changed_at else None,
+        }
+
+    @staticmethod
+    def for_item(op: str, item) -> dict:
+        """Returns the change row for an Item that was created or updated"""
+        data = {field: getattr(item, field) for field in Items.FIELDS}
+        data["condition"] = getattr(item.condition, "name", item.condition)
+        return {"item_id": item.id, "op": op, "version": item.version, "data": data}
+
+    @classmethod
+    def record(cls, session, changes: list):
+        """Appends change rows in the session's transaction"""
+        if changes:
+            rows = [dict({"item_id": None, "version": None, "data": None}, **change)
+                    for change in changes]
+            insert = cls.__table__.insert()
+            connection = session.connection(bind_arguments={"clause": insert})
+            if connection.dialect.name == "postgresql":
+                # released at commit, so no later seq can commit before this one
+                connection.execute(
+                    text("SELECT pg_advisory_xact_lock(:key)"), {"key": cls.LOCK_KEY}
+                )
+            session.execute(insert, rows)
+
+    @classmethod
+    def purge(cls, days: float, batch_size: int) -> int:
+        """Deletes up to batch_size changes older than days, oldest first
+
+        :return: the number of changes deleted
+        :rtype: int
+
+        """
+        table = cls.__table__
+        expired = (
+            select(table.c.seq)
+            .where(table.c.changed_at < datetime.utcnow() - timedelta(days=days))
+            .order_by(table.c.seq)
+            .limit(batch_size)
+        )
+        try:
+            deleted = db.session.execute(table.delete().where(table.c.seq.in_(expired))).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        return deleted
+
+    @classmethod
+    def since(cls, seq: int = None, limit: int = None) -> list:
+        """Returns the changes after a seq, oldest first
+
+        :param seq: only changes with a greater seq (None for every change)
+        :type seq: int
+        :param limit: return at most this many changes
+
+        :return: the serialized changes
+        :rtype: list
+
+        """
+        query = cls.query
+        if seq is not None:
+            query = query.filter(cls.seq > seq)
+        return [change.serialize() for change in query.order_by(cls.seq).limit(limit)]
+
+
+def _committed(session, item):
+    """Returns the category, condition and quantity an Item had in the database"""
+    names = StockSummary.GROUP_FIELDS + ("quantity",)
+    values = {}
+    for name in names:
+        history = inspect(item).attrs[name].history
+        if history.added and not history.deleted:
+            # set while expired, so the old value was never loaded
+            row = session.query(*[getattr(Items, name) for name in names]).filter(
+                Items.id == item.id
+            ).one()
+            return SimpleNamespace(**dict(zip(names, row)))
+        values[name] = history.deleted[0] if history.deleted else getattr(item, name)
+    return SimpleNamespace(**values)
+
+
+@event.listens_for(orm.Session, "before_flush")
+def _update_stock_summary(session, flush_context, instances):  # pylint: disable=unused-argument
+    """Applies the Items created, changed or deleted by a flush to the summary"""
+    if not StockSummary.enabled:
+        return
+    deltas = {}
+    for item in session.new:
+        if isinstance(item, Items):
+            StockSummary.add_delta(deltas, item, 1)
+    for item in session.dirty:
+        if isinstance(item, Items) and session.is_modified(item):
+            StockSummary.add_delta(deltas, _committed(session, item), -1)
+            StockSummary.add_delta(deltas, item, 1)
+    for item in session.deleted:
+        if isinstance(item, Items):
+            StockSummary.add_delta(deltas, _committed(session, item), -1)
+    StockSummary.apply(session, deltas)
+
+
+@event.listens_for(orm.Session, "before_commit")
+def _hold_idempotency_key(session):
+    """Holds the claimed Idempotency-Key of a request in its first write transaction"""
+    pending = session.info.pop("idempotency_key", None)
+    if pending is not None:
+        IdempotencyKey.hold(session, *pending)
+        session.info["idempotency_holding"] = pending
+
+
+@event.listens_for(orm.Session, "after_commit")
+def _idempotency_key_held(session):
+    """Marks the request's write as committed once the transaction holding its key has"""
+    if session.info.pop("idempotency_holding", None) is not None:
+        session.info["idempotency_committed"] = True
+
+
+@event.listens_for(orm.Session, "after_rollback")
+def _idempotency_key_not_held(session):
+    """Holds the key in the next write transaction if the one holding it rolled back"""
+    pending = session.info.pop("idempotency_holding", None)
+    if pending is not None:
+        session.info["idempotency_key"] = pending
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _record_item_changes(session, flush_context):  # pylint: disable=unused-argument
+    """Appends the Items created, updated or deleted by a flush to the change log"""
+    if not ItemChange.enabled:
+        return
+    changes = [ItemChange.for_item("create", item)
+               for item in session.new if isinstance(item, Items)]
+    changes.extend(ItemChange.for_item("update", item) for item in session.dirty
+                   if isinstance(item, Items) and session.is_modified(item))
+    changes.extend({"item_id": item.id, "op": "delete", "version": item.version}
+                   for item in session.deleted if isinstance(item, Items))
+    ItemChange.record(session, changes)
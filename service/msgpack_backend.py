@@ -0,0 +1,99 @@
+"""
+Module: msgpack_backend
+
+Compact binary (MessagePack) encoding for large responses
+
+Clients that send Accept: application/msgpack get list responses encoded as
+MessagePack, which is smaller than JSON and cheaper to parse. The msgpack
+package is used when it is installed, otherwise a pure Python encoder that
+handles the types our responses contain (dict, list, str, int, float, bool
+and None).
+"""
+import struct
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MEDIA_TYPE = "application/msgpack"
+MEDIA_TYPES = (MEDIA_TYPE, "application/x-msgpack")
+
+
+def _pack(value, out: list):  # pylint: disable=too-many-branches
+    """Appends the MessagePack encoding of value to out"""
+    if value is None:
+        out.append(b"\xc0")
+    elif value is True:
+        out.append(b"\xc3")
+    elif value is False:
+        out.append(b"\xc2")
+    elif isinstance(value, int):
+        if 0 <= value < 0x80:
+            out.append(struct.pack("B", value))
+        elif -0x20 <= value < 0:
+            out.append(struct.pack("b", value))
+        elif 0 <= value <= 0xFFFFFFFF:
+            out.append(struct.pack(">BI", 0xCE, value))
+        elif 0 <= value <= 0xFFFFFFFFFFFFFFFF:
+            out.append(struct.pack(">BQ", 0xCF, value))
+        elif -0x80000000 <= value < 0:
+            out.append(struct.pack(">Bi", 0xD2, value))
+        else:
+            out.append(struct.pack(">Bq", 0xD3, value))
+    elif isinstance(value, float):
+        out.append(struct.pack(">Bd", 0xCB, value))
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        size = len(data)
+        if size < 32:
+            out.append(struct.pack("B", 0xA0 | size))
+        elif size < 0x100:
+            out.append(struct.pack(">BB", 0xD9, size))
+        elif size < 0x10000:
+            out.append(struct.pack(">BH", 0xDA, size))
+        else:
+            out.append(struct.pack(">BI", 0xDB, size))
+        out.append(data)
+    elif isinstance(value, (list, tuple)):
+        size = len(value)
+        if size < 16:
+            out.append(struct.pack("B", 0x90 | size))
+        elif size < 0x10000:
+            out.append(struct.pack(">BH", 0xDC, size))
+        else:
+            out.append(struct.pack(">BI", 0xDD, size))
+        for element in value:
+            _pack(element, out)
+    elif isinstance(value, dict):
+        size = len(value)
+        if size < 16:
+            out.append(struct.pack("B", 0x80 | size))
+        elif size < 0x10000:
+            out.append(struct.pack(">BH", 0xDE, size))
+        else:
+            out.append(struct.pack(">BI", 0xDF, size))
+        for key, element in value.items():
+            _pack(key, out)
+            _pack(element, out)
+    else:
+        raise TypeError("Cannot encode {} as MessagePack".format(type(value).__name__))
+
+
+def _python_dumps(data) -> bytes:
+    """Encodes data with the pure Python encoder"""
+    out = []
+    _pack(data, out)
+    return b"".join(out)
+
+
+def backend_name() -> str:
+    """Returns the name of the MessagePack encoder in use"""
+    return "msgpack" if msgpack is not None else "python"
+
+
+def dumps(data) -> bytes:
+    """Encodes data as MessagePack bytes"""
+    if msgpack is not None:
+        return msgpack.packb(data, use_bin_type=True)
+    return _python_dumps(data)
@@ -4,124 +4,466 @@ Inventory Service
 Paths:
 ------
 GET /inventory - Returns a list all of the Items
+GET /inventory?category=&name=&condition=&min_qty=&max_qty=&sort=&fields=
+    - Returns the Items matching every filter, sorted and projected in SQL
+GET /inventory?limit={n}&after={id} - Returns one keyset page of Items
+GET /inventory?stream=true - Streams all of the Items as chunked JSON
+GET /inventory/export?format=csv|ndjson - Streams the matching Items for bulk export
+GET /inventory/search?q=&limit=&fuzzy= - Returns the Items whose names match as you type
+GET /inventory/summary?group_by=category,condition - Returns counts and total quantities
+GET /inventory/changes?since={seq}&limit={n}&wait={s} - Returns the change log after a seq
+    (long-polls for up to wait seconds, or streams Server-Sent Events when the
+    client accepts text/event-stream)
 GET /inventory/{id} - Returns the Item with a given id number
 POST /inventory - creates a new Item record in the database
+POST /inventory:batch - creates, updates and deletes many Items in one transaction
+POST /inventory/import - creates Items from a streamed CSV or NDJSON body
 PUT /inventory/{id} - updates a Item record in the database
 DELETE /inventory/{id} - deletes a Item record in the database
 PUT /inventory/{id}/disable
+GET /inventory/{id}/stock - Returns the stock of an Item per location and in total
+PUT /inventory/{id}/stock/{location} - Sets the stock of an Item at a location
+POST /inventory/{id}/adjust - atomically adds a signed delta to the quantity
+POST /inventory/{id}/reservations - holds a quantity of an Item for a TTL
+GET /inventory/{id}/reservations - Returns the reserved and available stock of an Item
+POST /inventory/{id}/reservations/{rid}/commit - takes a held quantity off the Item
+DELETE /inventory/{id}/reservations/{rid} - releases a held quantity
+
+List responses are MessagePack encoded for clients that send
+Accept: application/msgpack, and responses are gzip/deflate compressed
+for clients that send Accept-Encoding (see compression.py)
+
+GET requests return an ETag and honour If-None-Match with 304 Not Modified,
+PUT /inventory/{id} honours If-Match and rejects stale updates with 412
+
+POST and PUT writes accept an Idempotency-Key header: a retry with the same
+key replays the first response instead of writing again (see idempotency.py)
+
+GET /health - Liveness: the process is up (no database work)
+GET /ready - Readiness: database reachable, fast and not saturated, else 503
+GET /cache/stats - Returns the item cache hit and miss counters
+GET /metrics - Returns request, SQL and serialization timings for Prometheus
 """
 
-from flask import jsonify, request, url_for, make_response, abort
-from werkzeug.exceptions import NotFound
-from service.models import Items
+import time
+import hashlib
+import threading
+from flask import Blueprint, current_app, jsonify, request, url_for, make_response, abort
+from flask import Response, stream_with_context
+from werkzeug.exceptions import NotFound, PreconditionFailed, ServiceUnavailable
+from service.models import Items, ItemChange, StockLevel, Reservation, DataValidationError, db
+from service.cache import cache
+from service.routing import primary_reads
+from service import json_backend, msgpack_backend, metrics, importer, exporter, health, search
+from service.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from service.compression import etag_matches
 from . import status  # HTTP Status Codes
-from . import app  # Import Flask application
+
+api = Blueprint("inventory", __name__)
 
 ######################################################################
 # GET INDEX
 ######################################################################
-@app.route("/")
+@api.route("/")
 def index():
     """Base URL for our service"""
-    return app.send_static_file("index.html")    
+    return current_app.send_static_file("index.html")    
+
+######################################################################
+# HEALTH AND READINESS PROBES
+######################################################################
+@api.route("/health", methods=["GET"])
+def get_health():
+    """Liveness probe: answers as long as the process can serve requests"""
+    return make_response(jsonify(status="OK"), status.HTTP_200_OK)
+
+
+@api.route("/ready", methods=["GET"])
+def get_ready():
+    """Readiness probe: checks the database pool utilisation and a timed SELECT 1"""
+    ready, report = health.check_readiness(db.engine, current_app.config)
+    report["status"] = "OK" if ready else "UNAVAILABLE"
+    if not ready:
+        current_app.logger.warning("Not ready: %s", report["checks"])
+    code = status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+    response = make_response(jsonify(report), code)
+    response.cache_control.no_store = True
+    return response
+
 
 ######################################################################
 # LIST ALL ITEMS
 ######################################################################
-@app.route("/inventory", methods=["GET"])
+@api.route("/inventory", methods=["GET"])
 def list_items():
-    """Returns all of the Items"""
-    app.logger.info("Request for item list")
-    items = []
-    category = request.args.get("category")
-    name = request.args.get("name")
-    if category:
-        items = Items.find_by_category(category)
-    elif name:
-        items = Items.find_by_name(name)
+    """Returns all of the Items
+
+    Optional query parameters:
+        category, name, condition - only Items matching all of the given values
+        min_qty, max_qty - only Items with a quantity in this range
+        location - only Items in stock at this location
+        sort - comma separated fields to order by (id, name, category),
+               prefixed with "-" for descending order
+        fields - comma separated fields to return (id and version always are)
+        limit - return at most this many Items (keyset pagination on id,
+                DEFAULT_PAGE_SIZE if not given, at most MAX_PAGE_SIZE)
+        after - only return Items with an id greater than this cursor
+        stream - when true, stream every matching Item as chunked JSON
+        include - "stock" adds each Item's {location: quantity} stock levels,
+                  read with one query for the whole list
+
+    Unsorted lists are returned one page at a time, with the cursor of the
+    next page in X-Next-Cursor. Sorted lists are not paged and are refused
+    when more than MAX_PAGE_SIZE Items match: narrow the filters, or use
+    stream or /inventory/export.
+    """
+    current_app.logger.info("Request for item list")
+    filters = get_filters()
+    fields = get_list_arg("fields")
+    limit = get_int_arg("limit")
+    after = get_int_arg("after")
+    streamed = request.args.get("stream", "").lower() == "true"
+    paged = limit is not None or after is not None
+    if filters["sort"] and (paged or streamed):
+        raise DataValidationError("sort cannot be combined with limit, after or stream")
+    query = Items.build_query(**filters)
+
+    if streamed:
+        current_app.logger.info("Streaming item list")
+        return Response(
+            stream_with_context(stream_items(query, fields)),
+            status=status.HTTP_200_OK,
+            mimetype="application/json",
+        )
+
+    headers = {}
+    max_page_size = current_app.config["MAX_PAGE_SIZE"]
+    if filters["sort"]:
+        # one row past the limit tells a full list from one that is too long
+        page = query.limit(max_page_size + 1)
+    else:
+        if limit is None:
+            limit = current_app.config["DEFAULT_PAGE_SIZE"]
+        limit = min(limit, max_page_size)
+        page = Items.page_query(limit, after, query)
+    if any(value is not None for value in filters.values()) or fields:
+        key = {name: value for name, value in filters.items() if value is not None}
+        key.update(fields=fields, limit=limit, after=after)
+        results = cache.get_list(key, from_primary(lambda: Items.serialize_rows(page, fields)))
     else:
-        items = Items.all()
+        results = Items.serialize_rows(page)
+    if filters["sort"] and len(results) > max_page_size:
+        raise DataValidationError(
+            "More than {} Items match a sorted list: narrow the filters, or use "
+            "stream=true or /inventory/export".format(max_page_size)
+        )
+    if not filters["sort"] and results and len(results) == limit:
+        headers["X-Next-Cursor"] = str(results[-1]["id"])
+
+    if "stock" in (get_list_arg("include") or []):
+        stock = StockLevel.for_items([item["id"] for item in results])
+        results = [dict(item, stock=stock[item["id"]]) for item in results]
+
+    etag = list_etag(results, fields, response_media_type())
+    if etag_matches(request.if_none_match, etag):
+        return not_modified(etag, headers)
+    current_app.logger.info("Returning %d items", len(results))
+    response = json_response(results, status.HTTP_200_OK, headers)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # revalidate with If-None-Match
+    return response
+
 
-    results = [item.serialize() for item in items]
-    app.logger.info("Returning %d items", len(results))
+######################################################################
+# EXPORT ITEMS
+######################################################################
+@api.route("/inventory/export", methods=["GET"])
+def export_items():
+    """Streams the Items for a bulk export
+
+    Takes the same category, name, condition, min_qty, max_qty, sort and
+    fields parameters as GET /inventory, plus:
+        format - csv or ndjson (the default)
+
+    The body is gzip compressed when the client accepts gzip.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in exporter.FORMATS:
+        raise DataValidationError("Invalid format: " + export_format)
+    current_app.logger.info("Request to export items as %s", export_format)
+    filters = get_filters()
+    query = Items.build_query(**filters)
+    if not filters["sort"]:
+        query = query.order_by(Items.id)
+    fields = get_list_arg("fields")
+    columns = Items.projection(fields)
+    gzip = request.accept_encodings["gzip"] > 0  # not for "gzip;q=0"
+    items = Items.iter_rows(current_app.config["STREAM_BATCH_SIZE"], query, fields)
+    headers = {
+        "Content-Disposition": "attachment; filename=inventory.{}".format(export_format),
+        "Vary": "Accept-Encoding",
+    }
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        stream_with_context(exporter.export(items, columns, export_format, gzip)),
+        status=status.HTTP_200_OK,
+        headers=headers,
+        mimetype=exporter.FORMATS[export_format],
+    )
+
+
+######################################################################
+# SEARCH ITEM NAMES
+######################################################################
+@api.route("/inventory/search", methods=["GET"])
+def search_items():
+    """Returns the Items whose names match a typeahead query
+
+    Query parameters:
+        q - the words typed so far; each must start a word of the name
+        limit - return at most this many Items (SEARCH_DEFAULT_LIMIT)
+        fuzzy - "false" to turn off matching words with typos
+        fields - comma separated fields to return (id and version always are)
+    """
+    query = request.args.get("q", "")
+    if not search.words(query):
+        raise DataValidationError("Query parameter 'q' must contain a word")
+    limit = get_int_arg("limit") or current_app.config["SEARCH_DEFAULT_LIMIT"]
+    limit = min(limit, current_app.config["SEARCH_MAX_LIMIT"])
+    fuzzy = request.args.get("fuzzy", "true").lower() != "false"
+    results = search.search(query, limit, fuzzy, get_list_arg("fields"))
+    current_app.logger.info("Returning %d items for search %r", len(results), query)
+    return json_response(results, status.HTTP_200_OK)
+
+
+######################################################################
+# STOCK SUMMARY
+######################################################################
+@api.route("/inventory/summary", methods=["GET"])
+def summarize_items():
+    """Returns the number of Items and their total quantity
+
+    Optional query parameters:
+        group_by - comma separated fields to total by (category, condition);
+                   without it a single overall total is returned
+    """
+    group_by = get_list_arg("group_by")
+    current_app.logger.info("Request for stock summary by %s", group_by)
+    results = Items.summary(group_by)
     return make_response(jsonify(results), status.HTTP_200_OK)
 
 
+######################################################################
+# CHANGE FEED
+######################################################################
+@api.route("/inventory/changes", methods=["GET"])
+def list_changes():
+    """Returns the Item changes after a sequence number
+
+    Optional query parameters:
+        since - only changes with a greater seq (also read from Last-Event-ID)
+        limit - return at most this many changes
+        wait - when there are no changes yet, wait up to this many seconds
+               for one (long-polling)
+
+    Clients that accept text/event-stream get the changes as Server-Sent
+    Events until CHANGE_STREAM_TIMEOUT, then reconnect with Last-Event-ID.
+
+    Waiting requests and streams hold a worker thread each, so at most
+    CHANGE_MAX_STREAMS run at once per process: further streams get 503
+    and further long-polls return at once without waiting. Serve many
+    subscribers with an async or gevent worker and a higher limit.
+    """
+    since = get_int_arg("since")
+    if since is None and request.headers.get("Last-Event-ID", "").isdigit():
+        since = int(request.headers["Last-Event-ID"])
+    limit = get_int_arg("limit")
+    if limit is None or limit > current_app.config["MAX_PAGE_SIZE"]:
+        limit = current_app.config["MAX_PAGE_SIZE"]
+    current_app.logger.info("Request for changes since %s", since)
+
+    slots = stream_slots()
+    if request.accept_mimetypes.best == "text/event-stream":
+        if not slots.acquire(blocking=False):
+            raise ServiceUnavailable("Too many change streams, retry later", retry_after=5)
+        response = Response(
+            stream_with_context(change_events(since)),
+            status=status.HTTP_200_OK,
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            mimetype="text/event-stream",
+        )
+        response.call_on_close(slots.release)
+        return response
+
+    wait = min(get_int_arg("wait") or 0, current_app.config["CHANGE_MAX_WAIT"])
+    changes = ItemChange.since(since, limit)
+    if not changes and wait and slots.acquire(blocking=False):
+        try:
+            deadline = time.monotonic() + wait
+            while not changes and time.monotonic() < deadline:
+                db.session.commit()  # end the read transaction so the next poll sees new rows
+                time.sleep(current_app.config["CHANGE_POLL_INTERVAL"])
+                changes = ItemChange.since(since, limit)
+        finally:
+            slots.release()
+    headers = {}
+    if changes:
+        headers["X-Next-Cursor"] = str(changes[-1]["seq"])
+    return json_response(changes, status.HTTP_200_OK, headers)
+
+
 ######################################################################
 # CREATE A NEW ITEM
 ######################################################################
-@app.route("/inventory", methods=["POST"])
+@api.route("/inventory", methods=["POST"])
+@idempotent
 def create_item():
     """
     Creates an Item
     This endpoint will create an Item based the data in the body that is posted
     """
-    app.logger.info("Request to create an item")
+    current_app.logger.info("Request to create an item")
     check_content_type("application/json")
     item = Items()
     item.deserialize(request.get_json())
     item.create()
     message = item.serialize()
-    location_url = url_for("get_items", item_id=item.id, _external=True)
+    location_url = url_for(".get_items", item_id=item.id, _external=True)
 
-    app.logger.info("Item with ID [%s] created.", item.id)
-    return make_response(
+    current_app.logger.info("Item with ID [%s] created.", item.id)
+    response = make_response(
         jsonify(message), status.HTTP_201_CREATED, {"Location": location_url}
     )
+    response.set_etag(item_etag(item.id, item.version))
+    return response
+
+######################################################################
+# BATCH CREATE / UPDATE / DELETE ITEMS
+######################################################################
+@api.route("/inventory:batch", methods=["POST"])
+@idempotent
+def batch_items():
+    """
+    Applies a batch of Item operations
+    This endpoint takes a JSON array of create, update and delete operations,
+    applies them in a single transaction and returns one result per operation.
+    Batches longer than BATCH_MAX_OPERATIONS are refused with 413
+    """
+    current_app.logger.info("Request to process a batch of items")
+    check_content_type("application/json")
+    operations = request.get_json()
+    limit = current_app.config["BATCH_MAX_OPERATIONS"]
+    if isinstance(operations, list) and len(operations) > limit:
+        abort(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "A batch may hold at most {} operations, got {}".format(limit, len(operations)),
+        )
+    results = Items.batch(operations)
+    current_app.logger.info("Batch of %d operations complete.", len(results))
+    return make_response(jsonify(results), status.HTTP_200_OK)
+
+######################################################################
+# BULK IMPORT ITEMS
+######################################################################
+@api.route("/inventory/import", methods=["POST"])
+def import_items():
+    """
+    Imports Items from CSV or NDJSON
+    This endpoint reads the body as a stream, validates every row, inserts the
+    valid rows in chunks and returns the counts and the errors of bad rows
+
+    Imports are not @idempotent: the key's fingerprint is a digest of the
+    whole body, which would have to be buffered before the claim, and each
+    chunk commits on its own, so a failed import is partly applied and has
+    no single response to replay. An Idempotency-Key is refused with 501
+    rather than ignored; a client retrying an import should send only the
+    rows after the last committed chunk.
+    """
+    current_app.logger.info("Request to import items")
+    if IDEMPOTENCY_HEADER in request.headers:
+        abort(
+            status.HTTP_501_NOT_IMPLEMENTED,
+            "{} is not supported for imports".format(IDEMPOTENCY_HEADER),
+        )
+    reader = importer.READERS.get(request.mimetype)
+    if reader is None:
+        current_app.logger.error("Invalid Content-Type: %s", request.mimetype)
+        abort(
+            status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            "Content-Type must be one of {}".format(", ".join(importer.READERS)),
+        )
+    result = importer.import_rows(
+        reader(request.stream),
+        current_app.config["IMPORT_CHUNK_SIZE"],
+        current_app.config["IMPORT_MAX_ERRORS"],
+    )
+    return make_response(jsonify(result), status.HTTP_200_OK)
 
 ######################################################################
 # RETRIEVE AN INVENTORY ITEM
 ######################################################################
-@app.route("/inventory/<int:item_id>", methods=["GET"])
+@api.route("/inventory/<int:item_id>", methods=["GET"])
 def get_items(item_id):
     """
     Retrieve a single Item
     This endpoint will return a Item based on it's id
     """
-    app.logger.info("Request for item with id: %s", item_id)
-    item = Items.find(item_id)
-    if not item:
+    current_app.logger.info("Request for item with id: %s", item_id)
+    data = cache.get_item(item_id, from_primary(lambda: find_serialized(item_id)))
+    if not data:
         raise NotFound("Item with id '{}' was not found.".format(item_id))
 
-    app.logger.info("Returning item: %s", item.name)
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    etag = item_etag(data["id"], data["version"])
+    if etag_matches(request.if_none_match, etag):
+        return not_modified(etag)
+    current_app.logger.info("Returning item: %s", data["name"])
+    response = make_response(jsonify(data), status.HTTP_200_OK)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # revalidate with If-None-Match
+    return response
 
 ######################################################################
 # UPDATE AN EXISTING INVENTORY ITEM
 ######################################################################
-@app.route("/inventory/<int:item_id>", methods=["PUT"])
+@api.route("/inventory/<int:item_id>", methods=["PUT"])
+@idempotent
 def update_items(item_id):
     """
     Update an Inventory Item
     This endpoint will update an Inventory Item based the body that is posted
     """
-    app.logger.info("Request to update item with id: %s", item_id)
+    current_app.logger.info("Request to update item with id: %s", item_id)
     check_content_type("application/json")
     item = Items.find(item_id)
     if not item:
         raise NotFound("Item with id '{}' was not found.".format(item_id))
+    if request.if_match and not etag_matches(request.if_match, item_etag(item.id, item.version)):
+        raise PreconditionFailed("Item with id '{}' has been modified.".format(item_id))
     item.deserialize(request.get_json())
     item.id = item_id
     item.update()
 
-    app.logger.info("Item with ID [%s] updated.", item.id)
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    current_app.logger.info("Item with ID [%s] updated.", item.id)
+    response = make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response.set_etag(item_etag(item.id, item.version))
+    return response
 
 ######################################################################
 # DELETE AN EXISTING INVENTORY ITEM
 ######################################################################
-@app.route("/inventory/<int:item_id>", methods=["DELETE"])
+@api.route("/inventory/<int:item_id>", methods=["DELETE"])
 def delete_item(item_id):
     """
     Delete a Item
     This endpoint will delete a Item based the id specified in the path
     """
-    app.logger.info("Request to delete item with id: %s", item_id)
+    current_app.logger.info("Request to delete item with id: %s", item_id)
     item = Items.find(item_id)
     if item:
         item.delete()
 
-    app.logger.info("Item with ID [%s] delete complete.", item_id)
+    current_app.logger.info("Item with ID [%s] delete complete.", item_id)
     return make_response("", status.HTTP_204_NO_CONTENT)
 
 
@@ -129,27 +471,331 @@ def delete_item(item_id):
 ######################################################################
 # Disabling an Item
 ######################################################################
-@app.route("/inventory/<item_id>/disable", methods=["PUT"])
+@api.route("/inventory/<item_id>/disable", methods=["PUT"])
 def disable_item(item_id):
     """Disabling an Item makes it unavailable"""
     item = Items.find(item_id)
     if not item:
         abort(status.HTTP_404_NOT_FOUND, f"Item with id '{item_id}' was not found.")
-    item.quantity = 0
-    item.update()
-    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)    
+    item.disable()
+    return make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+
+
+######################################################################
+# STOCK LEVELS PER LOCATION
+######################################################################
+@api.route("/inventory/<int:item_id>/stock", methods=["GET"])
+def get_stock(item_id):
+    """Returns the stock of an Item at every location and in total"""
+    current_app.logger.info("Request for stock of item with id: %s", item_id)
+    stock = StockLevel.availability(item_id)
+    if not stock["locations"] and Items.find(item_id) is None:
+        raise NotFound("Item with id '{}' was not found.".format(item_id))
+    return make_response(jsonify(stock), status.HTTP_200_OK)
+
+
+@api.route("/inventory/<int:item_id>/stock/<location>", methods=["PUT"])
+def set_stock(item_id, location):
+    """Sets the quantity of an Item held at a location
+
+    The body is a JSON object with the new "quantity" at the location
+    """
+    current_app.logger.info("Request to set stock of item %s at %s", item_id, location)
+    check_content_type("application/json")
+    body = request.get_json()
+    if not isinstance(body, dict) or "quantity" not in body:
+        raise DataValidationError("Invalid stock level: missing quantity")
+    if not StockLevel.set_level(item_id, location, body["quantity"]):
+        raise NotFound("Item with id '{}' was not found.".format(item_id))
+    return make_response(jsonify(StockLevel.availability(item_id)), status.HTTP_200_OK)
+
+
+######################################################################
+# ADJUST THE QUANTITY OF AN ITEM
+######################################################################
+@api.route("/inventory/<int:item_id>/adjust", methods=["POST"])
+@idempotent
+def adjust_item(item_id):
+    """
+    Adjust the quantity of an Item
+    This endpoint adds the signed "delta" in the body to the quantity in a
+    single UPDATE. Unless "allow_negative" is true the quantity cannot drop
+    below zero and the request fails with 409 Conflict.
+    """
+    current_app.logger.info("Request to adjust item with id: %s", item_id)
+    check_content_type("application/json")
+    data = request.get_json()
+    delta = data.get("delta") if isinstance(data, dict) else None
+    if not isinstance(delta, int) or isinstance(delta, bool):
+        raise DataValidationError("Invalid adjustment: delta must be an integer")
+    allow_negative = data.get("allow_negative") is True
+    item = Items.adjust_quantity(item_id, delta, allow_negative)
+    if not item:
+        raise NotFound("Item with id '{}' was not found.".format(item_id))
+
+    current_app.logger.info("Item with ID [%s] adjusted to %s.", item.id, item.quantity)
+    response = make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response.set_etag(item_etag(item.id, item.version))
+    return response
+
+
+######################################################################
+# RESERVE STOCK FOR A LIMITED TIME
+######################################################################
+@api.route("/inventory/<int:item_id>/reservations", methods=["POST"])
+@idempotent
+def create_reservation(item_id):
+    """Holds a quantity of an Item for a limited time
+
+    The body is a JSON object with the "quantity" to hold and an optional
+    "ttl" in seconds (RESERVATION_DEFAULT_TTL, at most RESERVATION_MAX_TTL).
+    Fails with 409 Conflict if less than the quantity is available.
+    """
+    current_app.logger.info("Request to reserve stock of item with id: %s", item_id)
+    check_content_type("application/json")
+    body = request.get_json()
+    if not isinstance(body, dict) or "quantity" not in body:
+        raise DataValidationError("Invalid reservation: missing quantity")
+    ttl = body.get("ttl", current_app.config["RESERVATION_DEFAULT_TTL"])
+    max_ttl = current_app.config["RESERVATION_MAX_TTL"]
+    if isinstance(ttl, int) and ttl > max_ttl:
+        raise DataValidationError("Invalid ttl: must be at most {} seconds".format(max_ttl))
+    reservation = Reservation.reserve(item_id, body["quantity"], ttl)
+    if reservation is None:
+        raise NotFound("Item with id '{}' was not found.".format(item_id))
+
+    location_url = url_for(
+        "inventory.get_reservations", item_id=item_id, _external=True
+    )
+    return make_response(
+        jsonify(reservation.serialize()), status.HTTP_201_CREATED, {"Location": location_url}
+    )
+
+
+@api.route("/inventory/<int:item_id>/reservations", methods=["GET"])
+def get_reservations(item_id):
+    """Returns the quantity, reserved and available stock of an Item"""
+    current_app.logger.info("Request for reservations of item with id: %s", item_id)
+    stock = Reservation.active(item_id)
+    if stock is None:
+        raise NotFound("Item with id '{}' was not found.".format(item_id))
+    return make_response(jsonify(stock), status.HTTP_200_OK)
+
+
+@api.route("/inventory/<int:item_id>/reservations/<int:reservation_id>/commit",
+           methods=["POST"])
+@idempotent
+def commit_reservation(item_id, reservation_id):
+    """Takes the quantity of a reservation off the Item, e.g. after payment"""
+    current_app.logger.info("Request to commit reservation %s", reservation_id)
+    item = Reservation.commit(item_id, reservation_id)
+    if not item:
+        raise NotFound(
+            "Reservation with id '{}' was not found or has expired.".format(reservation_id)
+        )
+    response = make_response(jsonify(item.serialize()), status.HTTP_200_OK)
+    response.set_etag(item_etag(item.id, item.version))
+    return response
+
+
+@api.route("/inventory/<int:item_id>/reservations/<int:reservation_id>", methods=["DELETE"])
+def release_reservation(item_id, reservation_id):
+    """Releases a reservation, making its quantity available again"""
+    current_app.logger.info("Request to release reservation %s", reservation_id)
+    Reservation.release(item_id, reservation_id)
+    return make_response("", status.HTTP_204_NO_CONTENT)
+
+
+######################################################################
+# ITEM CACHE STATISTICS
+######################################################################
+@api.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Returns the item cache hit and miss counters"""
+    return make_response(jsonify(cache.stats()), status.HTTP_200_OK)
+
+
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Returns the request metrics in the Prometheus text format"""
+    if not current_app.config.get("METRICS_ENABLED"):
+        raise NotFound("Metrics are not enabled.")
+    return Response(
+        metrics.expose(),
+        status=status.HTTP_200_OK,
+        mimetype="text/plain; version=0.0.4",
+    )
 
 
 ######################################################################
 #  U T I L I T Y   F U N C T I O N S
 ######################################################################
 
+def from_primary(loader):
+    """Returns a cache loader that reads from the primary database
+
+    Cached entries are served to every client, so they are never filled
+    from a read replica that may be behind the primary.
+    """
+    if cache.backend is None:
+        return loader
+
+    def load():
+        with primary_reads(db.session()):
+            return loader()
+
+    return load
+
+
+def find_serialized(item_id):
+    """Returns the serialized Item with the given id or None if not found"""
+    item = Items.find(item_id)
+    return item.serialize() if item else None
+
+
+def item_etag(item_id, version):
+    """Returns the strong ETag for one version of an Item"""
+    return "{}-{}".format(item_id, version)
+
+
+def list_etag(items, fields=None, media_type="application/json"):
+    """Returns a strong ETag for a list of Items or serialized Items
+
+    The projected fields and the media type are part of the tag, as each
+    is a different representation of the same Items.
+    """
+    digest = hashlib.sha1()
+    digest.update(",".join(fields or []).encode() + b";")
+    if media_type != "application/json":
+        digest.update(media_type.encode() + b";")
+    for item in items:
+        if isinstance(item, dict):
+            digest.update(item_etag(item["id"], item["version"]).encode())
+        else:
+            digest.update(item_etag(item.id, item.version).encode())
+        digest.update(b",")
+    return digest.hexdigest()
+
+
+def not_modified(etag, headers=None):
+    """Returns an empty 304 Not Modified response for a matching ETag"""
+    current_app.logger.info("Returning not modified for ETag %s", etag)
+    response = make_response("", status.HTTP_304_NOT_MODIFIED, headers or {})
+    response.set_etag(etag)
+    return response
+
+
+def response_media_type():
+    """Returns the media type negotiated for a list response from Accept"""
+    best = request.accept_mimetypes.best_match(
+        ("application/json",) + msgpack_backend.MEDIA_TYPES, default="application/json"
+    )
+    return msgpack_backend.MEDIA_TYPE if best in msgpack_backend.MEDIA_TYPES else best
+
+
+def json_response(data, status_code, headers=None):
+    """Returns a JSON (or, if negotiated, MessagePack) response
+
+    JSON is encoded with the fast JSON backend.
+    """
+    media_type = response_media_type()
+    with metrics.timed_serialization():
+        if media_type == msgpack_backend.MEDIA_TYPE:
+            body = msgpack_backend.dumps(data)
+        else:
+            body = json_backend.dumps(data)
+    response = Response(
+        body,
+        status=status_code,
+        headers=headers,
+        mimetype=media_type,
+    )
+    response.vary.add("Accept")
+    return response
+
+
+def stream_items(query=None, fields=None):
+    """Yields the Items as a JSON array one keyset batch at a time"""
+    yield b"["
+    separator = b""
+    for item in Items.iter_pages(current_app.config["STREAM_BATCH_SIZE"], query, fields):
+        yield separator + json_backend.dumps(item)
+        separator = b","
+    yield b"]"
+
+
+def change_events(since=None):
+    """Yields the change log as Server-Sent Events, polling for new changes"""
+    deadline = time.monotonic() + current_app.config["CHANGE_STREAM_TIMEOUT"]
+    yield b"retry: 1000\n\n"
+    while True:
+        changes = ItemChange.since(since, current_app.config["MAX_PAGE_SIZE"])
+        db.session.commit()  # do not hold a transaction open between polls
+        for change in changes:
+            yield b"id: %d\nevent: change\ndata: %s\n\n" % (
+                change["seq"], json_backend.dumps(change)
+            )
+            since = change["seq"]
+        if time.monotonic() >= deadline:
+            return
+        if not changes:
+            yield b": keep-alive\n\n"
+            time.sleep(current_app.config["CHANGE_POLL_INTERVAL"])
+
+
+def stream_slots():
+    """Returns the semaphore that bounds the waiting change requests of this app"""
+    slots = current_app.extensions.get("change_streams")
+    if slots is None:
+        slots = current_app.extensions.setdefault(
+            "change_streams", threading.BoundedSemaphore(current_app.config["CHANGE_MAX_STREAMS"])
+        )
+    return slots
+
+
+def get_filters():
+    """Returns the list filters of GET /inventory from the query parameters"""
+    return {
+        "category": request.args.get("category"),
+        "name": request.args.get("name"),
+        "condition": request.args.get("condition"),
+        "min_qty": get_int_arg("min_qty"),
+        "max_qty": get_int_arg("max_qty"),
+        "sort": get_list_arg("sort"),
+        "location": request.args.get("location"),
+    }
+
+
+def get_int_arg(name):
+    """Returns a query parameter as a non-negative int or None if absent"""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        abort(
+            status.HTTP_400_BAD_REQUEST,
+            "Query parameter '{}' must be a non-negative integer".format(name),
+        )
+    return int(value)
+
+
+def get_list_arg(name):
+    """Returns a comma separated query parameter as a list or None if absent"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
 def check_content_type(media_type):
     """Checks that the media type is correct"""
     content_type = request.headers.get("Content-Type")
     if content_type and content_type == media_type:
         return
-    app.logger.error("Invalid Content-Type: %s", content_type)
+    current_app.logger.error("Invalid Content-Type: %s", content_type)
     abort(
         status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
         "Content-Type must be {}".format(media_type),
@@ -0,0 +1,129 @@
+"""
+Module: routing
+
+Read replica routing for the SQLAlchemy session
+
+When DATABASE_READ_URIS lists one or more read replicas, reads are spread
+round-robin across them and everything else goes to the primary database:
+
+    - INSERT, UPDATE and DELETE statements and ORM flushes use the primary
+    - a session that has written keeps reading from the primary, so a
+      request sees its own writes
+    - requests other than GET and HEAD read from the primary, so an update
+      never starts from a lagging replica
+    - after a write the response sets a short-lived cookie and that client's
+      reads stay on the primary until it expires (read-your-writes)
+    - reads inside primary_reads() use the primary, e.g. to fill the item
+      cache, which every client reads, with rows that are not behind
+"""
+import time
+import threading
+from contextlib import contextmanager
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from service import metrics
+
+PRIMARY_COOKIE = "inventory_read_primary"
+READ_METHODS = ("GET", "HEAD")
+SERVER_POOL_OPTIONS = ("pool_size", "max_overflow", "pool_timeout", "pool_recycle", "connect_args")
+
+
+class RoundRobin:
+    """Thread safe round-robin over a list of bind keys"""
+
+    def __init__(self):
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def choose(self, binds: list) -> str:
+        """Returns the next bind key to use"""
+        with self._lock:
+            bind = binds[self._next % len(binds)]
+            self._next += 1
+        return bind
+
+
+ROUND_ROBIN = RoundRobin()
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads to the read replicas and writes to the primary"""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):  # pylint: disable=arguments-differ,unused-argument
+        """Returns the engine for a statement: a replica for reads if possible"""
+        if bind is not None:
+            return bind
+        replicas = self.app.config.get("SQLALCHEMY_READ_BINDS")
+        if not replicas:
+            return super().get_bind(mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+            return super().get_bind(mapper, clause)
+        if self.info.get("wrote") or self.info.get("read_primary") or primary_requested():
+            return super().get_bind(mapper, clause)
+        return self.db.get_engine(self.app, bind=ROUND_ROBIN.choose(replicas))
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with a session that routes reads to replicas"""
+
+    def create_session(self, options):
+        """Creates sessions that route reads to the read replicas"""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        """Creates an engine, dropping PostgreSQL pool options for SQLite
+
+        SQLALCHEMY_ENGINE_OPTIONS apply to every bind, so a PostgreSQL
+        primary with SQLite replicas (as in the tests) needs this. Server
+        databases get a pool that times checkouts, for load shedding.
+        """
+        if sa_url.drivername.startswith("sqlite"):
+            engine_opts = {
+                key: value for key, value in engine_opts.items()
+                if key not in SERVER_POOL_OPTIONS
+            }
+        else:
+            engine_opts = dict(engine_opts)
+            engine_opts.setdefault("poolclass", metrics.TimedQueuePool)
+        return super().create_engine(sa_url, engine_opts)
+
+
+@contextmanager
+def primary_reads(session):
+    """Sends the reads of a session to the primary inside the with block"""
+    previous = session.info.get("read_primary", False)
+    session.info["read_primary"] = True
+    try:
+        yield session
+    finally:
+        session.info["read_primary"] = previous
+
+
+def primary_requested() -> bool:
+    """Returns True when the current request must read from the primary"""
+    if not has_request_context():
+        return False
+    if request.method not in READ_METHODS:
+        return True
+    try:
+        return float(request.cookies.get(PRIMARY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def init_app(app, db):
+    """Sets the read-your-writes cookie on responses to requests that wrote"""
+
+    @app.after_request
+    def _mark_primary_reads(response):
+        window = app.config.get("DB_READ_AFTER_WRITE_SECONDS", 0)
+        if app.config.get("SQLALCHEMY_READ_BINDS") and window and db.session().info.get("wrote"):
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + window), max_age=window)
+        return response
@@ -0,0 +1,297 @@
+"""
+Module: search
+
+Typeahead search over Item names
+
+A query matches the Items whose name has a word starting with each word of
+the query, so "blu sh" finds "blue shirt". With fuzzy matching, words a few
+typos away match too ("shrit" finds "shirt"), ranked after the prefix
+matches.
+
+Backends
+--------
+trigram - PostgreSQL with the pg_trgm extension: word prefix and word
+          similarity matches, both served by a GIN trigram index on name
+fts - PostgreSQL without pg_trgm: prefix matches with a full text query
+      (to_tsquery('simple', 'word:*')) served by a GIN index on the name's
+      tsvector. Fuzzy matching needs pg_trgm, so only prefix matches are found
+trie - any other database (e.g. SQLite): an in-process prefix trie of the
+       words of every name, rebuilt when the Items have changed
+"""
+import re
+import time
+import heapq
+import logging
+import threading
+from sqlalchemy import and_, case, func, literal, literal_column, text
+from sqlalchemy.exc import DBAPIError
+from service.models import Items, db
+from service.cache import cache
+
+logger = logging.getLogger("flask.app")
+
+WORD = re.compile(r"\w+")
+SIMPLE = literal_column("'simple'")  # text search config: no stemming or stop words
+
+INDEX_DDL = {
+    "trigram": "CREATE INDEX IF NOT EXISTS ix_items_name_trgm "
+               "ON items USING gin (name gin_trgm_ops)",
+    "fts": "CREATE INDEX IF NOT EXISTS ix_items_name_fts "
+           "ON items USING gin (to_tsvector('simple', name))",
+}
+
+# whether pg_trgm is installed, per database URL
+_trigram_installed = {}
+
+
+def words(value: str) -> list:
+    """Returns the lowercased words of a name or query"""
+    return WORD.findall(value.lower())
+
+
+def max_edits(word: str) -> int:
+    """Returns the number of typos a fuzzy match allows in a word"""
+    if len(word) < 3:
+        return 0
+    return 1 if len(word) < 7 else 2
+
+
+######################################################################
+#  I N - P R O C E S S   P R E F I X   T R I E
+######################################################################
+class NameTrie:
+    """Prefix trie of the words of Item names
+
+    Each node is a dictionary of child nodes keyed by character, plus the
+    set of item ids of the words that end there under the None key.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.names = {}
+
+    def add(self, item_id: int, name: str):
+        """Adds the words of an Item name"""
+        self.names[item_id] = name
+        for word in set(words(name)):
+            node = self.root
+            for char in word:
+                node = node.setdefault(char, {})
+            node.setdefault(None, set()).add(item_id)
+
+    @staticmethod
+    def _collect(node: dict, ids: set) -> set:
+        """Adds the ids of every word below a node to ids"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is None:
+                    ids.update(child)
+                else:
+                    stack.append(child)
+        return ids
+
+    def prefix(self, word: str) -> set:
+        """Returns the ids of the names with a word starting with word"""
+        node = self.root
+        for char in word:
+            node = node.get(char)
+            if node is None:
+                return set()
+        return self._collect(node, set())
+
+    def fuzzy(self, word: str, distance: int) -> set:
+        """Returns the ids of the names with a word starting within distance edits of word
+
+        Edits are insertions, deletions, substitutions and swaps of adjacent
+        characters. The trie is walked once, carrying the last two rows of
+        the edit distance table per node and pruning branches that can no
+        longer come within distance.
+        """
+        ids = set()
+        first = list(range(len(word) + 1))
+        stack = [(child, char, None, first, None)
+                 for char, child in self.root.items() if char is not None]
+        while stack:
+            node, char, previous_char, previous, before = stack.pop()
+            row = [previous[0] + 1]
+            for column in range(1, len(word) + 1):
+                cost = 0 if word[column - 1] == char else 1
+                row.append(min(row[column - 1] + 1, previous[column] + 1,
+                               previous[column - 1] + cost))
+                if (column > 1 and before is not None and word[column - 1] == previous_char
+                        and word[column - 2] == char):
+                    row[column] = min(row[column], before[column - 2] + 1)
+            if row[-1] <= distance:
+                self._collect(node, ids)
+            elif min(row) <= distance:
+                stack.extend((child, key, char, row, previous)
+                             for key, child in node.items() if key is not None)
+        return ids
+
+    def search(self, query: str, limit: int, fuzzy: bool = True) -> list:
+        """Returns the ids of up to limit matching names, prefix matches first"""
+        terms = words(query)
+        if not terms:
+            return []
+        matched = set.intersection(*[self.prefix(term) for term in terms])
+        ranked = self._best(matched, query, limit)
+        if fuzzy and len(ranked) < limit:
+            close = set.intersection(*[
+                self.prefix(term) | self.fuzzy(term, max_edits(term)) for term in terms
+            ])
+            ranked += self._best(close - matched, query, limit - len(ranked))
+        return ranked
+
+    def _best(self, ids: set, query: str, limit: int) -> list:
+        """Returns up to limit ids, names starting with the query first, then by name"""
+        query = query.lower()
+
+        def rank(item_id):
+            name = self.names[item_id].lower()
+            return (not name.startswith(query), name, item_id)
+
+        return heapq.nsmallest(limit, ids, key=rank)
+
+
+class TrieIndex:
+    """A NameTrie of every Item, rebuilt after writes or when older than ttl
+
+    Writes are noticed through the item cache's list generation, so with a
+    shared cache every worker rebuilds after any worker writes.
+    """
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._trie = None
+        self._generation = None
+        self._built = 0.0
+        self._lock = threading.Lock()
+
+    def current(self) -> NameTrie:
+        """Returns a trie that is up to date with the items table"""
+        generation = cache.backend.counter(cache.LIST_GENERATION) if cache.backend else None
+        with self._lock:
+            if (
+                self._trie is None
+                or generation != self._generation
+                or time.monotonic() - self._built > self.ttl
+            ):
+                trie = NameTrie()
+                for item_id, name in db.session.query(Items.id, Items.name):
+                    trie.add(item_id, name)
+                self._trie, self._generation = trie, generation
+                self._built = time.monotonic()
+            return self._trie
+
+    def clear(self):
+        """Drops the trie so the next search rebuilds it"""
+        with self._lock:
+            self._trie = None
+
+
+trie_index = TrieIndex()
+
+
+######################################################################
+#  P O S T G R E S Q L   I N D E X E S
+######################################################################
+def backend_name(engine) -> str:
+    """Returns the search backend used for a database: trigram, fts or trie"""
+    if engine.dialect.name != "postgresql":
+        return "trie"
+    url = str(engine.url)
+    if url not in _trigram_installed:
+        with engine.connect() as connection:
+            found = connection.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).first()
+        _trigram_installed[url] = found is not None
+    return "trigram" if _trigram_installed[url] else "fts"
+
+
+def create_indexes(engine):
+    """Creates the name search index on PostgreSQL
+
+    pg_trgm is installed if the database allows it, otherwise the full text
+    search index is created instead.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as connection:
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as error:
+        logger.warning("pg_trgm is not available, using full text search: %s", error.orig)
+    _trigram_installed.pop(str(engine.url), None)
+    backend = backend_name(engine)
+    logger.info("Creating the %s name search index", backend)
+    with engine.begin() as connection:
+        connection.execute(text(INDEX_DDL[backend]))
+
+
+######################################################################
+#  S E A R C H
+######################################################################
+def trigram_query(query: str, terms: list, fuzzy: bool):
+    """Returns the Items query for the pg_trgm backend"""
+    # \m anchors each term at the start of a word; trigram indexes serve ~*
+    prefix = and_(*[Items.name.op("~*")(r"\m" + term) for term in terms])
+    criteria = prefix
+    if fuzzy:
+        # word similarity above pg_trgm.word_similarity_threshold
+        criteria = prefix | literal(query).op("<%")(Items.name)
+    return Items.query.filter(criteria).order_by(
+        case((prefix, 0), else_=1),
+        func.word_similarity(query, Items.name).desc(),
+        func.lower(Items.name),
+        Items.id,
+    )
+
+
+def fts_query(query: str, terms: list):
+    """Returns the Items query for the full text search backend"""
+    tsquery = " & ".join(term + ":*" for term in terms)
+    document = func.to_tsvector(SIMPLE, Items.name)
+    starts = func.lower(Items.name).startswith(query.lower(), autoescape=True)
+    return Items.query.filter(document.op("@@")(func.to_tsquery(SIMPLE, tsquery))).order_by(
+        case((starts, 0), else_=1), func.lower(Items.name), Items.id
+    )
+
+
+def search(query: str, limit: int, fuzzy: bool = True, fields=None) -> list:
+    """Returns up to limit serialized Items whose names match a query
+
+    :param query: the words typed so far
+    :type query: str
+    :param limit: the most Items to return
+    :type limit: int
+    :param fuzzy: also match words a few typos away
+    :type fuzzy: bool
+    :param fields: only return these fields (see Items.projection)
+
+    :return: the matching Items, best match first
+    :rtype: list
+
+    """
+    terms = words(query)
+    if not terms:
+        return []
+    backend = backend_name(db.session.get_bind())
+    logger.info("Searching names for %r with the %s backend", query, backend)
+    if backend == "trie":
+        ids = trie_index.current().search(query, limit, fuzzy)
+        rows = Items.serialize_rows(Items.query.filter(Items.id.in_(ids)), fields)
+        by_id = {row["id"]: row for row in rows}
+        return [by_id[item_id] for item_id in ids if item_id in by_id]
+    if backend == "trigram":
+        items = trigram_query(query, terms, fuzzy)
+    else:
+        items = fts_query(query, terms)
+    return Items.serialize_rows(items.limit(limit), fields)
+
+
+def init_app(app):
+    """Configures how long the in-process trie may be reused"""
+    trie_index.ttl = app.config.get("SEARCH_TRIE_TTL", 30.0)
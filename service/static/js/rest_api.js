@@ -1,4 +1,7 @@
 $(function () {
+  // ETag of the item shown in the form, sent as If-Match when updating it
+  let item_etag = null;
+
   // ****************************************
   //  U T I L I T Y   F U N C T I O N S
   // ****************************************
@@ -10,6 +13,7 @@ $(function () {
     $('#item_category').val(res.category);
     $('#item_quantity').val(res.quantity);
     $('#item_condition').val(res.condition);
+    item_etag = `"${res.id}-${res.version}"`;
   }
 
   /// Clears all form fields
@@ -19,6 +23,7 @@ $(function () {
     $('#item_category').val('');
     $('#item_quantity').val('');
     $('#item_condition').val('');
+    item_etag = null;
   }
 
   // Updates the flash message area
@@ -87,6 +92,7 @@ $(function () {
       type: 'PUT',
       url: `/inventory/${item_id}`,
       contentType: 'application/json',
+      headers: item_etag && item_etag.startsWith(`"${item_id}-`) ? { 'If-Match': item_etag } : {},
       data: JSON.stringify(data),
     });
 
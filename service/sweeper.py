@@ -0,0 +1,83 @@
+"""
+Module: sweeper
+
+Background release of expired stock reservations and idempotency keys
+
+Each worker process starts one daemon thread on its first request. Every
+RESERVATION_SWEEP_INTERVAL seconds it releases expired reservations in
+batches of RESERVATION_SWEEP_BATCH (see Reservation.sweep), and goes on
+without sleeping while full batches keep coming back. Expired idempotency
+keys, and change log rows older than CHANGE_LOG_RETENTION_DAYS, are deleted
+the same way. Sweeps from several workers skip each
+other's locked rows, so running one per worker is safe.
+Set RESERVATION_SWEEP_INTERVAL to 0 to run the sweep elsewhere (e.g. a
+scheduled `flask sweep-reservations`). The sweeper does not run under TESTING.
+"""
+import logging
+import threading
+from service.models import IdempotencyKey, ItemChange, Reservation
+
+logger = logging.getLogger("flask.app")
+
+
+def sweep_expired(batch_size: int) -> int:
+    """Releases expired reservations batch by batch until none are left"""
+    total = 0
+    while True:
+        released = Reservation.sweep(batch_size)
+        total += released
+        if released < batch_size:
+            return total
+
+
+def purge_keys(batch_size: int) -> int:
+    """Deletes expired idempotency keys batch by batch until none are left"""
+    total = 0
+    while True:
+        deleted = IdempotencyKey.purge(batch_size)
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def purge_changes(days: float, batch_size: int) -> int:
+    """Deletes change log rows older than days batch by batch (0 keeps them all)"""
+    total = 0
+    while days > 0:
+        deleted = ItemChange.purge(days, batch_size)
+        total += deleted
+        if deleted < batch_size:
+            break
+    return total
+
+
+def run(app, stop: threading.Event = None):
+    """Sweeps expired reservations, keys and changes every interval until stop is set"""
+    interval = app.config["RESERVATION_SWEEP_INTERVAL"]
+    batch_size = app.config["RESERVATION_SWEEP_BATCH"]
+    stop = stop or threading.Event()
+    while not stop.wait(interval):
+        try:
+            with app.app_context():
+                sweep_expired(batch_size)
+                purge_keys(batch_size)
+                purge_changes(app.config["CHANGE_LOG_RETENTION_DAYS"], batch_size)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Reservation sweep failed, retrying in %ss", interval)
+
+
+def start(app) -> threading.Thread:
+    """Starts the sweeper thread"""
+    thread = threading.Thread(target=run, args=(app,), name="reservation-sweeper", daemon=True)
+    thread.start()
+    logger.info("Reservation sweeper started")
+    return thread
+
+
+def init_app(app):
+    """Starts the sweeper on the first request if RESERVATION_SWEEP_INTERVAL > 0"""
+
+    @app.before_first_request
+    def _start_sweeper():
+        if app.config.get("RESERVATION_SWEEP_INTERVAL", 0) > 0 and not app.testing:
+            start(app)
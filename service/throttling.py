@@ -0,0 +1,177 @@
+"""
+Module: throttling
+
+Per-client rate limiting and load shedding
+
+Rate limiting (RATE_LIMIT_ENABLED)
+    Every client has a token bucket that holds up to RATE_LIMIT_BURST
+    tokens and refills at RATE_LIMIT_RATE tokens a second. Each request
+    takes its route's cost (RATE_LIMIT_COSTS, by endpoint name, 1 if not
+    listed), so a list or export call costs more than a single GET. When the
+    bucket is short the request fails at once with 429 and a Retry-After.
+    Clients sending one of the RATE_LIMIT_API_KEYS in RATE_LIMIT_KEY_HEADER
+    get a bucket per key, every other client one per address, so made-up
+    keys cannot buy fresh buckets. Behind a proxy set PROXY_FIX_X_FOR so
+    the address is the client's and not the proxy's. Buckets are kept per
+    worker process, for the RATE_LIMIT_MAX_CLIENTS most recently seen
+    clients, so each of the CACHE_WORKERS workers (WEB_CONCURRENCY) gets
+    an equal share of the rate and burst. With requests spread evenly over
+    the workers a client's total stays close to the configured limit; a
+    client whose requests all land on one worker gets only its share. The
+    share of the burst is never below the largest route cost, so every
+    route stays reachable.
+
+Load shedding (LOAD_SHED_ENABLED, off by default)
+    When the 95th percentile of the time checkouts queued for a database
+    connection over the last LOAD_SHED_WINDOW seconds is above
+    LOAD_SHED_MAX_POOL_WAIT_MS, new requests fail at once with 503 and a
+    Retry-After instead of queueing for the pool behind the others. Opening
+    new connections is not counted, and at least LOAD_SHED_MIN_SAMPLES
+    checkouts must be in the window, so one slow checkout never sheds
+    load. Once the slow checkouts age out of the window requests are
+    admitted again.
+
+The probes and the metrics endpoint are never limited or shed.
+"""
+import math
+import time
+import threading
+import logging
+from collections import OrderedDict
+from flask import g, request
+from werkzeug.exceptions import ServiceUnavailable, TooManyRequests
+from service import metrics
+
+logger = logging.getLogger("flask.app")
+
+# endpoints that are never limited, without the blueprint prefix
+EXEMPT_ENDPOINTS = ("index", "get_health", "get_ready", "get_metrics", "static")
+
+DEFAULT_COSTS = {
+    "list_items": 5,
+    "export_items": 20,
+    "import_items": 20,
+    "batch_items": 5,
+    "summarize_items": 2,
+    "list_changes": 2,
+}
+
+
+######################################################################
+#  T O K E N   B U C K E T S
+######################################################################
+class TokenBuckets:
+    """Token buckets per client, bounded with least recently used eviction"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # client -> (tokens, updated at)
+        self._lock = threading.Lock()
+
+    def take(self, client: str, cost: float, now: float = None) -> tuple:
+        """Takes cost tokens from a client's bucket if it holds enough
+
+        :return: (allowed, tokens left, seconds until cost tokens are available)
+        :rtype: tuple
+
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        wait = 0.0 if allowed else (cost - tokens) / self.rate if self.rate else math.inf
+        return allowed, tokens, wait
+
+    def clear(self):
+        """Forgets every client"""
+        with self._lock:
+            self._buckets.clear()
+
+
+######################################################################
+#  R E Q U E S T   H O O K S
+######################################################################
+def client_key(config) -> str:
+    """Returns the known API key of the request, or else the client address"""
+    api_key = request.headers.get(config["RATE_LIMIT_KEY_HEADER"])
+    if api_key and api_key in config.get("RATE_LIMIT_API_KEYS", ()):
+        return "key:" + api_key
+    return "addr:" + str(request.remote_addr)
+
+
+def route_cost(config, endpoint: str) -> float:
+    """Returns the number of tokens a request to an endpoint takes"""
+    return config["RATE_LIMIT_COSTS"].get(endpoint, DEFAULT_COSTS.get(endpoint, 1))
+
+
+def retry_after(seconds: float) -> int:
+    """Returns a Retry-After value in whole seconds, at least 1"""
+    return max(1, math.ceil(seconds))
+
+
+def check_rate_limit(buckets: TokenBuckets, config, endpoint: str):
+    """Takes the route's cost from the client's bucket or raises TooManyRequests"""
+    cost = route_cost(config, endpoint)
+    allowed, tokens, wait = buckets.take(client_key(config), cost)
+    g.rate_limit_remaining = int(tokens)
+    if not allowed:
+        logger.warning("Rate limited %s on %s", client_key(config), endpoint)
+        raise TooManyRequests(
+            "Rate limit exceeded: {} costs {} tokens".format(endpoint, cost),
+            retry_after=retry_after(wait if math.isfinite(wait) else 60),
+        )
+
+
+def check_admission(config):
+    """Raises ServiceUnavailable while connection pool checkouts are too slow"""
+    wait = metrics.recent_pool_wait(config["LOAD_SHED_WINDOW"])
+    if (
+        wait["count"] >= config.get("LOAD_SHED_MIN_SAMPLES", 1)
+        and wait["p95_ms"] > config["LOAD_SHED_MAX_POOL_WAIT_MS"]
+    ):
+        logger.warning("Shedding load: pool wait p95 is %sms", wait["p95_ms"])
+        raise ServiceUnavailable(
+            "The service is overloaded, please retry later",
+            retry_after=retry_after(config["LOAD_SHED_WINDOW"]),
+        )
+
+
+def worker_share(config) -> tuple:
+    """Returns the (rate, burst) of one worker process's buckets"""
+    workers = max(1, config.get("CACHE_WORKERS", 1))
+    largest_cost = max([1, *DEFAULT_COSTS.values(), *config["RATE_LIMIT_COSTS"].values()])
+    burst = config["RATE_LIMIT_BURST"]
+    return config["RATE_LIMIT_RATE"] / workers, max(burst / workers, min(burst, largest_cost))
+
+
+def init_app(app):
+    """Registers the rate limiting and load shedding hooks"""
+    rate, burst = worker_share(app.config)
+    buckets = app.extensions["rate_limit_buckets"] = TokenBuckets(
+        rate, burst, app.config["RATE_LIMIT_MAX_CLIENTS"],
+    )
+
+    @app.before_request
+    def _throttle():
+        endpoint = (request.endpoint or "").rpartition(".")[2]
+        if not endpoint or endpoint in EXEMPT_ENDPOINTS:
+            return
+        if app.config.get("RATE_LIMIT_ENABLED"):
+            check_rate_limit(buckets, app.config, endpoint)
+        if app.config.get("LOAD_SHED_ENABLED"):
+            check_admission(app.config)
+
+    @app.after_request
+    def _rate_limit_headers(response):
+        if "rate_limit_remaining" in g:
+            response.headers["X-RateLimit-Limit"] = str(app.config["RATE_LIMIT_BURST"])
+            response.headers["X-RateLimit-Remaining"] = str(g.rate_limit_remaining)
+        return response
@@ -0,0 +1,102 @@
+"""
+Test cases for the Item cache backends
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import time
+import unittest
+from flask import Flask
+from service.cache import ItemCache, LRUCache, LocalClient, SharedCache
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestItemCache(unittest.TestCase):
+    """Test Cases for the Item cache"""
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted when full"""
+        backend = LRUCache(max_size=2, ttl=60)
+        backend.set("a", 1)
+        backend.set("b", 2)
+        self.assertEqual(backend.get("a"), 1)
+        backend.set("c", 3)
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), 1)
+        self.assertEqual(backend.get("c"), 3)
+
+    def test_lru_max_bytes(self):
+        """Entries are evicted to stay within the byte budget"""
+        backend = LRUCache(max_size=100, ttl=60, max_bytes=80)
+        for key in "abcde":
+            backend.set(key, key * 18)  # 20 bytes of JSON each
+        self.assertIsNone(backend.get("a"))
+        self.assertEqual(backend.get("e"), "e" * 18)
+        self.assertEqual(backend.size, 80)
+        backend.set("big", "x" * 19)
+        self.assertIsNone(backend.get("big"))
+        backend.delete("b")
+        self.assertEqual(backend.size, 60)
+
+    def test_local_ttl_for_workers(self):
+        """Several workers without a shared cache only keep entries briefly"""
+        app = Flask(__name__)
+        app.config.update(CACHE_WORKERS=3, CACHE_REDIS_URL=None, CACHE_TTL=30,
+                          CACHE_LOCAL_TTL=2)
+        cache = ItemCache()
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, LRUCache)
+        self.assertEqual(cache.backend.ttl, 2)
+        app.config["CACHE_LOCAL_TTL"] = 0
+        cache.init_app(app)
+        self.assertIsNone(cache.backend)
+        app.config["CACHE_WORKERS"] = 1
+        cache.init_app(app)
+        self.assertIsInstance(cache.backend, LRUCache)
+        self.assertEqual(cache.backend.ttl, 30)
+
+    def test_lru_expiry(self):
+        """Entries expire after the TTL"""
+        backend = LRUCache(max_size=2, ttl=0.01)
+        backend.set("a", 1)
+        time.sleep(0.02)
+        self.assertIsNone(backend.get("a"))
+
+    def test_read_through(self):
+        """Misses call the loader and hits do not"""
+        for backend in (LRUCache(), SharedCache(LocalClient())):
+            cache = ItemCache(backend)
+            calls = []
+
+            def loader():
+                calls.append(1)
+                return {"id": 1, "name": "blue shirt"}
+
+            self.assertEqual(cache.get_item(1, loader)["name"], "blue shirt")
+            self.assertEqual(cache.get_item(1, loader)["name"], "blue shirt")
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(cache.stats()["hits"], 1)
+            self.assertEqual(cache.stats()["misses"], 1)
+            cache.invalidate(1)
+            cache.get_item(1, loader)
+            self.assertEqual(len(calls), 2)
+
+    def test_list_invalidation(self):
+        """Any write invalidates every cached list"""
+        cache = ItemCache(SharedCache(LocalClient()))
+        self.assertEqual(cache.get_list({"name": "a"}, lambda: [1]), [1])
+        self.assertEqual(cache.get_list({"name": "a"}, lambda: [2]), [1])
+        cache.invalidate()
+        self.assertEqual(cache.get_list({"name": "a"}, lambda: [2]), [2])
+        cache.clear()
+        self.assertEqual(cache.get_list({"name": "a"}, lambda: [3]), [3])
+
+    def test_disabled(self):
+        """Without a backend every call goes to the loader"""
+        cache = ItemCache()
+        self.assertEqual(cache.get_item(1, lambda: {"id": 1}), {"id": 1})
+        cache.invalidate(1)
+        self.assertFalse(cache.stats()["enabled"])
@@ -12,9 +12,11 @@ While debugging just these tests it's convenient to use this:
 import os
 import logging
 import unittest
+from datetime import datetime, timedelta
 from werkzeug.exceptions import NotFound
-from service.models import Items, Condition, DataValidationError, db
-from service import app
+from service.models import Items, Condition, DataValidationError, ItemChange, StockSummary, db, init_app
+from service.models import IdempotencyKey, InsufficientQuantityError, Reservation
+from service import app, create_app, sweeper
 from tests.factories import ItemFactory
 
 DATABASE_URI = os.getenv(
@@ -220,3 +222,207 @@ class TestItemModel(unittest.TestCase):
     #     item_list = [item for item in items]
     #     self.assertEqual(len(item_list), 2)
 
+
+    def test_find_page(self):
+        """Find Items one keyset page at a time"""
+        for _ in range(5):
+            ItemFactory().create()
+        ids = [item.id for item in Items.all()]
+        page = Items.find_page(2)
+        self.assertEqual([item.id for item in page], ids[:2])
+        page = Items.find_page(2, after=page[-1].id)
+        self.assertEqual([item.id for item in page], ids[2:4])
+        page = Items.find_page(2, after=ids[-1])
+        self.assertEqual(page, [])
+        shirts = Items.find_page(10, query=Items.find_by_category("shirt"))
+        self.assertTrue(all(item.category == "shirt" for item in shirts))
+        streamed = [item["id"] for item in Items.iter_pages(2)]
+        self.assertEqual(streamed, sorted(ids))
+
+    def test_filter_indexes(self):
+        """Filter queries can use the name and category indexes"""
+        index_names = {index.name for index in Items.__table__.indexes}
+        self.assertIn("ix_items_category_name", index_names)
+        self.assertIn("ix_items_name", index_names)
+        self.assertIn("ix_items_category", index_names)
+        if db.engine.dialect.name != "postgresql":
+            return
+        db.session.execute("SET enable_seqscan = off")
+        plan = "\n".join(Items.explain(Items.find_by_name("blue shirt")))
+        db.session.rollback()
+        self.assertIn("ix_items_name", plan)
+
+    def test_explain_filters_command(self):
+        """Dump the query plans for the list filters"""
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["explain-filters", "--category", "socks"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("-- filter on category and name", result.output)
+
+    def test_create_db_command(self):
+        """Create the schema from the command line"""
+        runner = app.test_cli_runner()
+        result = runner.invoke(args=["create-db"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn("up to date", result.output)
+
+    def test_create_app_without_database(self):
+        """Create an app while its database is unreachable"""
+        other = create_app({"SQLALCHEMY_DATABASE_URI": "postgresql://nobody@127.0.0.1:1/none"})
+        self.assertIn("inventory", other.blueprints)
+        resp = other.test_client().get("/")
+        self.assertEqual(resp.status_code, 200)
+        init_app(app)  # restore the settings of the app under test
+
+    def test_serialize_rows(self):
+        """Serialize Items from column tuples"""
+        for _ in range(3):
+            ItemFactory().create()
+        expected = [item.serialize() for item in Items.all()]
+        rows = Items.serialize_rows(Items.query.order_by(Items.id))
+        self.assertEqual(rows, sorted(expected, key=lambda item: item["id"]))
+
+    def test_build_query(self):
+        """Combine filters and sorting in one query"""
+        Items(name="blue shirt", category="shirt", quantity=5, condition=Condition.NEW).create()
+        Items(name="blue shirt", category="shirt", quantity=9, condition=Condition.USED).create()
+        Items(name="red shirt", category="shirt", quantity=1, condition=Condition.NEW).create()
+        items = Items.build_query(category="shirt", name="blue shirt", condition="USED").all()
+        self.assertEqual([item.quantity for item in items], [9])
+        items = Items.build_query(min_qty=2, max_qty=8).all()
+        self.assertEqual([item.quantity for item in items], [5])
+        items = Items.build_query(sort=["-name", "id"]).all()
+        self.assertEqual([item.name for item in items], ["red shirt", "blue shirt", "blue shirt"])
+        self.assertRaises(DataValidationError, Items.build_query, condition="new")
+        self.assertRaises(DataValidationError, Items.build_query, sort=["quantity"])
+        self.assertRaises(DataValidationError, Items.serialize_rows, Items.query, ["price"])
+
+    def test_summary(self):
+        """Total the Items by category and condition with GROUP BY"""
+        Items(name="blue shirt", category="shirt", quantity=5, condition=Condition.NEW).create()
+        Items(name="red shirt", category="shirt", quantity=2, condition=Condition.USED).create()
+        Items(name="cap", category="hats", quantity=1, condition=Condition.NEW).create()
+        self.assertEqual(Items.summary(), [{"count": 3, "quantity": 8}])
+        self.assertEqual(
+            Items.summary(["category"]),
+            [{"category": "hats", "count": 1, "quantity": 1},
+             {"category": "shirt", "count": 2, "quantity": 7}],
+        )
+        groups = Items.summary(["condition", "category"])
+        self.assertEqual(len(groups), 3)
+        self.assertEqual(groups[0], {"category": "hats", "condition": "NEW", "count": 1, "quantity": 1})
+        self.assertRaises(DataValidationError, Items.summary, ["name"])
+
+    def test_summary_table(self):
+        """Keep the summary table in step with every kind of write"""
+        StockSummary.rebuild()
+        StockSummary.enabled = True
+        try:
+            shirt = Items(name="blue shirt", category="shirt", quantity=5, condition=Condition.NEW)
+            shirt.create()
+            cap = Items(name="cap", category="hats", quantity=1, condition=Condition.NEW)
+            cap.create()
+            shirt.category = "tops"
+            shirt.quantity = 4
+            shirt.update()
+            cap.delete()
+            Items.adjust_quantity(shirt.id, 3)
+            Items.bulk_insert([Items(name="sock", category="socks", quantity=2, condition=Condition.USED)])
+            new_item = ItemFactory().serialize()
+            results = Items.batch([
+                {"op": "create", "item": new_item},
+                {"op": "update", "id": shirt.id, "item": dict(shirt.serialize(), quantity=1)},
+            ])
+            self.assertEqual([result["result"] for result in results], ["created", "updated"])
+            by_table = Items.summary(["category", "condition"])
+            StockSummary.enabled = False
+            self.assertEqual(by_table, Items.summary(["category", "condition"]))
+            self.assertIn({"category": "tops", "condition": "NEW", "count": 1, "quantity": 1}, by_table)
+        finally:
+            StockSummary.enabled = False
+
+    def test_change_log(self):
+        """Append a change for each Item write in the same transaction"""
+        last = ItemChange.since()[-1]["seq"] if ItemChange.since() else 0
+        item = Items(name="blue shirt", category="shirt", quantity=5, condition=Condition.NEW)
+        item.create()
+        item.quantity = 3
+        item.update()
+        Items.adjust_quantity(item.id, 2)
+        item = Items.find(item.id)
+        item.delete()
+        Items.bulk_insert([Items(name="sock", category="socks", quantity=2, condition=Condition.USED)])
+        changes = ItemChange.since(last)
+        self.assertEqual([change["op"] for change in changes],
+                         ["create", "update", "update", "delete", "import"])
+        self.assertEqual([change["version"] for change in changes[:4]], [1, 2, 3, 3])
+        self.assertEqual(changes[2]["item"]["quantity"], 5)
+        self.assertEqual(changes[4]["item"], {"count": 1})
+        self.assertEqual(len(ItemChange.since(last, limit=2)), 2)
+
+    def test_purge_changes(self):
+        """Delete change log rows older than the retention period"""
+        items = [Items(name="sock", category="socks", quantity=1, condition=Condition.NEW)
+                 for _ in range(3)]
+        for item in items:
+            item.create()
+        changes = ItemChange.since()
+        old = [change["seq"] for change in changes[:-1]]
+        ItemChange.query.filter(ItemChange.seq.in_(old)).update(
+            {"changed_at": datetime.utcnow() - timedelta(days=10)}, synchronize_session=False
+        )
+        db.session.commit()
+        self.assertEqual(sweeper.purge_changes(0, 1), 0)
+        self.assertEqual(sweeper.purge_changes(7, 1), len(old))
+        self.assertEqual([change["seq"] for change in ItemChange.since()], [changes[-1]["seq"]])
+
+    def test_reservations(self):
+        """Hold stock without changing the quantity until it is committed"""
+        item = Items(name="blue shirt", category="shirt", quantity=5, condition=Condition.NEW)
+        item.create()
+        first = Reservation.reserve(item.id, 3, 60).id
+        self.assertRaises(InsufficientQuantityError, Reservation.reserve, item.id, 3, 60)
+        self.assertRaises(DataValidationError, Reservation.reserve, item.id, 0, 60)
+        self.assertIsNone(Reservation.reserve(0, 1, 60))
+        second = Reservation.reserve(item.id, 2, 60).id
+        stock = Reservation.active(item.id)
+        self.assertEqual((stock["quantity"], stock["reserved"], stock["available"]), (5, 5, 0))
+        self.assertEqual(Reservation.commit(item.id, first).quantity, 2)
+        self.assertIsNone(Reservation.commit(item.id, first))
+        self.assertTrue(Reservation.release(item.id, second))
+        self.assertFalse(Reservation.release(item.id, second))
+        stock = Reservation.active(item.id)
+        self.assertEqual((stock["quantity"], stock["reserved"], stock["reservations"]), (2, 0, []))
+
+    def test_sweep_expired_reservations(self):
+        """Release expired reservations in batches and keep the active ones"""
+        item = Items(name="blue shirt", category="shirt", quantity=10, condition=Condition.NEW)
+        item.create()
+        expired = [Reservation.reserve(item.id, 2, 60).id for _ in range(3)]
+        active = Reservation.reserve(item.id, 1, 60).id
+        Reservation.query.filter(Reservation.id.in_(expired)).update(
+            {"expires_at": datetime.utcnow() - timedelta(seconds=1)},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        self.assertIsNone(Reservation.commit(item.id, expired[0]))
+        sweeper.sweep_expired(2)
+        stock = Reservation.active(item.id)
+        self.assertEqual((stock["reserved"], stock["available"]), (1, 9))
+        self.assertEqual([row["id"] for row in stock["reservations"]], [active])
+        self.assertEqual(Reservation.query.count(), 1)
+
+    def test_idempotency_keys(self):
+        """Claim a key once, take over expired claims and purge expired keys"""
+        IdempotencyKey.query.delete()
+        db.session.commit()
+        self.assertIsNone(IdempotencyKey.claim("a", "digest", 60))
+        self.assertIsNone(IdempotencyKey.claim("a", "digest", 60).status_code)
+        IdempotencyKey.complete("a", 201, {"Location": "/inventory/1"}, b"{}", 60)
+        stored = IdempotencyKey.claim("a", "digest", 60)
+        self.assertEqual((stored.status_code, stored.body), (201, b"{}"))
+        self.assertIsNone(IdempotencyKey.claim("b", "digest", -1))
+        self.assertIsNone(IdempotencyKey.claim("b", "other", 60))  # expired, taken over
+        self.assertIsNone(IdempotencyKey.claim("c", "digest", -1))
+        self.assertEqual(sweeper.purge_keys(10), 1)
+        self.assertEqual(sorted(key.key for key in IdempotencyKey.query), ["a", "b"])
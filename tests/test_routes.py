@@ -10,14 +10,23 @@ Test cases can be run with the following:
     nosetests --stop tests/test_service.py:TestPetServer
 """
 
+import io
 import os
+import csv
+import gzip
+import json
+import time
 import logging
 import unittest
 
+from contextlib import nullcontext
 from unittest.mock import MagicMock, patch
 from urllib.parse import quote_plus
+from sqlalchemy.exc import SQLAlchemyError
 from service import app, status
 from service.models import db, init_db
+from service.cache import cache
+from service import json_backend, msgpack_backend, metrics
 from tests.factories import ItemFactory
 
 # Disable all but critical errors during normal test run
@@ -57,6 +66,8 @@ class TestItemServer(unittest.TestCase):
         """Runs before each test"""
         db.drop_all()  # clean up the last tests
         db.create_all()  # create new tables
+        cache.clear()
+        cache.reset_stats()
         self.app = app.test_client()
 
     def tearDown(self):
@@ -85,6 +96,36 @@ class TestItemServer(unittest.TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertIn(b"Inventory Demo REST API Service", resp.data)    
 
+    def test_health(self):
+        """The liveness probe answers without the database"""
+        resp = self.app.get("/health")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["status"], "OK")
+
+    def test_ready(self):
+        """The readiness probe checks the pool and a SELECT 1"""
+        resp = self.app.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(set(data["checks"]), {"pool", "database"})
+        self.assertTrue(all(data["checks"].values()))
+        self.assertIn("checked_out", data["pool"])
+        self.assertGreater(data["recent_sql"]["count"], 0)
+        # slow bulk statements are reported but do not fail the probe
+        with patch.object(metrics, "RECENT_SQL", [(time.perf_counter(), 30.0)] * 10):
+            resp = self.app.get("/ready")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["recent_sql"]["p95_ms"], 30000.0)
+        for setting in ("READY_MAX_LATENCY_MS", "READY_MAX_POOL_UTILISATION"):
+            saved = app.config[setting]
+            app.config[setting] = 0
+            try:
+                resp = self.app.get("/ready")
+            finally:
+                app.config[setting] = saved
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(resp.get_json()["status"], "UNAVAILABLE")
+
     def test_get_item_list(self):
         """Get a list of Items"""
         self._create_items(5)
@@ -93,6 +134,20 @@ class TestItemServer(unittest.TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)    
 
+    def test_get_item_list_json_backends(self):
+        """Get a list of Items with each JSON backend"""
+        items = self._create_items(3)
+        for backend in json_backend.BACKENDS:
+            app.config["JSON_BACKEND"] = backend
+            json_backend.init_app(app)
+            self.assertEqual(json_backend.backend_name(), backend)
+            resp = self.app.get(BASE_URL)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            data = resp.get_json()
+            self.assertEqual([item["id"] for item in data], [item.id for item in items])
+        app.config["JSON_BACKEND"] = "auto"
+        json_backend.init_app(app)
+
     def test_get_item(self):
         """Get a single Item"""
         # get the id of an item
@@ -234,4 +289,870 @@ class TestItemServer(unittest.TestCase):
         self.assertEqual(len(data), name_count)
         # check the data just to be sure
         for item in data:
-            self.assertEqual(item["name"], test_name)
\ No newline at end of file
+            self.assertEqual(item["name"], test_name)
+    ######################################################################
+    # T E S T   P A G I N A T I O N   A N D   S T R E A M I N G
+    ######################################################################
+
+    def test_get_item_list_paginated(self):
+        """Get a list of Items one keyset page at a time"""
+        items = self._create_items(5)
+        resp = self.app.get(BASE_URL, query_string="limit=2")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([item["id"] for item in data], [items[0].id, items[1].id])
+        cursor = resp.headers.get("X-Next-Cursor")
+        self.assertEqual(cursor, str(items[1].id))
+        # follow the cursors to the end of the list
+        seen = [item["id"] for item in data]
+        while cursor:
+            resp = self.app.get(BASE_URL, query_string=f"limit=2&after={cursor}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            seen.extend(item["id"] for item in resp.get_json())
+            cursor = resp.headers.get("X-Next-Cursor")
+        self.assertEqual(seen, [item.id for item in items])
+
+    def test_get_item_list_default_page(self):
+        """A list without a limit is one default sized page, sorted lists are bounded"""
+        items = self._create_items(5)
+        with patch.dict(app.config, DEFAULT_PAGE_SIZE=2, MAX_PAGE_SIZE=4):
+            resp = self.app.get(BASE_URL)
+            self.assertEqual([item["id"] for item in resp.get_json()], [items[0].id, items[1].id])
+            self.assertEqual(resp.headers["X-Next-Cursor"], str(items[1].id))
+            resp = self.app.get(BASE_URL, query_string="limit=10")
+            self.assertEqual(len(resp.get_json()), 4)
+            resp = self.app.get(BASE_URL, query_string="sort=name")
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+            resp = self.app.get(BASE_URL, query_string="sort=name&category=none")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_item_list_bad_cursor(self):
+        """Get a list of Items with a bad limit or cursor"""
+        resp = self.app.get(BASE_URL, query_string="limit=two")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.get(BASE_URL, query_string="after=-1")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_item_list_streamed(self):
+        """Stream a list of Items as chunked JSON"""
+        items = self._create_items(5)
+        app.config["STREAM_BATCH_SIZE"] = 2
+        resp = self.app.get(BASE_URL, query_string="stream=true")
+        app.config["STREAM_BATCH_SIZE"] = 500
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp.is_streamed)
+        data = resp.get_json()
+        self.assertEqual([item["id"] for item in data], [item.id for item in items])
+
+    ######################################################################
+    # T E S T   B A T C H   O P E R A T I O N S
+    ######################################################################
+
+    def test_batch_items(self):
+        """Create, update and delete Items in one batch"""
+        existing = self._create_items(2)
+        new_item = ItemFactory()
+        updated = existing[0].serialize()
+        updated["category"] = "unknown"
+        operations = [
+            {"op": "create", "item": new_item.serialize()},
+            {"op": "update", "id": existing[0].id, "item": updated},
+            {"op": "delete", "id": existing[1].id},
+            {"op": "update", "id": 0, "item": updated},
+            {"op": "create", "item": {"name": "no category"}},
+            {"op": "explode"},
+        ]
+        resp = self.app.post(
+            f"{BASE_URL}:batch", json=operations, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.get_json()
+        self.assertEqual(
+            [result["result"] for result in results],
+            ["created", "updated", "deleted", "not_found", "invalid", "invalid"],
+        )
+        self.assertEqual(results[0]["item"]["name"], new_item.name)
+        resp = self.app.get(f"{BASE_URL}/{results[0]['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{existing[0].id}")
+        self.assertEqual(resp.get_json()["category"], "unknown")
+        resp = self.app.get(f"{BASE_URL}/{existing[1].id}")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_batch_items_ids_and_deletes(self):
+        """Each create gets its own id and deletes report what they removed"""
+        existing = self._create_items(1)[0]
+        names = ["first", "second", "third"]
+        operations = [{"op": "create", "item": ItemFactory(name=name).serialize()}
+                      for name in names]
+        operations += [{"op": "delete", "id": existing.id}, {"op": "delete", "id": existing.id},
+                       {"op": "delete", "id": 0}]
+        resp = self.app.post(f"{BASE_URL}:batch", json=operations, content_type=CONTENT_TYPE_JSON)
+        results = resp.get_json()
+        self.assertEqual([result["result"] for result in results],
+                         ["created"] * 3 + ["deleted", "not_found", "not_found"])
+        for name, result in zip(names, results):
+            self.assertEqual(result["item"]["name"], name)
+            self.assertEqual(self.app.get(f"{BASE_URL}/{result['id']}").get_json()["name"], name)
+
+    def test_batch_items_not_a_list(self):
+        """Send a batch that is not a list of operations"""
+        resp = self.app.post(
+            f"{BASE_URL}:batch", json={"op": "create"}, content_type=CONTENT_TYPE_JSON
+        )
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_items_too_large(self):
+        """Refuse a batch with more operations than allowed"""
+        operations = [{"op": "create", "item": ItemFactory().serialize()} for _ in range(3)]
+        with patch.dict(app.config, BATCH_MAX_OPERATIONS=2):
+            resp = self.app.post(f"{BASE_URL}:batch", json=operations,
+                                 content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            resp = self.app.post(f"{BASE_URL}:batch", json=operations[:2],
+                                 content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # ids taken in the batch are not handed out again
+        item = self.app.post(BASE_URL, json=ItemFactory().serialize()).get_json()
+        self.assertGreater(item["id"], max(result["id"] for result in resp.get_json()))
+
+    def test_import_items_csv(self):
+        """Import Items from a CSV body in chunks"""
+        body = (
+            "name,category,quantity,condition\n"
+            "blue shirt,shirt,3,NEW\n"
+            "\"shorts, red\",shorts,1,USED\n"
+            "no quantity,shirt,,NEW\n"
+            "bad condition,shirt,2,BROKEN\n"
+            "hat,hats,4,NEW\n"
+        )
+        app.config["IMPORT_CHUNK_SIZE"] = 2
+        try:
+            resp = self.app.post(f"{BASE_URL}/import", data=body, content_type="text/csv")
+        finally:
+            app.config["IMPORT_CHUNK_SIZE"] = 1000
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        result = resp.get_json()
+        self.assertEqual(result["imported"], 3)
+        self.assertEqual(result["rejected"], 2)
+        self.assertEqual([error["line"] for error in result["errors"]], [4, 5])
+        items = self.app.get(f"{BASE_URL}?sort=name").get_json()
+        self.assertEqual([item["name"] for item in items], ["blue shirt", "hat", "shorts, red"])
+        self.assertEqual(items[2]["condition"], "USED")
+
+    def test_import_items_ndjson(self):
+        """Import Items from an NDJSON body and cap the reported errors"""
+        item = ItemFactory().serialize()
+        body = "\n".join(
+            [json_backend.dumps(item).decode(), "{not json", "[]", "", json_backend.dumps(item).decode()]
+        )
+        app.config["IMPORT_MAX_ERRORS"] = 1
+        try:
+            resp = self.app.post(
+                f"{BASE_URL}/import", data=body, content_type="application/x-ndjson"
+            )
+        finally:
+            app.config["IMPORT_MAX_ERRORS"] = 1000
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        result = resp.get_json()
+        self.assertEqual(result["imported"], 2)
+        self.assertEqual(result["rejected"], 2)
+        self.assertEqual(result["errors"][0]["line"], 2)
+        self.assertTrue(result["errors_truncated"])
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 2)
+
+    def test_export_items(self):
+        """Export the matching Items as CSV and NDJSON"""
+        items = self._create_items(5)
+        category = items[0].category
+        expected = [item.id for item in items if item.category == category]
+        resp = self.app.get(f"{BASE_URL}/export?format=ndjson&category={quote_plus(category)}")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = resp.get_data().splitlines()
+        self.assertEqual([json.loads(line)["id"] for line in lines], expected)
+        resp = self.app.get(f"{BASE_URL}/export?format=csv&fields=name&sort=-id")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        rows = list(csv.reader(io.StringIO(resp.get_data(as_text=True))))
+        self.assertEqual(rows[0], ["id", "name", "version"])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [item.id for item in reversed(items)])
+
+    def test_export_items_gzip(self):
+        """Export the Items gzip compressed when the client accepts it"""
+        self._create_items(3)
+        resp = self.app.get(
+            f"{BASE_URL}/export?format=csv", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        rows = gzip.decompress(resp.get_data()).decode().splitlines()
+        self.assertEqual(len(rows), 4)
+        for accept in ("gzip;q=0", "identity, *;q=0.5, gzip;q=0"):
+            resp = self.app.get(f"{BASE_URL}/export?format=csv", headers={"Accept-Encoding": accept})
+            self.assertNotIn("Content-Encoding", resp.headers)
+            self.assertEqual(len(resp.get_data(as_text=True).splitlines()), 4)
+        resp = self.app.get(f"{BASE_URL}/export?format=csv", headers={"Accept-Encoding": "*"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        resp = self.app.get(f"{BASE_URL}/export?format=xml")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_summarize_items(self):
+        """Get the counts and total quantities per category"""
+        items = self._create_items(4)
+        resp = self.app.get(f"{BASE_URL}/summary?group_by=category")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(sum(group["count"] for group in data), 4)
+        self.assertEqual(
+            sum(group["quantity"] for group in data), sum(item.quantity for item in items)
+        )
+        resp = self.app.get(f"{BASE_URL}/summary?group_by=price")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_changes(self):
+        """Read the change log after a sequence number"""
+        items = self._create_items(2)
+        self.app.put(f"{BASE_URL}/{items[0].id}/disable")
+        self.app.delete(f"{BASE_URL}/{items[1].id}")
+        resp = self.app.get(f"{BASE_URL}/changes")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        changes = resp.get_json()
+        self.assertEqual([change["op"] for change in changes],
+                         ["create", "create", "update", "delete"])
+        self.assertEqual(changes[2]["item"]["quantity"], 0)
+        self.assertEqual(resp.headers["X-Next-Cursor"], str(changes[-1]["seq"]))
+        resp = self.app.get(f"{BASE_URL}/changes?since={changes[1]['seq']}&limit=1")
+        self.assertEqual([change["seq"] for change in resp.get_json()], [changes[2]["seq"]])
+        resp = self.app.get(f"{BASE_URL}/changes?since={changes[-1]['seq']}&wait=0")
+        self.assertEqual(resp.get_json(), [])
+        self.assertNotIn("X-Next-Cursor", resp.headers)
+
+    def test_stream_changes(self):
+        """Stream the change log as Server-Sent Events"""
+        items = self._create_items(2)
+        app.config["CHANGE_STREAM_TIMEOUT"] = 0
+        try:
+            resp = self.app.get(
+                f"{BASE_URL}/changes", headers={"Accept": "text/event-stream"}
+            )
+            body = resp.get_data(as_text=True)
+        finally:
+            app.config["CHANGE_STREAM_TIMEOUT"] = 300
+        self.assertEqual(resp.mimetype, "text/event-stream")
+        events = [event for event in body.split("\n\n") if event.startswith("id:")]
+        self.assertEqual(len(events), 2)
+        data = json.loads(events[1].split("data: ", 1)[1])
+        self.assertEqual(data["item_id"], items[1].id)
+
+    def test_change_stream_limit(self):
+        """Refuse streams and skip waiting when every stream slot is taken"""
+        self.app.get(f"{BASE_URL}/changes")
+        slots = app.extensions["change_streams"]
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            resp = self.app.get(f"{BASE_URL}/changes", headers={"Accept": "text/event-stream"})
+            self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertIn("Retry-After", resp.headers)
+            started = time.monotonic()
+            resp = self.app.get(f"{BASE_URL}/changes?wait=5")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertLess(time.monotonic() - started, 2)
+        finally:
+            for _ in range(taken):
+                slots.release()
+        self.assertEqual(taken, app.config["CHANGE_MAX_STREAMS"])
+
+    def test_get_item_list_compressed(self):
+        """Compress large list responses for clients that accept gzip"""
+        self._create_items(20)
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip, deflate;q=0.5"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(len(json.loads(gzip.decompress(resp.get_data()))), 20)
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "deflate")
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "identity"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.app.get(f"{BASE_URL}?limit=1", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)  # under COMPRESS_MIN_SIZE
+
+    def test_compressed_etags(self):
+        """Compressed responses get their own ETag that conditional requests accept"""
+        self._create_items(20)
+        plain = self.app.get(BASE_URL, headers={"Accept-Encoding": "identity"}).headers["ETag"]
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip"})
+        etag = resp.headers["ETag"]
+        self.assertEqual(etag, plain[:-1] + '-gzip"')
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(BASE_URL, headers={"Accept-Encoding": "identity", "If-None-Match": plain})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.headers["ETag"], plain)
+        item = self.app.get(BASE_URL).get_json()[0]
+        resp = self.app.put(
+            f"{BASE_URL}/{item['id']}", json=dict(item, name="renamed"),
+            headers={"If-Match": '"{}-{}-gzip"'.format(item["id"], item["version"])},
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_get_item_list_msgpack(self):
+        """Encode list responses as MessagePack when the client asks for it"""
+        self._create_items(3)
+        data = self.app.get(BASE_URL).get_json()
+        resp = self.app.get(BASE_URL, headers={"Accept": "application/msgpack"})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.mimetype, "application/msgpack")
+        self.assertEqual(resp.get_data(), msgpack_backend.dumps(data))
+        etag = resp.headers["ETag"]
+        resp = self.app.get(BASE_URL, headers={"Accept": "application/json"})
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        resp = self.app.get(BASE_URL, headers={"Accept": "text/html,*/*;q=0.8"})
+        self.assertEqual(resp.mimetype, "application/json")
+        self.assertEqual(
+            msgpack_backend._python_dumps(  # pylint: disable=protected-access
+                [{"id": 1, "ok": True}, None, -1, 1.5, "é" * 40, 300]
+            ),
+            b"\x96\x82\xa2id\x01\xa2ok\xc3\xc0\xff\xcb?\xf8\x00\x00\x00\x00\x00\x00"
+            b"\xd9P" + "é".encode() * 40 + b"\xce\x00\x00\x01,",
+        )
+
+    def test_stock_levels(self):
+        """Set and read the stock of an Item per location"""
+        items = [ItemFactory(quantity=0) for _ in range(3)]
+        for item in items:
+            item.id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        item_id = items[0].id
+        etag = self.app.get(f"{BASE_URL}/{item_id}").headers["ETag"]
+        for location, quantity in (("east", 4), ("west", 6), ("east", 5)):
+            resp = self.app.put(
+                f"{BASE_URL}/{item_id}/stock/{location}", json={"quantity": quantity},
+                content_type=CONTENT_TYPE_JSON,
+            )
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{item_id}/stock")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {
+            "item_id": item_id,
+            "locations": [{"location": "east", "quantity": 5}, {"location": "west", "quantity": 6}],
+            "total": 11,
+        })
+        self.assertNotEqual(self.app.get(f"{BASE_URL}/{item_id}").headers["ETag"], etag)
+        self.app.put(f"{BASE_URL}/{items[1].id}/stock/west", json={"quantity": 0},
+                     content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(f"{BASE_URL}?location=west")
+        self.assertEqual([item["id"] for item in resp.get_json()], [item_id])
+        resp = self.app.get(f"{BASE_URL}?include=stock")
+        stock = {item["id"]: item["stock"] for item in resp.get_json()}
+        self.assertEqual(stock, {item_id: {"east": 5, "west": 6}, items[1].id: {"west": 0},
+                                 items[2].id: {}})
+
+    def test_stock_levels_set_quantity(self):
+        """The quantity of an Item stays the total of its stock levels"""
+        item = ItemFactory(quantity=50)
+        item_id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        # the first level keeps the existing 50 at the default location
+        for location, quantity, total in (("east", 4, 54), ("west", 6, 60), ("east", 0, 56)):
+            resp = self.app.put(
+                f"{BASE_URL}/{item_id}/stock/{location}", json={"quantity": quantity},
+                content_type=CONTENT_TYPE_JSON,
+            )
+            self.assertEqual(resp.get_json()["total"], total)
+            self.assertEqual(self.app.get(f"{BASE_URL}/{item_id}").get_json()["quantity"], total)
+        changes = self.app.get(f"{BASE_URL}/changes").get_json()
+        self.assertEqual(changes[-1]["op"], "stock")
+
+    def test_stock_levels_authoritative(self):
+        """Every write keeps the quantity of a located Item the total of its levels"""
+        item = ItemFactory(quantity=0)
+        item_id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{item_id}/stock"
+        self.app.put(f"{url}/east", json={"quantity": 4}, content_type=CONTENT_TYPE_JSON)
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": -1})
+        self.assertEqual(resp.get_json()["quantity"], 3)
+        resp = self.app.put(f"{url}/west", json={"quantity": 0}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["total"], 3)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{item_id}").get_json()["quantity"], 3)
+
+        body = self.app.get(f"{BASE_URL}/{item_id}").get_json()
+        resp = self.app.put(f"{BASE_URL}/{item_id}", json=dict(body, quantity=10),
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.put(f"{BASE_URL}/{item_id}", json=dict(body, name="renamed"),
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.post(f"{BASE_URL}:batch", json=[
+            {"op": "update", "id": item_id, "item": dict(body, quantity=10)},
+        ])
+        self.assertEqual(resp.get_json()[0]["result"], "conflict")
+        self.assertEqual(self.app.get(url).get_json()["total"], 3)
+
+        resp = self.app.put(f"{BASE_URL}/{item_id}/disable", content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.get_json()["quantity"], 0)
+        self.assertEqual(self.app.get(url).get_json()["total"], 0)
+
+    def test_stock_levels_errors(self):
+        """Reject stock levels for unknown Items or with bad quantities"""
+        item_id = self._create_items(1)[0].id
+        resp = self.app.get(f"{BASE_URL}/0/stock")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.get(f"{BASE_URL}/{item_id}/stock")
+        self.assertEqual(resp.get_json()["total"], 0)
+        resp = self.app.put(f"{BASE_URL}/0/stock/east", json={"quantity": 1},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        for body in ({"quantity": -1}, {"quantity": "1"}, {}):
+            resp = self.app.put(f"{BASE_URL}/{item_id}/stock/east", json=body,
+                                content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reservations(self):
+        """Reserve, commit and release stock of an Item"""
+        item = ItemFactory(quantity=5)
+        item_id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{item_id}/reservations"
+        resp = self.app.post(url, json={"quantity": 3, "ttl": 60}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        first = resp.get_json()
+        self.assertEqual(first["quantity"], 3)
+        resp = self.app.post(url, json={"quantity": 3}, content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        second = self.app.post(url, json={"quantity": 2}, content_type=CONTENT_TYPE_JSON).get_json()
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stock = resp.get_json()
+        self.assertEqual((stock["quantity"], stock["reserved"], stock["available"]), (5, 5, 0))
+        self.assertEqual(len(stock["reservations"]), 2)
+
+        resp = self.app.post(f"{url}/{first['id']}/commit")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 2)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{item_id}").get_json()["quantity"], 2)
+        resp = self.app.post(f"{url}/{first['id']}/commit")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.delete(f"{url}/{second['id']}")
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        stock = self.app.get(url).get_json()
+        self.assertEqual((stock["quantity"], stock["reserved"], stock["available"]), (2, 0, 2))
+
+    def test_adjust_into_reserved_stock(self):
+        """Refuse to adjust the quantity below the reserved stock"""
+        item = ItemFactory(quantity=5)
+        item_id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{item_id}/reservations"
+        self.app.post(url, json={"quantity": 3}, content_type=CONTENT_TYPE_JSON)
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": -3})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": -2})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stock = self.app.get(url).get_json()
+        self.assertEqual((stock["quantity"], stock["reserved"], stock["available"]), (3, 3, 0))
+
+    def test_writes_into_reserved_stock(self):
+        """Refuse every write that sets the quantity below the reserved stock"""
+        item = ItemFactory(quantity=5)
+        body = self.app.post(BASE_URL, json=item.serialize()).get_json()
+        item_id = body["id"]
+        self.app.post(f"{BASE_URL}/{item_id}/reservations", json={"quantity": 3},
+                      content_type=CONTENT_TYPE_JSON)
+        resp = self.app.put(f"{BASE_URL}/{item_id}", json=dict(body, quantity=2),
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post(f"{BASE_URL}:batch", json=[
+            {"op": "update", "id": item_id, "item": dict(body, quantity=2)},
+        ])
+        self.assertEqual(resp.get_json()[0]["result"], "conflict")
+        resp = self.app.put(f"{BASE_URL}/{item_id}/stock/default", json={"quantity": 2},
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.put(f"{BASE_URL}/{item_id}/disable", content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.put(f"{BASE_URL}/{item_id}", json=dict(body, quantity=3),
+                            content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stock = self.app.get(f"{BASE_URL}/{item_id}/reservations").get_json()
+        self.assertEqual((stock["quantity"], stock["reserved"]), (3, 3))
+        self.assertEqual(self.app.get(f"{BASE_URL}/{item_id}/stock").get_json()["locations"], [])
+
+    def test_reservations_errors(self):
+        """Reject reservations for unknown Items or with bad bodies"""
+        item_id = self._create_items(1)[0].id
+        url = f"{BASE_URL}/{item_id}/reservations"
+        resp = self.app.post(f"{BASE_URL}/0/reservations", json={"quantity": 1},
+                             content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.app.get(f"{BASE_URL}/0/reservations").status_code,
+                         status.HTTP_404_NOT_FOUND)
+        for body in ({}, {"quantity": 0}, {"quantity": "1"}, {"quantity": 1, "ttl": 0},
+                     {"quantity": 1, "ttl": 10 ** 6}):
+            resp = self.app.post(url, json=body, content_type=CONTENT_TYPE_JSON)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_items(self):
+        """Search Item names by word prefix, best match first"""
+        for name in ("blue shirt", "Blue Jeans", "red shirt", "shirt dress"):
+            self.app.post(BASE_URL, json=ItemFactory(name=name).serialize())
+        # the full text search index here, then the in-process trie
+        for backend in (nullcontext(), patch("service.search.backend_name", return_value="trie")):
+            with backend:
+                resp = self.app.get(f"{BASE_URL}/search?q=blu")
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(sorted(item["name"] for item in resp.get_json()),
+                                 ["Blue Jeans", "blue shirt"])
+                resp = self.app.get(f"{BASE_URL}/search", query_string={"q": "blu sh"})
+                self.assertEqual([item["name"] for item in resp.get_json()], ["blue shirt"])
+                resp = self.app.get(f"{BASE_URL}/search?q=shirt&fuzzy=false&fields=name")
+                self.assertEqual([item["name"] for item in resp.get_json()],
+                                 ["shirt dress", "blue shirt", "red shirt"])
+                self.assertEqual(set(resp.get_json()[0]), {"id", "name", "version"})
+                resp = self.app.get(f"{BASE_URL}/search?q=shirt&limit=1")
+                self.assertEqual(len(resp.get_json()), 1)
+        with patch("service.search.backend_name", return_value="trie"):
+            resp = self.app.get(f"{BASE_URL}/search?q=shrit")
+            self.assertEqual(len(resp.get_json()), 3)
+        resp = self.app.get(f"{BASE_URL}/search?q=+")
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_idempotent_create(self):
+        """A retried create with the same Idempotency-Key does not add a row"""
+        item = ItemFactory().serialize()
+        headers = {"Idempotency-Key": "create-1"}
+        first = self.app.post(BASE_URL, json=item, headers=headers)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn("Idempotent-Replayed", first.headers)
+        second = self.app.post(BASE_URL, json=item, headers=headers)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(second.get_json(), first.get_json())
+        for name in ("Location", "ETag", "Content-Type"):
+            self.assertEqual(second.headers[name], first.headers[name])
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+        resp = self.app.post(BASE_URL, json=ItemFactory().serialize(), headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
+    def test_idempotent_adjust(self):
+        """A retried adjustment is applied once, failed requests can be retried"""
+        item = ItemFactory(quantity=5)
+        item_id = self.app.post(BASE_URL, json=item.serialize()).get_json()["id"]
+        url = f"{BASE_URL}/{item_id}/adjust"
+        headers = {"Idempotency-Key": "adjust-1"}
+        resp = self.app.post(url, json={"delta": "x"}, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        for _ in range(3):
+            resp = self.app.post(url, json={"delta": -2}, headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["quantity"], 3)
+        self.assertEqual(self.app.get(f"{BASE_URL}/{item_id}").get_json()["quantity"], 3)
+        resp = self.app.post(url, json={"delta": -2})
+        self.assertEqual(resp.get_json()["quantity"], 1)
+
+    def test_idempotency_key_in_progress(self):
+        """A retry while the first request is running is rejected"""
+        item = ItemFactory().serialize()
+        resp = self.app.post(BASE_URL, json=item, headers={"Idempotency-Key": ""})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        with patch("service.idempotency.IdempotencyKey.complete"):
+            self.app.post(BASE_URL, json=item, headers={"Idempotency-Key": "slow"})
+        resp = self.app.post(BASE_URL, json=item, headers={"Idempotency-Key": "slow"})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+
+    def test_idempotency_key_not_stored(self):
+        """A write whose response cannot be stored is never run twice"""
+        item = ItemFactory().serialize()
+        headers = {"Idempotency-Key": "unstored"}
+        # the claim alone expires at once, so only the write's transaction holds it
+        app.config["IDEMPOTENCY_LOCK_SECONDS"], lock = 0, app.config["IDEMPOTENCY_LOCK_SECONDS"]
+        try:
+            with patch("service.idempotency.IdempotencyKey.complete",
+                       side_effect=SQLAlchemyError("lost")) as complete:
+                resp = self.app.post(BASE_URL, json=item, headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(complete.call_count, 2)
+            resp = self.app.post(BASE_URL, json=item, headers=headers)
+        finally:
+            app.config["IDEMPOTENCY_LOCK_SECONDS"] = lock
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
+    def test_idempotency_key_failed_after_commit(self):
+        """A write that fails after committing replays its error instead of running again"""
+        item = ItemFactory().serialize()
+        headers = {"Idempotency-Key": "late-failure"}
+        with patch.object(cache, "invalidate", side_effect=RuntimeError("cache down")):
+            with self.assertRaises(RuntimeError):
+                self.app.post(BASE_URL, json=item, headers=headers)
+        resp = self.app.post(BASE_URL, json=item, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(resp.headers["Idempotent-Replayed"], "true")
+        self.assertIn("applied", resp.get_json()["message"])
+        self.assertEqual(len(self.app.get(BASE_URL).get_json()), 1)
+
+        # a failure before the commit still frees the key for a retry
+        with patch("service.routes.Items.create", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.app.post(BASE_URL, json=item, headers={"Idempotency-Key": "early"})
+        resp = self.app.post(BASE_URL, json=item, headers={"Idempotency-Key": "early"})
+        self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+
+    def test_import_items_bad_content_type(self):
+        """Reject an import that is not CSV or NDJSON"""
+        resp = self.app.post(f"{BASE_URL}/import", json=[], content_type=CONTENT_TYPE_JSON)
+        self.assertEqual(resp.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    def test_import_items_idempotency_key(self):
+        """Refuse an Idempotency-Key on imports instead of ignoring it"""
+        resp = self.app.post(f"{BASE_URL}/import", data="name,category,quantity,condition\n",
+                             content_type="text/csv", headers={"Idempotency-Key": "import-1"})
+        self.assertEqual(resp.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertIn("Idempotency-Key", resp.get_json()["message"])
+
+    ######################################################################
+    # T E S T   R A T E   L I M I T S   A N D   L O A D   S H E D D I N G
+    ######################################################################
+
+    def test_rate_limit(self):
+        """Clients over their token budget get 429, list calls cost more"""
+        self._create_items(1)
+        buckets = app.extensions["rate_limit_buckets"]
+        buckets.clear()
+        with patch.dict(app.config, RATE_LIMIT_ENABLED=True, RATE_LIMIT_API_KEYS={"other"}), \
+                patch.multiple(buckets, rate=0.01, burst=7):
+            resp = self.app.get(BASE_URL)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.headers["X-RateLimit-Remaining"], "2")
+            resp = self.app.get(BASE_URL)
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertGreaterEqual(int(resp.headers["Retry-After"]), 1)
+            self.assertEqual(self.app.get(f"{BASE_URL}/0").status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(self.app.get("/health").status_code, status.HTTP_200_OK)
+            resp = self.app.get(BASE_URL, headers={"X-API-Key": "unknown"})
+            self.assertEqual(resp.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            resp = self.app.get(BASE_URL, headers={"X-API-Key": "other"})
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        buckets.clear()
+
+    def test_load_shedding(self):
+        """Requests get 503 at once while pool checkouts queue too long"""
+        self.assertIsInstance(db.engine.pool, metrics.TimedQueuePool)
+        now = time.perf_counter()
+        slow = [(now, 2.0)] * app.config["LOAD_SHED_MIN_SAMPLES"]
+        with patch.dict(app.config, LOAD_SHED_ENABLED=True):
+            with patch.object(metrics, "RECENT_POOL_WAIT", list(slow)):
+                resp = self.app.get(BASE_URL)
+                self.assertEqual(resp.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+                self.assertIn("Retry-After", resp.headers)
+                self.assertEqual(self.app.get("/health").status_code, status.HTTP_200_OK)
+                with patch.dict(app.config, LOAD_SHED_ENABLED=False):
+                    self.assertEqual(self.app.get(BASE_URL).status_code, status.HTTP_200_OK)
+            # too few samples to judge
+            with patch.object(metrics, "RECENT_POOL_WAIT", slow[:1]):
+                self.assertEqual(self.app.get(BASE_URL).status_code, status.HTTP_200_OK)
+            with patch.object(metrics, "RECENT_POOL_WAIT", [(now - 60, 2.0)] * len(slow)):
+                self.assertEqual(self.app.get(BASE_URL).status_code, status.HTTP_200_OK)
+        self.assertFalse(app.config["LOAD_SHED_ENABLED"])
+
+    ######################################################################
+    # T E S T   I T E M   C A C H E
+    ######################################################################
+
+    def test_get_item_cached(self):
+        """Repeated lookups of an Item are served from the cache"""
+        test_item = self._create_items(1)[0]
+        for _ in range(3):
+            resp = self.app.get(f"{BASE_URL}/{test_item.id}")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        stats = self.app.get("/cache/stats").get_json()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hits"], 2)
+        # writes invalidate the cached copy
+        resp = self.app.put(f"{BASE_URL}/{test_item.id}/disable")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.get(f"{BASE_URL}/{test_item.id}")
+        self.assertEqual(resp.get_json()["quantity"], 0)
+
+    def test_query_list_cached(self):
+        """Filtered lists are cached until an Item is written"""
+        items = self._create_items(3)
+        category = items[0].category
+        count = len([item for item in items if item.category == category])
+        resp = self.app.get(BASE_URL, query_string=f"category={category}")
+        self.assertEqual(len(resp.get_json()), count)
+        resp = self.app.get(BASE_URL, query_string=f"category={category}")
+        self.assertEqual(len(resp.get_json()), count)
+        self.assertEqual(cache.stats()["hits"], 1)
+        new_item = ItemFactory(category=category)
+        self.app.post(BASE_URL, json=new_item.serialize(), content_type=CONTENT_TYPE_JSON)
+        resp = self.app.get(BASE_URL, query_string=f"category={category}")
+        self.assertEqual(len(resp.get_json()), count + 1)
+
+    ######################################################################
+    # T E S T   C O N D I T I O N A L   R E Q U E S T S
+    ######################################################################
+
+    def test_get_item_not_modified(self):
+        """Get an Item with a matching If-None-Match"""
+        test_item = self._create_items(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{test_item.id}")
+        etag = resp.headers.get("ETag")
+        self.assertIsNotNone(etag)
+        resp = self.app.get(f"{BASE_URL}/{test_item.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(len(resp.data), 0)
+        # a change produces a new ETag
+        self.app.put(f"{BASE_URL}/{test_item.id}/disable")
+        resp = self.app.get(f"{BASE_URL}/{test_item.id}", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers.get("ETag"), etag)
+
+    def test_get_item_list_not_modified(self):
+        """Get a list of Items with a matching If-None-Match"""
+        self._create_items(3)
+        resp = self.app.get(BASE_URL)
+        etag = resp.headers.get("ETag")
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self._create_items(1)
+        resp = self.app.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.get_json()), 4)
+
+    def test_update_item_if_match(self):
+        """Update an Item only if it has not changed"""
+        test_item = self._create_items(1)[0]
+        resp = self.app.get(f"{BASE_URL}/{test_item.id}")
+        etag = resp.headers.get("ETag")
+        data = resp.get_json()
+        data["category"] = "unknown"
+        resp = self.app.put(
+            f"{BASE_URL}/{test_item.id}", json=data, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["version"], data["version"] + 1)
+        # the old ETag is now stale
+        resp = self.app.put(
+            f"{BASE_URL}/{test_item.id}", json=data, headers={"If-Match": etag}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    ######################################################################
+    # T E S T   Q U A N T I T Y   A D J U S T M E N T S
+    ######################################################################
+
+    def test_adjust_item(self):
+        """Adjust the quantity of an Item"""
+        test_item = ItemFactory(quantity=5)
+        resp = self.app.post(BASE_URL, json=test_item.serialize())
+        item_id = resp.get_json()["id"]
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": -3})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], 2)
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": 10})
+        self.assertEqual(resp.get_json()["quantity"], 12)
+        resp = self.app.get(f"{BASE_URL}/{item_id}")
+        self.assertEqual(resp.get_json()["quantity"], 12)
+
+    def test_adjust_item_below_zero(self):
+        """Adjust the quantity of an Item below zero"""
+        test_item = ItemFactory(quantity=1)
+        resp = self.app.post(BASE_URL, json=test_item.serialize())
+        item_id = resp.get_json()["id"]
+        resp = self.app.post(f"{BASE_URL}/{item_id}/adjust", json={"delta": -2})
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        resp = self.app.post(
+            f"{BASE_URL}/{item_id}/adjust", json={"delta": -2, "allow_negative": True}
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json()["quantity"], -1)
+
+    def test_adjust_item_bad_request(self):
+        """Adjust an Item with a bad delta or an unknown id"""
+        resp = self.app.post(f"{BASE_URL}/0/adjust", json={"delta": 1})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        resp = self.app.post(f"{BASE_URL}/0/adjust", json={"delta": "1"})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    ######################################################################
+    # T E S T   M E T R I C S
+    ######################################################################
+
+    def test_metrics(self):
+        """Record request timings and expose them for Prometheus"""
+        resp = self.app.get("/metrics")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        app.config["METRICS_ENABLED"] = True
+        metrics.clear()
+        self._create_items(2)
+        resp = self.app.get(BASE_URL)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        timing = resp.headers.get("Server-Timing")
+        self.assertIn("app;dur=", timing)
+        self.assertIn('desc="1 queries"', timing)
+        resp = self.app.get("/metrics")
+        app.config["METRICS_ENABLED"] = False
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        text = resp.get_data(as_text=True)
+        self.assertIn(
+            'inventory_request_duration_seconds_count{endpoint="list_items",method="GET",status="200"} 1',
+            text,
+        )
+        self.assertIn('inventory_request_sql_statements_count{endpoint="create_item"} 2', text)
+
+    ######################################################################
+    # T E S T   C O M B I N E D   Q U E R I E S
+    ######################################################################
+
+    def test_query_combined_filters(self):
+        """Query Items by category, name, condition and quantity together"""
+        for name, category, quantity, condition in [
+            ("blue shirt", "shirt", 5, "NEW"),
+            ("blue shirt", "shirt", 50, "NEW"),
+            ("blue shirt", "shirt", 5, "USED"),
+            ("red shirt", "shirt", 5, "NEW"),
+            ("blue shirt", "sale", 5, "NEW"),
+        ]:
+            data = {"name": name, "category": category,
+                    "quantity": quantity, "condition": condition}
+            resp = self.app.post(BASE_URL, json=data)
+            self.assertEqual(resp.status_code, status.HTTP_201_CREATED)
+        resp = self.app.get(
+            BASE_URL,
+            query_string="category=shirt&name=blue%20shirt&condition=NEW&max_qty=10",
+        )
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]["quantity"], 5)
+        self.assertEqual(data[0]["condition"], "NEW")
+        resp = self.app.get(BASE_URL, query_string="min_qty=10")
+        self.assertEqual([item["quantity"] for item in resp.get_json()], [50])
+
+    def test_query_sort_and_fields(self):
+        """Query Items sorted by name with only some fields"""
+        for name in ["b", "c", "a"]:
+            data = {"name": name, "category": "shirt", "quantity": 1, "condition": "NEW"}
+            self.app.post(BASE_URL, json=data)
+        resp = self.app.get(BASE_URL, query_string="sort=-name&fields=name")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual([item["name"] for item in data], ["c", "b", "a"])
+        self.assertEqual(set(data[0].keys()), {"id", "name", "version"})
+        # each projection has its own ETag
+        etag = resp.headers.get("ETag")
+        resp = self.app.get(BASE_URL, query_string="sort=-name", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_query_bad_parameters(self):
+        """Query Items with unknown conditions, fields or sort columns"""
+        for query_string in [
+            "condition=new",
+            "fields=price",
+            "sort=quantity",
+            "sort=name&limit=10",
+            "min_qty=many",
+        ]:
+            resp = self.app.get(BASE_URL, query_string=query_string)
+            self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST, query_string)
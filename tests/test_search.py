@@ -0,0 +1,49 @@
+"""
+Test cases for the in-process name search trie
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import unittest
+from service.search import NameTrie, max_edits, words
+
+
+######################################################################
+#  T R I E   T E S T   C A S E S
+######################################################################
+class TestNameTrie(unittest.TestCase):
+    """Test Cases for the prefix trie used without a search index"""
+
+    def setUp(self):
+        self.trie = NameTrie()
+        for item_id, name in enumerate(
+            ["blue shirt", "Blue Jeans", "red shirt", "shirt dress", "sock"], start=1
+        ):
+            self.trie.add(item_id, name)
+
+    def test_words(self):
+        """Names and queries are split into lowercased words"""
+        self.assertEqual(words("Blue-Shirt  XL"), ["blue", "shirt", "xl"])
+        self.assertEqual(words(" ,. "), [])
+        self.assertEqual([max_edits(word) for word in ("ab", "shirt", "trousers")], [0, 1, 2])
+
+    def test_prefix(self):
+        """Every query word must start a word of the name"""
+        self.assertEqual(self.trie.prefix("blu"), {1, 2})
+        self.assertEqual(self.trie.prefix("s"), {1, 3, 4, 5})
+        self.assertEqual(self.trie.prefix("green"), set())
+        self.assertEqual(self.trie.search("blu sh", 10), [1])
+
+    def test_ranking(self):
+        """Names starting with the query come first, then by name"""
+        self.assertEqual(self.trie.search("shirt", 10, fuzzy=False), [4, 1, 3])
+        self.assertEqual(self.trie.search("shirt", 2, fuzzy=False), [4, 1])
+
+    def test_fuzzy(self):
+        """Words a few typos away match after the prefix matches"""
+        self.assertEqual(self.trie.search("shrit", 10, fuzzy=False), [])
+        self.assertEqual(self.trie.search("shrit", 10), [1, 3, 4])
+        self.assertEqual(self.trie.search("blue shrt", 10), [1])
+        self.assertEqual(self.trie.search("soc", 10), [5])
+        self.assertEqual(self.trie.fuzzy("sox", max_edits("sox")), {5})
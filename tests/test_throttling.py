@@ -0,0 +1,68 @@
+"""
+Test cases for the rate limiting token buckets
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import unittest
+from service import create_app
+from service.throttling import TokenBuckets, client_key, retry_after, worker_share
+
+
+######################################################################
+#  T O K E N   B U C K E T   T E S T   C A S E S
+######################################################################
+class TestTokenBuckets(unittest.TestCase):
+    """Test Cases for the per-client token buckets"""
+
+    def test_burst_and_refill(self):
+        """A client can spend its burst at once, then the refill rate"""
+        buckets = TokenBuckets(rate=2, burst=10)
+        self.assertEqual(buckets.take("a", 5, now=0.0), (True, 5, 0.0))
+        self.assertEqual(buckets.take("a", 5, now=0.0), (True, 0, 0.0))
+        allowed, tokens, wait = buckets.take("a", 5, now=1.0)
+        self.assertFalse(allowed)
+        self.assertEqual((tokens, wait), (2, 1.5))
+        self.assertTrue(buckets.take("a", 5, now=2.5)[0])
+        self.assertEqual(buckets.take("a", 1, now=100.0)[1], 9)  # capped at the burst
+
+    def test_clients_are_separate(self):
+        """Each client has its own bucket, and the least recent are evicted"""
+        buckets = TokenBuckets(rate=1, burst=1, max_clients=2)
+        self.assertTrue(buckets.take("a", 1, now=0.0)[0])
+        self.assertFalse(buckets.take("a", 1, now=0.0)[0])
+        self.assertTrue(buckets.take("b", 1, now=0.0)[0])
+        self.assertTrue(buckets.take("c", 1, now=0.0)[0])
+        self.assertTrue(buckets.take("a", 1, now=0.0)[0])  # evicted, so full again
+
+    def test_retry_after(self):
+        """Retry-After is given in whole seconds"""
+        self.assertEqual([retry_after(s) for s in (0.0, 0.2, 1.0, 1.5)], [1, 1, 1, 2])
+
+    def test_worker_share(self):
+        """Each worker gets its share of the limit, but room for the largest cost"""
+        config = {"RATE_LIMIT_RATE": 30, "RATE_LIMIT_BURST": 120, "RATE_LIMIT_COSTS": {},
+                  "CACHE_WORKERS": 3}
+        self.assertEqual(worker_share(config), (10, 40))
+        config.update(CACHE_WORKERS=12)
+        self.assertEqual(worker_share(config), (2.5, 20))  # export_items costs 20
+        config.update(CACHE_WORKERS=1)
+        self.assertEqual(worker_share(config), (30, 120))
+
+    def test_client_key(self):
+        """Only known API keys get their own bucket, behind trusted proxies"""
+        app = create_app({"RATE_LIMIT_API_KEYS": {"known"}, "PROXY_FIX_X_FOR": 1})
+        keys = []
+
+        @app.route("/client-key")
+        def _client_key():
+            keys.append(client_key(app.config))
+            return ""
+
+        client = app.test_client()
+        for api_key in ("known", "made-up"):
+            client.get("/client-key", headers={"X-API-Key": api_key,
+                                               "X-Forwarded-For": "203.0.113.7"})
+        client.get("/client-key")
+        self.assertEqual(keys, ["key:known", "addr:203.0.113.7", "addr:127.0.0.1"])